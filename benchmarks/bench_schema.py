@@ -0,0 +1,233 @@
+"""
+End to end benchmark of the test schema against a local Postgres.
+
+Creates the databases of test/test_data/sql.py, fills the author,
+movie, country, director and old_fruits tables with synthetic rows
+and runs the transformers of test/test_data/transformers.py over them.
+Every scenario runs in a process of its own and records rows/s,
+peak RSS and the number of queries issued by Manager. Results are
+written to a JSON baseline which later runs can be compared to.
+
+Requires the DATABASE_USER and DATABASE_PASSWORD of the tests
+in the environment or a .env file.
+
+    python benchmarks/bench_schema.py --scale 100000 --output baseline.json
+    python benchmarks/bench_schema.py --scale 100000 --compare baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.reshaper.identity import IdentityMap
+from src.reshaper.runner import Runner
+from test.test_data import transformers
+from test.test_data.sql import DBWrapper
+
+# Rows generated and loaded with COPY at a time
+LOAD_CHUNK = 100000
+
+SCENARIOS = [
+    {'name': 'country', 'transformer': 'CountryTransformer', 'options': {}},
+    {'name': 'director', 'transformer': 'DirectorTransformer', 'options': {}},
+    {'name': 'director_prefetch', 'transformer': 'DirectorTransformer', 'options': {'prefetch': 1000}},
+    {'name': 'movie', 'transformer': 'MovieTransformer', 'options': {}},
+    {'name': 'movie_batched', 'transformer': 'MovieTransformer', 'options': {'batch_size': 500, 'prefetch': 1000}},
+    {'name': 'movie_identity', 'transformer': 'MovieTransformer', 'options': {'batch_size': 500}, 'identity': True},
+    {'name': 'fruit', 'transformer': 'FruitTransformer', 'options': {'batch_size': 500}},
+]
+
+DESTINATION_TABLES = [
+    'new_fruits', 'fruit_owner', 'new_director', 'new_country',
+    'movie_author', 'new_movie', 'new_author'
+]
+
+FRUITS = ['Apple', 'Orange', 'Banana', 'Pear', 'Plum', 'Cherry', 'Mango']
+
+def load(db, table, columns, rows):
+    """
+    Load generated rows into a table with COPY, LOAD_CHUNK rows at a time
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= LOAD_CHUNK:
+            db.copy_rows(table, columns, chunk)
+            chunk = []
+    if chunk:
+        db.copy_rows(table, columns, chunk)
+
+def generate(db, scale, fanout, countries, owners, seed=0):
+    """
+    Fill the source tables with synthetic rows
+
+    :param DB db: Source database
+    :param int scale: Number of movies, directors and fruits
+    :param int fanout: Number of movies per author
+    :param int countries: Number of distinct countries
+    :param int owners: Number of distinct fruit owners
+    :param int seed: Seed of the random generator
+    """
+    rand = random.Random(seed)
+    authors = max(1, scale // fanout)
+    load(db, 'author', ('name', 'age'), (
+        ('Author %i' % n, rand.randint(20, 90)) for n in range(authors)
+    ))
+    load(db, 'movie', ('title', 'author_id'), (
+        ('Movie %i' % n, rand.randint(1, authors)) for n in range(scale)
+    ))
+    load(db, 'country', ('name',), (
+        ('Country %i' % n,) for n in range(countries)
+    ))
+    load(db, 'director', ('name', 'country_id'), (
+        ('Director %i' % n, rand.randint(1, countries)) for n in range(scale)
+    ))
+    load(db, 'old_fruits', ('fruit', 'owner'), (
+        (rand.choice(FRUITS), 'Owner %i' % rand.randint(1, owners))
+        for n in range(scale)
+    ))
+    with db.cursor() as cur:
+        cur.execute('ANALYZE')
+
+def truncate(db):
+    """
+    Empty the destination tables so every scenario starts out the same
+    """
+    with db.cursor() as cur:
+        cur.execute(
+            'TRUNCATE %s RESTART IDENTITY CASCADE' % ', '.join(DESTINATION_TABLES)
+        )
+
+def run_scenario(source_db, destination_db, scenario):
+    """
+    Entry point of the process running a single scenario
+
+    :return: Dictionary of rows, seconds, rows/s, peak RSS and queries
+    """
+    identity = IdentityMap() if scenario.get('identity') else None
+    runner = Runner(
+        source_db, destination_db, identity=identity, metrics=True
+    )
+    transformer = getattr(transformers, scenario['transformer'])()
+
+    start = time.time()
+    count = runner.run(transformer, **scenario['options'])
+    seconds = time.time() - start
+
+    stats = runner.metrics.stats()
+    return {
+        'rows': count,
+        'seconds': seconds,
+        'rows_per_second': count / seconds if seconds else 0,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'queries': sum(
+            transformer_stats['counts'].get('queries', 0)
+            for transformer_stats in stats.values()
+        )
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change of every scenario against a baseline
+
+    :return: Names of scenarios whose rows/s dropped by more than tolerance
+    """
+    regressions = []
+    print('%-20s %12s %12s %8s %10s %10s' % (
+        'Scenario', 'Rows/s', 'Baseline', 'Change', 'RSS MB', 'Queries'
+    ))
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        change = result['rows_per_second'] / before['rows_per_second'] - 1\
+            if before['rows_per_second'] else 0
+        if change < -tolerance:
+            regressions.append(name)
+        print('%-20s %12.0f %12.0f %+7.1f%% %10.1f %10i' % (
+            name,
+            result['rows_per_second'],
+            before['rows_per_second'],
+            change * 100,
+            result['peak_rss_mb'],
+            result['queries']
+        ))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, default=10000, help='Number of movies, directors and fruits')
+    parser.add_argument('--fanout', type=int, default=10, help='Number of movies per author')
+    parser.add_argument('--countries', type=int, default=200, help='Number of distinct countries')
+    parser.add_argument('--owners', type=int, default=1000, help='Number of distinct fruit owners')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', help='Only run these scenarios')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Compare results to this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Largest accepted drop of rows/s')
+    args = parser.parse_args()
+
+    scenarios = [
+        scenario for scenario in SCENARIOS
+        if not args.scenario or scenario['name'] in args.scenario
+    ]
+
+    wrapper = DBWrapper()
+    wrapper.connect()
+    try:
+        start = time.time()
+        generate(
+            wrapper.source_db(),
+            args.scale,
+            args.fanout,
+            args.countries,
+            args.owners,
+            args.seed
+        )
+        print('Generated source rows in %.1fs' % (time.time() - start))
+
+        results = {
+            'settings': {
+                'scale': args.scale,
+                'fanout': args.fanout,
+                'countries': args.countries,
+                'owners': args.owners,
+                'seed': args.seed
+            },
+            'scenarios': {}
+        }
+        # A process per scenario so peak RSS is its own
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            for scenario in scenarios:
+                truncate(wrapper.destination_db())
+                results['scenarios'][scenario['name']] = pool.apply(
+                    run_scenario,
+                    (wrapper.source_db(), wrapper.destination_db(), scenario)
+                )
+    finally:
+        wrapper.destroy()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['settings'] != results['settings']:
+            print('Baseline was recorded with other settings: %s' % baseline['settings'])
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('Regressed: %s' % ', '.join(regressions))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
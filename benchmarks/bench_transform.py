@@ -0,0 +1,66 @@
+"""
+Micro-benchmark of the per-row transform path.
+
+Transforms rows of a 30 column source table with a transformer
+declaring a TransformerField per column, a third of them filtered,
+against a destination that only hands out ids, and prints rows/s.
+
+    python benchmarks/bench_transform.py [rows]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.reshaper.manager import Manager
+from src.reshaper.transformers import *
+
+COLUMNS = 30
+
+class IdDB:
+    """
+    Destination that accepts every insert
+    without storing it and returns increasing ids
+    """
+    def __init__(self):
+        self.pk = 0
+
+    def insert_single(self, table, row):
+        self.pk += 1
+        return {'id': self.pk}
+
+def build_transformer():
+    attrs = {}
+    for i in range(COLUMNS):
+        filters = [str.upper] if i % 3 == 0 else []
+        attrs['column_%i' % i] = TransformerField(
+            'source_%i' % i, filters=filters
+        )
+
+    class Meta:
+        source_table = 'wide'
+        destination_table = 'new_wide'
+    attrs['Meta'] = Meta
+    attrs['__module__'] = __name__
+    return TransformerMeta('WideTransformer', (Transformer,), attrs)
+
+def main(rows=100000):
+    transformer = build_transformer()()
+    manager = Manager(destination_db=IdDB())
+    source = [
+        dict(('source_%i' % i, 'value %i %i' % (n, i)) for i in range(COLUMNS))
+        for n in range(1000)
+    ]
+
+    start = time.time()
+    for n in range(rows):
+        manager.transform(transformer, source[n % len(source)])
+    elapsed = time.time() - start
+
+    print('%i rows of %i columns in %.2fs, %.0f rows/s' % (
+        rows, COLUMNS, elapsed, rows / elapsed
+    ))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
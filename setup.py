@@ -62,7 +62,8 @@ setup(
         'progressbar2==2.7.3'
     ],
     extras_require={
-        # eg: 'rst': ['docutils>=0.11'],
+        # reshaper.backends.psycopg3
+        'psycopg': ['psycopg>=3.1'],
     },
     entry_points={
         'console_scripts': [
@@ -0,0 +1,542 @@
+# Clauses of the conflict policies of insert_rows
+CONFLICT = {
+    'error': '',
+    'ignore': ' ON CONFLICT DO NOTHING'
+}
+
+class BaseDB:
+    """
+    Methods shared by the database backends. A backend sets
+    placeholder to the parameter marker of its driver and
+    implements cursor, begin, commit, end, insert_batch,
+    insert_rows and copy_rows.
+
+    Statements are built once per key and kept in statements,
+    a backend preparing them itself overrides execute.
+    """
+    # Parameter marker of the driver
+    placeholder = '%s'
+
+    def __getstate__(self):
+        # Connections can not be shared between processes,
+        # a DB passed to another process connects again
+        return self.settings
+
+    def __setstate__(self, settings):
+        self.__init__(**settings)
+
+    def param(self, n):
+        """
+        Returns the marker of parameter n, counted from 1,
+        in statements passed to execute
+        """
+        return self.placeholder
+
+    def escape(self, query):
+        """
+        Escape a query spliced into a statement taking parameters
+        """
+        if self.placeholder == '%s':
+            return query.replace('%', '%%')
+        return query
+
+    def statement(self, key, build):
+        """
+        Returns the SQL of a statement, built once per key
+
+        :param tuple key: Key of statement, such as (table, column signature)
+        :param function build: Called with no arguments to build the statement on a miss
+        """
+        query = self.statements.get(key)
+        if query is not None:
+            self.statement_hits += 1
+            return query
+        self.statement_misses += 1
+        query = self.statements[key] = build()
+        return query
+
+    def execute(self, cur, key, build, params=()):
+        """
+        Execute a statement built once per key
+
+        :param cursor cur: Cursor to execute the statement with
+        :param tuple key: Key of statement, such as (table, column signature)
+        :param function build: Called with no arguments to build the statement on a miss
+        :param list params: Values of the parameters of the statement
+        """
+        cur.execute(self.statement(key, build), params)
+
+    def statement_stats(self):
+        """
+        Returns number of statements, hits, misses
+        and hit rate of the statement cache as a dictionary
+        """
+        lookups = self.statement_hits + self.statement_misses
+        return {
+            'prepared': len(self.statements),
+            'hits': self.statement_hits,
+            'misses': self.statement_misses,
+            'hit_rate': self.statement_hits / lookups if lookups else 0
+        }
+
+    def get_table_row_count(self, table, query=''):
+        with self.cursor() as cur:
+            cur.execute(
+                """ SELECT COUNT(*) AS count FROM %s %s""" % (table, query)
+            )
+            return cur.fetchone().get('count')
+
+    def savepoint(self, name='row'):
+        with self.cursor() as cur:
+            cur.execute('SAVEPOINT %s' % name)
+
+    def release_savepoint(self, name='row'):
+        with self.cursor() as cur:
+            cur.execute('RELEASE SAVEPOINT %s' % name)
+
+    def rollback_to_savepoint(self, name='row'):
+        """
+        Undo everything done since savepoint name was set,
+        the rest of the transaction is kept
+        """
+        with self.cursor() as cur:
+            cur.execute('ROLLBACK TO SAVEPOINT %s' % name)
+
+    def get_id_bounds(self, table):
+        """
+        Returns the lowest and highest id of a table as a tuple,
+        (None, None) if the table is empty
+
+        :param str table: Name of table in database
+        """
+        with self.cursor() as cur:
+            try:
+                cur.execute(
+                    """ SELECT MIN(id) AS low, MAX(id) AS high FROM %s """ % table
+                )
+                row = cur.fetchone()
+                return row.get('low'), row.get('high')
+            except Exception:
+                raise Exception('Could not query id bounds of table %s' % table)
+
+    def get_id_percentiles(self, table, parts):
+        """
+        Returns the ids splitting a table into parts
+        with roughly the same number of rows each
+
+        :param str table: Name of table in database
+        :param int parts: Number of parts
+        :return: A list of parts - 1 ids
+        """
+        count = self.get_table_row_count(table)
+        ids = []
+        with self.cursor() as cur:
+            try:
+                for i in range(1, parts):
+                    cur.execute(
+                        """ SELECT id FROM %s ORDER BY id LIMIT 1 OFFSET %s """ % (
+                            table, self.placeholder
+                        ),
+                        (max(int(count * i / parts) - 1, 0),)
+                    )
+                    row = cur.fetchone()
+                    if row:
+                        ids.append(row.get('id'))
+            except Exception:
+                raise Exception('Could not query id percentiles of table %s' % table)
+        return ids
+
+    def get_table_row_estimate(self, table):
+        """
+        Returns the row count of a table, backends
+        keeping row estimates return those instead
+
+        :param str table: Name of table in database
+        """
+        return self.get_table_row_count(table)
+
+    def stream(self, query, itersize=2000, name='reshaper_stream'):
+        """
+        Iterate over the results of a query,
+        fetching itersize rows at a time
+
+        :param str query: SQL query to run
+        :param int itersize: Number of rows fetched at a time
+        :param str name: Name of the server-side cursor of backends using one
+        :return: A generator of rows
+        """
+        with self.cursor() as cur:
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+
+    def build_keyset(self, table, order_by, query='', after=False, columns=None):
+        """
+        Build a select of one page of rows ordered by the columns
+        of order_by, continuing after a key with a row-value
+        comparison. Takes the key values and the page size
+        as parameters.
+
+        :param str table: Name of table in database
+        :param tuple order_by: Columns identifying and ordering rows
+        :param str query: Extra query appended to the select of the table
+        :param boolean after: Start after a key instead of with the first row
+        :param tuple columns: Columns to select, None selects all of them
+        """
+        select = ','.join(columns) if columns else '*'
+        columns = ','.join(order_by)
+        if query:
+            build = 'SELECT * FROM (SELECT %s FROM %s %s) AS page' % (
+                select, table, self.escape(query)
+            )
+        else:
+            build = 'SELECT %s FROM %s' % (select, table)
+        if after:
+            build += ' WHERE (%s) > (%s)' % (
+                columns, ','.join([self.placeholder] * len(order_by))
+            )
+        return build + ' ORDER BY %s LIMIT %s' % (columns, self.placeholder)
+
+    def keyset(self, table, order_by, size=1000, after=None, query='', columns=None):
+        """
+        Iterate over the rows of a table in pages of size rows ordered
+        by the columns of order_by. Every page is a query of its own
+        starting after the key of the last row of the previous page,
+        so each page can use an index on order_by and reading can
+        resume after any key. The columns of order_by must be
+        unique together and not null.
+
+        :param str table: Name of table in database
+        :param tuple order_by: Columns identifying and ordering rows
+        :param int size: Number of rows in a page
+        :param tuple after: Key to start after, None starts with the first row
+        :param str query: Extra query appended to the select of the table
+        :param tuple columns: Columns to select, None selects all of them
+        :return: A generator of rows
+        """
+        while True:
+            with self.cursor() as cur:
+                try:
+                    cur.execute(
+                        self.build_keyset(
+                            table, order_by, query, after is not None, columns
+                        ),
+                        list(after or ()) + [size]
+                    )
+                    rows = cur.fetchall()
+                except Exception:
+                    raise Exception('Could not query page of table %s' % table)
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                return
+            after = tuple(rows[-1][column] for column in order_by)
+
+    def get_table_rows(self, table):
+        """
+        Get all rows of a table in database
+        :param str table: Name of table in database
+        :return: A list of rows
+        """
+        with self.cursor() as cur:
+            try:
+                cur.execute(
+                    """ SELECT * FROM %s """ % table
+                )
+                return cur.fetchall()
+            except Exception:
+                raise Exception('Query for table %s failed' % table)
+
+    def get_row_from_pk(self, table, pk, columns=None):
+        """
+        Fetch a row from database table based on id
+        :param str table: Name of table in database
+        :param str pk: id of row in database
+        :param tuple columns: Columns to select, None selects all of them
+        :return: A dictionary with column name:value from the row containing the id passed in
+        """
+        with self.cursor() as cur:
+            try:
+                self.execute(
+                    cur,
+                    ('pk', table, columns),
+                    lambda: 'SELECT %s FROM %s WHERE id=%s' % (
+                        ','.join(columns) if columns else '*', table, self.param(1)
+                    ),
+                    [pk]
+                )
+                return cur.fetchone()
+            except Exception:
+                raise Exception('Could not query id: %s from table: %s' % (pk, table))
+
+    def get_rows_from_pks(self, table, pks, columns=None):
+        """
+        Fetch multiple rows from database table, 500 ids per query
+        :param str table: Name of table in database
+        :param list pks: ids of rows in database
+        :param tuple columns: Columns to select, None selects all of them
+        :return: A dictionary of id:row for every id found
+        """
+        pks = list(pks)
+        rows = {}
+        with self.cursor() as cur:
+            try:
+                for start in range(0, len(pks), 500):
+                    part = pks[start:start + 500]
+                    cur.execute(
+                        """ SELECT %s FROM %s WHERE id IN (%s) """ % (
+                            ','.join(columns) if columns else '*',
+                            table,
+                            ','.join([self.placeholder] * len(part))
+                        ),
+                        part
+                    )
+                    for row in cur.fetchall():
+                        rows[row.get('id')] = row
+            except Exception:
+                raise Exception('Could not query ids from table: %s' % table)
+        return rows
+
+    def get_row_from_field(self, table, field_name, value):
+        """
+        Gets a row from table where field is equal to value.
+        This function will fail as soon as there are more then one value
+        that could match the value passed in. If fetching a single vaue
+        from a primary key use get_row_from_pk instead
+        """
+        with self.cursor() as cur:
+            try:
+                self.execute(
+                    cur,
+                    ('field', table, field_name),
+                    lambda: 'SELECT * FROM %s WHERE %s=%s' % (
+                        table, field_name, self.param(1)
+                    ),
+                    [value]
+                )
+                return cur.fetchone()
+            except Exception:
+                raise Exception("get_row_from_field: query error")
+
+    def get_pk_from_field(self, table, field_name, value):
+        """
+        Return the primary key where field value matches
+        """
+        return self.get_row_from_field(table, field_name, value).get('pk')
+
+    def build_single(self, table, columns):
+        """
+        Build an INSERT statement for a single row,
+        to be passed to execute
+
+        :param str table: Name of table in database
+        :param tuple columns: Column names of the row
+        """
+        if not columns:
+            return 'INSERT INTO %s DEFAULT VALUES' % table
+        return 'INSERT INTO %s (%s) VALUES (%s)' % (
+            table,
+            ','.join(columns),
+            ','.join(self.param(n + 1) for n in range(len(columns)))
+        )
+
+    def build_upsert(self, columns, key):
+        """
+        Build the ON CONFLICT clause updating every column but
+        those of key when a row with the same key already exists
+
+        :param tuple columns: Column names of the row
+        :param tuple key: Columns of a unique constraint of the table
+        """
+        update = [column for column in columns if column not in key] or list(key)
+        return ' ON CONFLICT (%s) DO UPDATE SET %s' % (
+            ','.join(key),
+            ','.join('%s=EXCLUDED.%s' % (column, column) for column in update)
+        )
+
+    def build_many(self, table, values):
+        """
+        Build s SQL which enables bulk loading values from
+        a list of dictionaries
+
+        :param str table: Name of table in database
+        :param list values: List of dictionaries
+        """
+        keys = list(values[0].keys())
+        return 'INSERT INTO %s (%s) VALUES (%s)' % (
+            table,
+            ','.join(keys),
+            ','.join('%%(%s)s' % key for key in keys)
+        )
+
+    def group_rows(self, rows, nulls=False):
+        """
+        Group rows by the columns they set, leaving out
+        columns with a value of None like insert_single
+
+        :param list rows: List of dictionaries
+        :param boolean nulls: Keep columns with a value of None
+        :return: Dictionary of column names:list of row indexes
+        """
+        groups = {}
+        for index, row in enumerate(rows):
+            if nulls:
+                columns = tuple(row.keys())
+            else:
+                columns = tuple(
+                    key for key, value in row.items() if value != None
+                )
+            groups.setdefault(columns, []).append(index)
+        return groups
+
+    def insert_single(self, table, row, key=None):
+        """
+        Insert a single row
+
+        :param str table: Name of db table to insert values into
+        :param dict row: Dictionary containing values to insert
+        :param tuple key: Columns of a unique constraint, a row with the same key is updated instead, columns with a value of None included
+        :return: pk of the row inserted as {id : pk}
+        """
+        if key:
+            columns = tuple(row.keys())
+            upsert = self.build_upsert(columns, key)
+        else:
+            columns = tuple(
+                column for column, value in row.items() if value != None
+            )
+            upsert = ''
+        with self.cursor() as cur:
+            try:
+                self.execute(
+                    cur,
+                    ('insert', table, columns, key),
+                    lambda: self.build_single(table, columns) + upsert + ' RETURNING id',
+                    [row[column] for column in columns]
+                )
+                return cur.fetchone()
+            except Exception:
+                raise Exception('Could not insert data %s into %s' % (row, table))
+
+    def insert_many(self, table, rows):
+        """
+        Insert multiple rows into database
+
+        :param str table: Name of table in database
+        :param list rows: List of dictionaries with values to insert into each row
+        """
+        build_query = self.build_many(table, rows)
+        with self.cursor() as cur:
+            try:
+                cur.executemany(build_query, rows)
+            except Exception:
+                raise Exception('Could not bulk insert')
+
+    def add_relation(self, table, pk_rel, pk_trans):
+        with self.cursor() as cur:
+            try:
+                self.execute(
+                    cur,
+                    ('relation', table),
+                    lambda: 'INSERT INTO %s VALUES(%s, %s)' % (
+                        table, self.param(1), self.param(2)
+                    ),
+                    [pk_rel, pk_trans]
+                )
+            except Exception:
+                raise Exception('Failed to add relation')
+
+
+class PostgresDB(BaseDB):
+    """
+    Methods shared by the psycopg2 and psycopg 3 backends
+    """
+    def begin(self):
+        """
+        Leave autocommit mode, statements run in a single
+        transaction until commit is called
+        """
+        self.conn.autocommit = False
+
+    def commit(self):
+        """
+        Commit the current transaction
+        """
+        self.conn.commit()
+
+    def end(self, commit=True):
+        """
+        Commit or roll back the current transaction
+        and return to autocommit mode
+        """
+        if commit:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.autocommit = True
+
+    def get_id_percentiles(self, table, parts):
+        """
+        Returns the ids splitting a table into parts
+        with roughly the same number of rows each
+
+        :param str table: Name of table in database
+        :param int parts: Number of parts
+        :return: A list of parts - 1 ids
+        """
+        fractions = [float(i) / parts for i in range(1, parts)]
+        with self.cursor() as cur:
+            try:
+                cur.execute(
+                    """ SELECT percentile_disc(%%s::float8[]) WITHIN GROUP (ORDER BY id) AS ids FROM %s """ % table,
+                    (fractions,)
+                )
+                return cur.fetchone().get('ids') or []
+            except Exception:
+                raise Exception('Could not query id percentiles of table %s' % table)
+
+    def get_table_row_estimate(self, table):
+        """
+        Estimate the number of rows in a table from the planner
+        statistics in pg_class instead of running COUNT(*).
+        Falls back to get_table_row_count if the table
+        has never been analyzed.
+
+        :param str table: Name of table in database
+        """
+        with self.cursor() as cur:
+            try:
+                cur.execute(
+                    """ SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = %s::regclass """,
+                    (table,)
+                )
+                estimate = cur.fetchone().get('estimate')
+            except Exception:
+                raise Exception('Could not estimate row count of table %s' % table)
+        if estimate is None or estimate < 0:
+            return self.get_table_row_count(table)
+        return estimate
+
+    def get_rows_from_pks(self, table, pks, columns=None):
+        """
+        Fetch multiple rows from database table with a single query
+        :param str table: Name of table in database
+        :param list pks: ids of rows in database
+        :param tuple columns: Columns to select, None selects all of them
+        :return: A dictionary of id:row for every id found
+        """
+        with self.cursor() as cur:
+            try:
+                cur.execute(
+                    """ SELECT %s FROM %s WHERE id = ANY(%%s) """ % (
+                        ','.join(columns) if columns else '*', table
+                    ),
+                    (list(pks),)
+                )
+                return dict((row.get('id'), row) for row in cur.fetchall())
+            except Exception:
+                raise Exception('Could not query ids from table: %s' % table)
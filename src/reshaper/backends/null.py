@@ -0,0 +1,176 @@
+class DB:
+    """
+    Destination that accepts every write without storing it,
+    for dry runs measuring how fast reshaper transforms rows
+    on its own and for validating transformers before
+    they touch a real database.
+
+    Inserted rows get synthetic primary keys, increasing
+    by one per table. Lookups find nothing and transactions
+    and savepoints do nothing. With stats=True the number of
+    rows and the null count, minimum and maximum of every
+    column written are kept per table.
+    """
+    def __init__(self, stats=False):
+        """
+        :param boolean stats: Keep row counts and column statistics
+        """
+        self.settings = {'stats': stats}
+        self.keep_stats = stats
+        # Last primary key handed out per table
+        self.ids = {}
+        self.rows = {}
+        self.columns = {}
+
+    def __getstate__(self):
+        return self.settings
+
+    def __setstate__(self, settings):
+        self.__init__(**settings)
+
+    def next_id(self, table):
+        pk = self.ids.get(table, 0) + 1
+        self.ids[table] = pk
+        return pk
+
+    def record(self, table, row):
+        """
+        Count a row written to table and add its
+        values to the statistics of its columns
+
+        :param str table: Name of table
+        :param dict row: Dictionary of column name:value
+        """
+        self.rows[table] = self.rows.get(table, 0) + 1
+        if not self.keep_stats:
+            return
+        columns = self.columns.setdefault(table, {})
+        for column, value in row.items():
+            # [values, nulls, min, max]
+            stats = columns.get(column)
+            if stats is None:
+                stats = columns[column] = [0, 0, None, None]
+            if value is None:
+                stats[1] += 1
+                continue
+            stats[0] += 1
+            try:
+                if stats[2] is None or value < stats[2]:
+                    stats[2] = value
+                if stats[3] is None or value > stats[3]:
+                    stats[3] = value
+            except TypeError:
+                # Values of mixed types have no order
+                pass
+
+    def stats(self):
+        """
+        Returns the rows written to every table and the statistics
+        of their columns as {table: {'rows': n, 'columns':
+        {column: {'values', 'nulls', 'min', 'max'}}}}
+        """
+        stats = {}
+        for table, rows in self.rows.items():
+            stats[table] = {'rows': rows, 'columns': {}}
+            for column, values in self.columns.get(table, {}).items():
+                stats[table]['columns'][column] = {
+                    'values': values[0],
+                    'nulls': values[1],
+                    'min': values[2],
+                    'max': values[3]
+                }
+        return stats
+
+    def report(self):
+        """
+        Print rows written to every table and, with
+        stats=True, the statistics of their columns
+        """
+        stats = self.stats()
+        for table in sorted(stats):
+            print('%s - %i rows' % (table, stats[table]['rows']))
+            columns = stats[table]['columns']
+            for column in sorted(columns):
+                print('    %-30s %10i values %10i nulls  min: %.30r  max: %.30r' % (
+                    column,
+                    columns[column]['values'],
+                    columns[column]['nulls'],
+                    columns[column]['min'],
+                    columns[column]['max']
+                ))
+
+    def statement_stats(self):
+        return {'prepared': 0, 'hits': 0, 'misses': 0, 'hit_rate': 0}
+
+    def get_table_row_count(self, table, query=''):
+        return self.rows.get(table, 0)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def end(self, commit=True):
+        pass
+
+    def savepoint(self, name='row'):
+        pass
+
+    def release_savepoint(self, name='row'):
+        pass
+
+    def rollback_to_savepoint(self, name='row'):
+        pass
+
+    def get_table_rows(self, table):
+        return []
+
+    def get_row_from_pk(self, table, pk, columns=None):
+        return None
+
+    def get_rows_from_pks(self, table, pks, columns=None):
+        return {}
+
+    def get_row_from_field(self, table, field_name, value):
+        return None
+
+    def insert_single(self, table, row, key=None):
+        """
+        Accept a single row
+
+        :param str table: Name of db table
+        :param dict row: Dictionary containing values to insert
+        :return: Synthetic pk of the row as {id : pk}
+        """
+        self.record(table, row)
+        return {'id': self.next_id(table)}
+
+    def insert_batch(self, table, rows, key=None):
+        """
+        Accept multiple rows
+
+        :param str table: Name of db table
+        :param list rows: List of dictionaries containing values to insert
+        :return: List of {id : pk} in the same order as rows
+        """
+        return [self.insert_single(table, row) for row in rows]
+
+    def insert_rows(self, table, rows, conflict='error'):
+        for row in rows:
+            self.record(table, row)
+            self.next_id(table)
+        return len(rows)
+
+    def copy_rows(self, table, columns, rows):
+        for row in rows:
+            self.record(table, dict(zip(columns, row)))
+            self.next_id(table)
+        return len(rows)
+
+    def insert_many(self, table, rows):
+        for row in rows:
+            self.insert_single(table, row)
+
+    def add_relation(self, table, pk_rel, pk_trans):
+        self.rows[table] = self.rows.get(table, 0) + 1
@@ -1,17 +1,35 @@
+import io
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import re
+import threading
+import time
+import weakref
+from .base import CONFLICT, PostgresDB
 
-class DB:
+# Largest number of rows in a single prepared multi-row insert
+BATCH_ROWS = 128
+
+class DB(PostgresDB):
     """
     psycopg2 client
 
     """
     def __init__(self, dbName=None, dbUser=None, dbPass=None, host="localhost"):
+        self.settings = {
+            'dbName': dbName,
+            'dbUser': dbUser,
+            'dbPass': dbPass,
+            'host': host
+        }
+        self.dsn = "dbname='%s' user='%s' password='%s' host='%s'" % (dbName, dbUser, dbPass, host)
+        # Names of prepared statements by connection
+        self.prepared = weakref.WeakKeyDictionary()
+        self.statement_hits = 0
+        self.statement_misses = 0
         try:
-            self.conn = psycopg2.connect(
-                "dbname='%s' user='%s' password='%s' host='%s'" % (dbName, dbUser, dbPass, host)
-            )
+            self.conn = psycopg2.connect(self.dsn)
             self.conn.autocommit = True
         except:
             raise Exception(
@@ -25,154 +43,420 @@ class DB:
         else:
             raise Exception('Connection to database not established')
 
-    def get_table_row_count(self, table, query=''):
-        with self.cursor() as cur:
-            try:
-                cur.execute(
-                    """ SELECT COUNT(*) FROM %s %s""" % (table,query)
-                )
-                return cur.fetchone().get('count')
-            except Exception as e:
-                raise e
+    def param(self, n):
+        """
+        Returns the marker of parameter n of a prepared statement
+        """
+        return '$%i' % n
+
+    def prepare(self, cur, key, build):
+        """
+        Prepare a statement on the connection of cur unless it is
+        already prepared there and return its name. Statements
+        only are parsed and planned once per connection.
 
+        :param cursor cur: Cursor to prepare the statement with
+        :param tuple key: Key of statement, such as (table, column signature)
+        :param function build: Called with no arguments to build the statement on a miss, with $1, $2... as parameters
+        :return: Name of the prepared statement
+        """
+        prepared = self.prepared.get(cur.connection)
+        if prepared is None:
+            prepared = self.prepared.setdefault(cur.connection, {})
+        name = prepared.get(key)
+        if name is not None:
+            self.statement_hits += 1
+            return name
 
+        self.statement_misses += 1
+        name = 'reshaper_%i' % len(prepared)
+        cur.execute('PREPARE %s AS %s' % (name, build()))
+        prepared[key] = name
+        return name
 
-    def get_table_rows(self, table):
+    def execute(self, cur, key, build, params=()):
         """
-        Get all rows of a table in database
-        :param str table: Name of table in database
-        :return: A list of rows 
+        Execute a statement prepared with prepare.
+        Parameters are sent as values typed by the
+        statement instead of being quoted into it.
+
+        :param cursor cur: Cursor to execute the statement with
+        :param tuple key: Key of statement, such as (table, column signature)
+        :param function build: Called with no arguments to build the statement on a miss
+        :param list params: Values of the parameters of the statement
         """
-        with self.cursor() as cur:
-            rows = []
-            try:
-                cur.execute(
-                    """ SELECT * FROM %s """ % table
-                )
-                return cur
-            except Exception:
-                raise Exception('Query for table %s failed' % table)
+        name = self.prepare(cur, key, build)
+        if params:
+            cur.execute(
+                'EXECUTE %s (%s)' % (name, ','.join(['%s'] * len(params))),
+                params
+            )
+        else:
+            cur.execute('EXECUTE %s' % name)
 
-    def get_row_from_pk(self, table, pk):
+    def statement_stats(self):
         """
-        Fetch a row from database table based on id
-        :param str table: Name of table in database
-        :param str pk: id of row in database
-        :return: A dictionary with column name:value from the row containing the id passed in
+        Returns number of prepared statements, hits, misses
+        and hit rate of the statement cache as a dictionary
         """
-        with self.cursor() as cur:
-            try:
-                cur.execute(
-                    """ SELECT * FROM %s WHERE id=%s """ % (table, pk)
-                )
-                return cur.fetchone()
-            except Exception:
-                raise Exception('Could not query id: %s from table: %s' % (pk, table))
-    
-    def get_row_from_field(self, table, field_name, value):
+        lookups = self.statement_hits + self.statement_misses
+        return {
+            'prepared': sum(len(names) for names in self.prepared.values()),
+            'hits': self.statement_hits,
+            'misses': self.statement_misses,
+            'hit_rate': self.statement_hits / lookups if lookups else 0
+        }
+
+    def stream(self, query, itersize=2000, name='reshaper_stream'):
         """
-        Gets a row from table where field is equal to value.
-        This function will fail as soon as there are more then one value
-        that could match the value passed in. If fetching a single vaue
-        from a primary key use get_row_from_pk instead
+        Iterate over the results of a query with a named
+        server-side cursor, fetching itersize rows per round trip.
+        The cursor lives on its own connection so it can hold a
+        transaction open while the main connection keeps autocommitting.
+
+        :param str query: SQL query to run
+        :param int itersize: Number of rows fetched from the server at a time
+        :param str name: Name of the server-side cursor
+        :return: A generator of rows
         """
-        with self.cursor() as cur:
-            try:
-                cur.execute(""" SELECT * FROM %s WHERE %s='%s'""" % (table, field_name, value))
-                return cur.fetchone()
-            except Exception:
-                raise Exception("get_row_from_field: query error")
+        conn = psycopg2.connect(self.dsn)
+        try:
+            with conn.cursor(
+                name, cursor_factory=psycopg2.extras.RealDictCursor
+            ) as cur:
+                cur.itersize = itersize
+                cur.execute(query)
+                for row in cur:
+                    yield row
+        finally:
+            conn.close()
 
-    def get_pk_from_field(self, table, field_name, value):
+    def build_batch(self, table, columns, count):
         """
-        Return the primary key where field value matches
+        Build a multi-row INSERT statement with one group
+        of parameters per row, to be prepared
+
+        :param str table: Name of table in database
+        :param tuple columns: Column names shared by every row
+        :param int count: Number of rows in the statement
         """
-        return self.get_row_from_field(table, field_name, value).get('pk')
+        width = len(columns)
+        build = 'INSERT INTO %s (%s)' % (table, ','.join(columns))
+        build += ' VALUES %s' % ','.join(
+            '(%s)' % ','.join(
+                '$%i' % (row * width + n + 1) for n in range(width)
+            )
+            for row in range(count)
+        )
+        return build
 
-    def build_single(self, table, values):
+    def split_batch(self, count):
         """
-        Build a SQL query out of a single dictionary
+        Split a number of rows into the sizes of the multi-row
+        inserts writing them, BATCH_ROWS at a time and the rest in
+        powers of two, so only a few statements get prepared per
+        column signature whatever the number of rows
 
-        :param str values: Name of table in database
-        :param dict values: Dictionary to build SQL query with
+        :param int count: Number of rows
+        :return: List of sizes adding up to count
         """
-        build = 'INSERT INTO %s ' % table
-        stub_a = '('
-        stub_b = '('
-        for key, value in values.items():
-            if value != None:
-                if isinstance(value, str):
-                    if "'" in value:
-                        value = value.replace("'", "''")
-                else:
-                    value = str(value)
-                stub_a += key + ','
-                stub_b += "'"+ value + "',"
-        stub_a = stub_a[:-1] + ')'
-        stub_b = stub_b[:-1] + ')'
-        build  += stub_a
-        build  += ' VALUES %s' % stub_b
-        return build
+        sizes = [BATCH_ROWS] * (count // BATCH_ROWS)
+        rest = count % BATCH_ROWS
+        size = BATCH_ROWS
+        while rest:
+            size //= 2
+            if rest >= size:
+                sizes.append(size)
+                rest -= size
+        return sizes
 
-    def build_many(self, table, values):
+    def write_batch(self, cur, table, rows, columns, indexes, returning='', conflict=''):
         """
-        Build s SQL which enables bulk loading values from 
-        a list of dictionaries
+        Write rows sharing a column signature with
+        prepared multi-row inserts sized by split_batch
 
-        :param str table: Name of table in database
-        :param list values: List of dictionaries
-        """
-
-        # We need a single set of keys so 
-        # we select the first dictionary
-        vals = values[0]
-        build = 'INSERT INTO %s' % table
-        build += '('
-        value_part = '('
-        for key in vals.keys():
-            build += key + ','
-            value_part += '%'
-            value_part += '(%s)s,' % key
-        value_part = value_part[:-1] + ')'
-        build = build[:-1] + ')'
-        build += ' VALUES %s' % value_part
-        return build
+        :param cursor cur: Cursor to insert with
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries
+        :param tuple columns: Column names set by the rows
+        :param list indexes: Indexes of the rows to write
+        :param str returning: RETURNING clause appended to the statement
+        :param str conflict: ON CONFLICT clause appended to the statement
+        :return: List of returned rows if returning is set
+        """
+        returned = []
+        start = 0
+        for count in self.split_batch(len(indexes)):
+            params = []
+            for index in indexes[start:start + count]:
+                params.extend(rows[index][key] for key in columns)
+            start += count
+            self.execute(
+                cur,
+                ('batch', table, columns, count, conflict + returning),
+                lambda: self.build_batch(table, columns, count) + conflict + returning,
+                params
+            )
+            if returning:
+                returned.extend(cur.fetchall())
+        return returned
 
-    def insert_single(self, table, row):
+    def insert_batch(self, table, rows, key=None):
         """
-        Insert a single row
+        Insert multiple rows with a single INSERT ... RETURNING id
+        statement per column signature. Like insert_single, columns
+        with a value of None are left out of the row.
 
         :param str table: Name of db table to insert values into
-        :param dict row: Dictionary containing values to insert
-        :return: pk of the row inserted as {id : pk}
+        :param list rows: List of dictionaries containing values to insert
+        :param tuple key: Columns of a unique constraint, a row with the same key is updated instead, columns with a value of None included
+        :return: List of {id : pk} in the same order as rows
         """
-        build  = self.build_single(table, row)
-        build += ' RETURNING id'
+        results = [None] * len(rows)
         with self.cursor() as cur:
-            try:
-                cur.execute(build)
-                pk = cur.fetchone()
-                return pk
-            except Exception:
-                raise Exception('Could not insert data %s' % build )
+            for columns, indexes in self.group_rows(rows, bool(key)).items():
+                try:
+                    if columns:
+                        returned = self.write_batch(
+                            cur, table, rows, columns, indexes, ' RETURNING id',
+                            self.build_upsert(columns, key) if key else ''
+                        )
+                    else:
+                        returned = []
+                        for index in indexes:
+                            cur.execute(
+                                'INSERT INTO %s DEFAULT VALUES RETURNING id' % table
+                            )
+                            returned.append(cur.fetchone())
+                except Exception:
+                    raise Exception('Could not batch insert into %s' % table)
+                for index, pk in zip(indexes, returned):
+                    results[index] = pk
+        return results
 
-    def insert_many(self, table, rows):
+    def insert_rows(self, table, rows, conflict='error'):
         """
-        Insert multiple rows into database
+        Insert rows without returning their primary keys,
+        for rows nothing refers to such as relation rows.
+        Like insert_single, columns with a value of None
+        are left out of the row.
 
-        :param str table: Name of table in database
-        :param list rows: List of dictionaries with values to insert into each row
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries containing values to insert
+        :param str conflict: error fails on a unique violation, ignore skips rows that already exist
+        :return: Number of rows inserted
         """
-        build_query = self.build_many(table, rows)
+        if conflict not in CONFLICT:
+            raise Exception('Unknown conflict policy: %s' % conflict)
+        clause = CONFLICT[conflict]
         with self.cursor() as cur:
-            try:
-                cur.executemany(build_query, rows)
-            except Exception:
-                raise Exception('Could not bulk insert')
+            for columns, indexes in self.group_rows(rows).items():
+                try:
+                    if columns:
+                        self.write_batch(
+                            cur, table, rows, columns, indexes, conflict=clause
+                        )
+                    else:
+                        for index in indexes:
+                            cur.execute(
+                                'INSERT INTO %s DEFAULT VALUES%s' % (table, clause)
+                            )
+                except Exception:
+                    raise Exception('Could not insert rows into %s' % table)
+        return len(rows)
+
+    def copy_value(self, value):
+        """
+        Format a single value for the COPY text format
+        """
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return '\\\\x' + bytes(value).hex()
+        return str(value)\
+            .replace('\\', '\\\\')\
+            .replace('\t', '\\t')\
+            .replace('\n', '\\n')\
+            .replace('\r', '\\r')
+
+    def copy_rows(self, table, columns, rows):
+        """
+        Bulk load rows with COPY ... FROM STDIN, streamed
+        from an in-memory buffer. No primary keys are returned
+        so this is only useful for rows nothing else refers to.
+
+        :param str table: Name of db table to load values into
+        :param tuple columns: Column names, in the same order as the values of each row
+        :param list rows: List of sequences containing values to load
+        :return: Number of rows loaded
+        """
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(self.copy_value(value) for value in row))
+            buf.write('\n')
+        buf.seek(0)
 
-    def add_relation(self, table, pk_rel, pk_trans):
         with self.cursor() as cur:
             try:
-                cur.execute(""" INSERT INTO %s VALUES(%s, %s) """ % (table, pk_rel, pk_trans))
+                cur.copy_expert(
+                    'COPY %s (%s) FROM STDIN' % (table, ','.join(columns)),
+                    buf
+                )
             except Exception:
-                raise Exception('Failed to add relation')
+                raise Exception('Could not copy rows into %s' % table)
+        return len(rows)
+
+
+class PooledCursor(psycopg2.extras.RealDictCursor):
+    """
+    Cursor returning its connection to the pool
+    of a PooledDB once it is closed
+    """
+    release = None
+
+    def close(self):
+        try:
+            if not self.closed:
+                super(PooledCursor, self).close()
+        finally:
+            release, self.release = self.release, None
+            if release:
+                release(self.connection)
+
+
+class PooledDB(DB):
+    """
+    psycopg2 client backed by a thread-safe pool of connections.
+    Every cursor borrows a connection from the pool and returns it
+    once closed, so threads can share a PooledDB and keep several
+    statements in flight. A thread that begins a transaction keeps
+    its connection until the transaction ends.
+    """
+    def __init__(
+        self,
+        dbName=None,
+        dbUser=None,
+        dbPass=None,
+        host="localhost",
+        minconn=1,
+        maxconn=10,
+        check_interval=30
+    ):
+        """
+        :param int minconn: Number of connections opened up front
+        :param int maxconn: Maximum number of connections, borrowing blocks while all are in use
+        :param float check_interval: Check a connection with SELECT 1 before use if it has not been checked for check_interval seconds
+        """
+        self.settings = {
+            'dbName': dbName,
+            'dbUser': dbUser,
+            'dbPass': dbPass,
+            'host': host,
+            'minconn': minconn,
+            'maxconn': maxconn,
+            'check_interval': check_interval
+        }
+        self.dsn = "dbname='%s' user='%s' password='%s' host='%s'" % (dbName, dbUser, dbPass, host)
+        self.check_interval = check_interval
+        self.checked = {}
+        self.prepared = weakref.WeakKeyDictionary()
+        self.statement_hits = 0
+        self.statement_misses = 0
+        self.local = threading.local()
+        self.available = threading.BoundedSemaphore(maxconn)
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                minconn, maxconn, self.dsn
+            )
+        except Exception:
+            raise Exception(
+                'Cannot connect to database: %s , user: %s, password: %s' % (dbName, dbUser, dbPass)
+            )
+
+    def healthy(self, conn):
+        """
+        Returns False if a connection is closed or
+        fails its periodic SELECT 1
+        """
+        if conn.closed:
+            return False
+        now = time.time()
+        if now - self.checked.get(id(conn), 0) < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+        self.checked[id(conn)] = now
+        return True
+
+    def getconn(self):
+        """
+        Borrow a healthy connection from the pool, broken
+        connections are discarded and replaced by new ones
+        """
+        self.available.acquire()
+        try:
+            conn = self.pool.getconn()
+            while not self.healthy(conn):
+                self.checked.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            conn.autocommit = True
+            return conn
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, conn):
+        """
+        Return a borrowed connection to the pool
+        """
+        try:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.available.release()
+
+    def cursor(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            return conn.cursor(
+                cursor_factory = psycopg2.extras.RealDictCursor)
+
+        conn = self.getconn()
+        try:
+            cur = conn.cursor(cursor_factory = PooledCursor)
+        except Exception:
+            self.putconn(conn)
+            raise
+        cur.release = self.putconn
+        return cur
+
+    def begin(self):
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = self.getconn()
+        self.local.conn.autocommit = False
+
+    def commit(self):
+        self.local.conn.commit()
+
+    def end(self, commit=True):
+        conn, self.local.conn = self.local.conn, None
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+            conn.autocommit = True
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """
+        Close all connections of the pool
+        """
+        self.pool.closeall()
+
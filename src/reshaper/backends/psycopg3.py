@@ -0,0 +1,174 @@
+import contextlib
+import psycopg
+from psycopg.rows import dict_row
+from .base import CONFLICT, PostgresDB
+
+class DB(PostgresDB):
+    """
+    psycopg 3 client, a drop-in replacement for
+    reshaper.backends.postgresql.DB.
+
+    Parameters are bound server-side and statements executed
+    repeatedly are prepared by psycopg. Independent writes such
+    as batched inserts and relation rows are sent in libpq
+    pipeline mode, without waiting for the reply of each
+    statement before sending the next one.
+    """
+    def __init__(self, dbName=None, dbUser=None, dbPass=None, host="localhost"):
+        self.settings = {
+            'dbName': dbName,
+            'dbUser': dbUser,
+            'dbPass': dbPass,
+            'host': host
+        }
+        self.dsn = "dbname='%s' user='%s' password='%s' host='%s'" % (dbName, dbUser, dbPass, host)
+        # SQL of statements by (table, column signature)
+        self.statements = {}
+        self.statement_hits = 0
+        self.statement_misses = 0
+        try:
+            self.conn = psycopg.connect(
+                self.dsn, autocommit=True, row_factory=dict_row
+            )
+        except Exception:
+            raise Exception(
+                'Cannot connect to database: %s , user: %s, password: %s' % (dbName, dbUser, dbPass)
+            )
+
+    def cursor(self):
+        if self.conn:
+            return self.conn.cursor()
+        else:
+            raise Exception('Connection to database not established')
+
+    def pipeline(self):
+        """
+        Context manager sending the statements run within
+        it in pipeline mode, if libpq supports it
+        """
+        if psycopg.Pipeline.is_supported():
+            return self.conn.pipeline()
+        return contextlib.nullcontext()
+
+    def execute(self, cur, key, build, params=()):
+        """
+        Execute a statement built once per key,
+        prepared by psycopg on the server
+
+        :param cursor cur: Cursor to execute the statement with
+        :param tuple key: Key of statement, such as (table, column signature)
+        :param function build: Called with no arguments to build the statement on a miss
+        :param list params: Values of the parameters of the statement
+        """
+        cur.execute(self.statement(key, build), params, prepare=True)
+
+    def stream(self, query, itersize=2000, name='reshaper_stream'):
+        """
+        Iterate over the results of a query with a named
+        server-side cursor, fetching itersize rows per round trip.
+        The cursor lives on its own connection so it can hold a
+        transaction open while the main connection keeps autocommitting.
+
+        :param str query: SQL query to run
+        :param int itersize: Number of rows fetched from the server at a time
+        :param str name: Name of the server-side cursor
+        :return: A generator of rows
+        """
+        conn = psycopg.connect(self.dsn, row_factory=dict_row)
+        try:
+            with conn.cursor(name) as cur:
+                cur.itersize = itersize
+                cur.execute(query)
+                for row in cur:
+                    yield row
+        finally:
+            conn.close()
+
+    def insert_batch(self, table, rows, key=None):
+        """
+        Insert multiple rows, all sent in a single pipeline.
+        Like insert_single, columns with a value of None
+        are left out of the row.
+
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries containing values to insert
+        :param tuple key: Columns of a unique constraint, a row with the same key is updated instead, columns with a value of None included
+        :return: List of {id : pk} in the same order as rows
+        """
+        results = [None] * len(rows)
+        try:
+            with self.pipeline(), self.cursor() as cur:
+                for columns, indexes in self.group_rows(rows, bool(key)).items():
+                    query = self.statement(
+                        ('insert', table, columns, key),
+                        lambda: self.build_single(table, columns) + (
+                            self.build_upsert(columns, key) if key else ''
+                        ) + ' RETURNING id'
+                    )
+                    cur.executemany(
+                        query,
+                        [
+                            [rows[index][column] for column in columns]
+                            for index in indexes
+                        ],
+                        returning=True
+                    )
+                    for index in indexes:
+                        results[index] = cur.fetchone()
+                        cur.nextset()
+        except Exception:
+            raise Exception('Could not batch insert into %s' % table)
+        return results
+
+    def insert_rows(self, table, rows, conflict='error'):
+        """
+        Insert rows without returning their primary keys,
+        for rows nothing refers to such as relation rows.
+        All rows are sent in a single pipeline.
+
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries containing values to insert
+        :param str conflict: error fails on a unique violation, ignore skips rows that already exist
+        :return: Number of rows inserted
+        """
+        if conflict not in CONFLICT:
+            raise Exception('Unknown conflict policy: %s' % conflict)
+        try:
+            with self.pipeline(), self.cursor() as cur:
+                for columns, indexes in self.group_rows(rows).items():
+                    query = self.statement(
+                        ('rows', table, columns, conflict),
+                        lambda: self.build_single(table, columns) + CONFLICT[conflict]
+                    )
+                    cur.executemany(
+                        query,
+                        [
+                            [rows[index][key] for key in columns]
+                            for index in indexes
+                        ]
+                    )
+        except Exception:
+            raise Exception('Could not insert rows into %s' % table)
+        return len(rows)
+
+    def copy_rows(self, table, columns, rows):
+        """
+        Bulk load rows with COPY ... FROM STDIN.
+        No primary keys are returned so this is only
+        useful for rows nothing else refers to.
+
+        :param str table: Name of db table to load values into
+        :param tuple columns: Column names, in the same order as the values of each row
+        :param list rows: List of sequences containing values to load
+        :return: Number of rows loaded
+        """
+        with self.cursor() as cur:
+            try:
+                with cur.copy(
+                    'COPY %s (%s) FROM STDIN' % (table, ','.join(columns))
+                ) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            except Exception:
+                raise Exception('Could not copy rows into %s' % table)
+        return len(rows)
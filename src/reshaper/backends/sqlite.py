@@ -0,0 +1,216 @@
+import sqlite3
+from .base import BaseDB, CONFLICT
+
+def dict_row(cursor, row):
+    """
+    Row factory returning rows as dictionaries
+    of column name:value like RealDictCursor
+    """
+    return dict(
+        (column[0], value) for column, value in zip(cursor.description, row)
+    )
+
+class Cursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor usable as a context manager,
+    closed when the block ends
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class DB(BaseDB):
+    """
+    sqlite3 client implementing the methods of
+    reshaper.backends.postgresql.DB, for local runs
+    and tests that do not need a database server.
+
+    Statements run in autocommit mode unless a transaction
+    is started with begin. Files are opened in WAL mode so
+    they can be read while a run writes to them.
+    """
+    placeholder = '?'
+
+    def __init__(self, path=':memory:', wal=True):
+        """
+        :param str path: Path of database file, :memory: for an in-memory database
+        :param boolean wal: Open files in write-ahead log mode
+        """
+        self.settings = {
+            'path': path,
+            'wal': wal
+        }
+        # SQL of statements by (table, column signature)
+        self.statements = {}
+        self.statement_hits = 0
+        self.statement_misses = 0
+        self.transaction = False
+        try:
+            self.conn = sqlite3.connect(path, isolation_level=None)
+            self.conn.row_factory = dict_row
+            if wal and path != ':memory:':
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA synchronous=NORMAL')
+        except Exception:
+            raise Exception('Cannot open database: %s' % path)
+
+    def __getstate__(self):
+        # A DB passed to another process opens the file again
+        if self.settings['path'] == ':memory:':
+            raise Exception(
+                'An in-memory database can not be shared between processes'
+            )
+        return self.settings
+
+    def cursor(self):
+        if self.conn:
+            return self.conn.cursor(factory=Cursor)
+        else:
+            raise Exception('Connection to database not established')
+
+    def begin(self):
+        """
+        Leave autocommit mode, statements run in a single
+        transaction until commit is called
+        """
+        self.conn.execute('BEGIN')
+        self.transaction = True
+
+    def commit(self):
+        """
+        Commit the current transaction, the
+        statements that follow run in a new one
+        """
+        self.conn.execute('COMMIT')
+        self.conn.execute('BEGIN')
+
+    def end(self, commit=True):
+        """
+        Commit or roll back the current transaction
+        and return to autocommit mode
+        """
+        if self.transaction and self.conn.in_transaction:
+            self.conn.execute('COMMIT' if commit else 'ROLLBACK')
+        self.transaction = False
+
+    def build_many(self, table, values):
+        """
+        Build s SQL which enables bulk loading values from
+        a list of dictionaries
+
+        :param str table: Name of table in database
+        :param list values: List of dictionaries
+        """
+        keys = list(values[0].keys())
+        return 'INSERT INTO %s (%s) VALUES (%s)' % (
+            table,
+            ','.join(keys),
+            ','.join(':%s' % key for key in keys)
+        )
+
+    def insert_batch(self, table, rows, key=None):
+        """
+        Insert multiple rows, returning their primary keys.
+        Like insert_single, columns with a value of None
+        are left out of the row.
+
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries containing values to insert
+        :param tuple key: Columns of a unique constraint, a row with the same key is updated instead, columns with a value of None included
+        :return: List of {id : pk} in the same order as rows
+        """
+        if key:
+            return [self.insert_single(table, row, key) for row in rows]
+        results = [None] * len(rows)
+        with self.cursor() as cur:
+            try:
+                for columns, indexes in self.group_rows(rows).items():
+                    query = self.statement(
+                        ('insert', table, columns),
+                        lambda: self.build_single(table, columns)
+                    )
+                    for index in indexes:
+                        cur.execute(
+                            query, [rows[index][column] for column in columns]
+                        )
+                        results[index] = {'id': cur.lastrowid}
+            except Exception:
+                raise Exception('Could not batch insert into %s' % table)
+        return results
+
+    def insert_rows(self, table, rows, conflict='error'):
+        """
+        Insert rows without returning their primary keys,
+        for rows nothing refers to such as relation rows
+
+        :param str table: Name of db table to insert values into
+        :param list rows: List of dictionaries containing values to insert
+        :param str conflict: error fails on a unique violation, ignore skips rows that already exist
+        :return: Number of rows inserted
+        """
+        if conflict not in CONFLICT:
+            raise Exception('Unknown conflict policy: %s' % conflict)
+        with self.cursor() as cur:
+            try:
+                for columns, indexes in self.group_rows(rows).items():
+                    query = self.statement(
+                        ('rows', table, columns, conflict),
+                        lambda: self.build_single(table, columns) + CONFLICT[conflict]
+                    )
+                    cur.executemany(query, [
+                        [rows[index][key] for key in columns]
+                        for index in indexes
+                    ])
+            except Exception:
+                raise Exception('Could not insert rows into %s' % table)
+        return len(rows)
+
+    def copy_rows(self, table, columns, rows):
+        """
+        Bulk load rows, SQLite has no COPY so rows are
+        inserted with a single executemany
+
+        :param str table: Name of db table to load values into
+        :param tuple columns: Column names, in the same order as the values of each row
+        :param list rows: List of sequences containing values to load
+        :return: Number of rows loaded
+        """
+        query = self.statement(
+            ('insert', table, tuple(columns)),
+            lambda: self.build_single(table, tuple(columns))
+        )
+        with self.cursor() as cur:
+            try:
+                cur.executemany(query, rows)
+            except Exception:
+                raise Exception('Could not copy rows into %s' % table)
+        return len(rows)
+
+    def insert_single(self, table, row, key=None):
+        """
+        Insert a single row
+
+        :param str table: Name of db table to insert values into
+        :param dict row: Dictionary containing values to insert
+        :param tuple key: Columns of a unique constraint, a row with the same key is updated instead, columns with a value of None included
+        :return: pk of the row inserted as {id : pk}
+        """
+        if key:
+            # lastrowid is not set when the row is updated
+            return super(DB, self).insert_single(table, row, key)
+        columns = tuple(
+            column for column, value in row.items() if value != None
+        )
+        with self.cursor() as cur:
+            try:
+                self.execute(
+                    cur,
+                    ('insert', table, columns),
+                    lambda: self.build_single(table, columns),
+                    [row[column] for column in columns]
+                )
+                return {'id': cur.lastrowid}
+            except Exception:
+                raise Exception('Could not insert data %s into %s' % (row, table))
@@ -0,0 +1,157 @@
+import abc
+import json
+import os
+import sqlite3
+import redis
+
+class CheckpointStore(abc.ABC):
+    """
+    Stores the checkpoints used to resume interrupted runs
+    as string values by key
+    """
+    # Whether worker processes can write to the store at the same time
+    shared = True
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        Returns the value stored under key or None
+        """
+
+    @abc.abstractmethod
+    def set(self, values):
+        """
+        Store multiple values at once
+
+        :param dict values: Dictionary of key:value to store
+        """
+
+
+class RedisCheckpoints(CheckpointStore):
+    """
+    Checkpoints stored in redis, writing all
+    values of a checkpoint in a single pipeline
+    """
+    def __init__(self, host=None, port=None, db=None, client=None):
+        """
+        :param str host: Redis host
+        :param int port: Redis port
+        :param int db: Redis database
+        :param client: Redis client to use instead of connecting to host
+        """
+        self.settings = {
+            'host': host,
+            'port': port,
+            'db': db
+        }
+        self.client = client
+        if client is None:
+            self.client = redis.StrictRedis(**self.settings)
+
+    def __getstate__(self):
+        # A store passed to another process connects again
+        return self.settings
+
+    def __setstate__(self, settings):
+        self.__init__(**settings)
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return value.decode('utf-8')
+
+    def set(self, values):
+        pipeline = self.client.pipeline()
+        for key, value in values.items():
+            pipeline.set(key, value)
+        pipeline.execute()
+
+
+class FileCheckpoints(CheckpointStore):
+    """
+    Checkpoints stored as JSON in a local file. The file is
+    replaced atomically on every write so an interrupted
+    write never leaves a broken checkpoint behind.
+    Meant for single process runs, Runner.run_parallel and
+    Scheduler refuse it, use SQLiteCheckpoints or RedisCheckpoints.
+    """
+    # Every process rewrites the whole file
+    # from the values it has read itself
+    shared = False
+
+    def __init__(self, path):
+        """
+        :param str path: Path of checkpoint file
+        """
+        self.path = path
+        self.values = {}
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.values = json.load(checkpoint_file)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            return None
+        return str(value)
+
+    def set(self, values):
+        self.values.update(
+            (key, str(value)) for key, value in values.items()
+        )
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as checkpoint_file:
+            json.dump(self.values, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp, self.path)
+
+
+class SQLiteCheckpoints(CheckpointStore):
+    """
+    Checkpoints stored in a local SQLite file
+    """
+    def __init__(self, path):
+        """
+        :param str path: Path of SQLite file
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute(
+                """ CREATE TABLE IF NOT EXISTS checkpoint(
+                    key     text PRIMARY KEY,
+                    value   text
+                )
+                """
+            )
+
+    def __getstate__(self):
+        # A store passed to another process connects again
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        row = self.conn.execute(
+            """ SELECT value FROM checkpoint WHERE key=? """,
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set(self, values):
+        with self.conn:
+            self.conn.executemany(
+                """ INSERT OR REPLACE INTO checkpoint VALUES (?, ?) """,
+                ((key, str(value)) for key, value in values.items())
+            )
@@ -0,0 +1,168 @@
+import sqlite3
+
+class IdentityMap:
+    """
+    Maps source primary keys of a transformer to the primary
+    keys of the rows they were migrated to in the destination database,
+    so a source row is only ever transformed and inserted once.
+
+    Entries are kept in memory, one dictionary per transformer.
+    If a path is given entries are spilled to a SQLite file
+    once more than max_memory of them are held in memory.
+    The file is kept between runs.
+    """
+    def __init__(self, path=None, max_memory=1000000):
+        """
+        :param str path: Path of SQLite file to spill entries to
+        :param int max_memory: Number of entries held in memory before spilling
+        """
+        self.path = path
+        self.max_memory = max_memory
+        self.entries = {}
+        self.size = 0
+        self.conn = None
+        # Names of the transformers with entries in the SQLite file,
+        # misses of other transformers are answered from memory
+        self.spilled = set()
+        # While held entries stay in memory, the destination
+        # transaction that wrote them can still be rolled back
+        self.held = False
+        if path:
+            self.conn = sqlite3.connect(path)
+            with self.conn:
+                self.conn.execute(
+                    """ CREATE TABLE IF NOT EXISTS identity(
+                        transformer     text NOT NULL,
+                        source_pk       NOT NULL,
+                        destination_pk  integer,
+                        PRIMARY KEY (transformer, source_pk)
+                    )
+                    """
+                )
+            self.spilled = set(
+                row[0] for row in self.conn.execute(
+                    """ SELECT DISTINCT transformer FROM identity """
+                )
+            )
+
+    def __getstate__(self):
+        # Entries are shared with other processes
+        # through the SQLite file
+        if not self.path:
+            raise Exception(
+                'An identity map without a path can not be shared between processes'
+            )
+        self.spill()
+        return {'path': self.path, 'max_memory': self.max_memory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def name(self, transformer):
+        """
+        Returns the name entries of a transformer are stored under
+        """
+        if isinstance(transformer, str):
+            return transformer
+        return transformer.__class__.__name__
+
+    def get(self, transformer, source_pk):
+        """
+        Get the destination primary key of a source row
+
+        :param Transformer transformer: Transformer object or name
+        :param source_pk: Primary key of row in source table
+        :return: Destination primary key or None if the row has not been migrated
+        """
+        name = self.name(transformer)
+        pk = self.entries.get(name, {}).get(source_pk)
+        if pk is None and name in self.spilled:
+            row = self.conn.execute(
+                """ SELECT destination_pk FROM identity WHERE transformer=? AND source_pk=? """,
+                (name, source_pk)
+            ).fetchone()
+            if row:
+                pk = row[0]
+        return pk
+
+    def set(self, transformer, source_pk, destination_pk):
+        """
+        Record the destination primary key of a source row
+
+        :param Transformer transformer: Transformer object or name
+        :param source_pk: Primary key of row in source table
+        :param destination_pk: Primary key of the row inserted into destination table
+        """
+        entries = self.entries.setdefault(self.name(transformer), {})
+        if source_pk not in entries:
+            self.size += 1
+        entries[source_pk] = destination_pk
+        if not self.held:
+            self.overflow()
+
+    def hold(self, held=True):
+        """
+        Keep entries in memory while a destination transaction is open
+
+        :param boolean held: False once the transaction has ended
+        """
+        self.held = held
+        if not held:
+            self.overflow()
+
+    def overflow(self):
+        """
+        Spill entries if more than max_memory are held in memory,
+        called once the transaction that wrote held entries is committed
+        """
+        if self.conn and self.size >= self.max_memory:
+            self.spill()
+
+    def discard(self, transformer, source_pk):
+        """
+        Forget the destination primary key of a source row
+
+        :param Transformer transformer: Transformer object or name
+        :param source_pk: Primary key of row in source table
+        """
+        name = self.name(transformer)
+        entries = self.entries.get(name, {})
+        if source_pk in entries:
+            del entries[source_pk]
+            self.size -= 1
+        if name in self.spilled:
+            with self.conn:
+                self.conn.execute(
+                    """ DELETE FROM identity WHERE transformer=? AND source_pk=? """,
+                    (name, source_pk)
+                )
+
+    def spill(self):
+        """
+        Write all entries held in memory to the SQLite file
+        """
+        if not self.conn:
+            return
+        with self.conn:
+            self.conn.executemany(
+                """ INSERT OR REPLACE INTO identity VALUES (?, ?, ?) """,
+                (
+                    (name, source_pk, destination_pk)
+                    for name, entries in self.entries.items()
+                    for source_pk, destination_pk in entries.items()
+                )
+            )
+        self.spilled.update(
+            name for name, entries in self.entries.items() if entries
+        )
+        self.entries = {}
+        self.size = 0
+
+    def close(self):
+        """
+        Spill remaining entries and close the SQLite file
+        """
+        if self.conn:
+            self.spill()
+            self.conn.close()
+            self.conn = None
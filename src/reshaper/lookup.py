@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+class LookupCache:
+    """
+    Bounded least recently used cache of destination rows
+    keyed by the value of a unique column.
+    Keeps count of hits and misses.
+    """
+    def __init__(self, maxsize=10000):
+        """
+        :param int maxsize: Maximum number of rows kept in cache
+        """
+        self.maxsize = maxsize
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, value):
+        """
+        Get a cached row by its unique value
+
+        :param value: Value of the unique column
+        :return: The cached row or None
+        """
+        if value in self.rows:
+            self.rows.move_to_end(value)
+            self.hits += 1
+            return self.rows[value]
+        self.misses += 1
+        return None
+
+    def set(self, value, row):
+        """
+        Cache a row by its unique value, evicting the
+        least recently used row if the cache is full
+
+        :param value: Value of the unique column
+        :param dict row: Row from the destination database
+        """
+        self.rows[value] = row
+        self.rows.move_to_end(value)
+        while len(self.rows) > self.maxsize:
+            self.rows.popitem(last=False)
+
+    def discard(self, value):
+        """
+        Remove a row from cache if it is cached
+
+        :param value: Value of the unique column
+        """
+        self.rows.pop(value, None)
+
+    def stats(self):
+        """
+        Returns size, hits and misses of the cache as a dictionary
+        """
+        return {
+            'size': len(self.rows),
+            'hits': self.hits,
+            'misses': self.misses
+        }
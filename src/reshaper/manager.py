@@ -1,19 +1,98 @@
 from .transformers import *
+from .lookup import LookupCache
 
 class Manager:
     def __init__(
         self, 
         source_db=None, 
-        destination_db=None
+        destination_db=None,
+        batch_size=None,
+        lookup_cache_size=10000,
+        identity=None,
+        metrics=None,
+        profiler=None
     ):
         self.source_db = source_db
         self.destination_db = destination_db
         self.transformers = [] 
         self.cache = []
 
+        # When batch_size is set transformed rows are
+        # buffered per destination table and written
+        # with a single multi-row insert once full
+        self.batch_size = batch_size
+        self.buffer = {}
+        # Unique values of the get_or_create rows
+        # waiting in buffer, per destination table
+        self.buffered = {}
+
+        # Relation rows waiting to be written, per relation
+        # table keyed by their values so each is written once.
+        # Without relation_batch they are written as soon as
+        # their transformer has been inserted, otherwise
+        # the runner flushes them relation_batch at a time.
+        # relation_conflict is the conflict policy of insert_rows.
+        # Once writing them failed they are kept until discarded.
+        self.relations = {}
+        self.relations_failed = False
+        self.relation_batch = None
+        self.relation_conflict = 'error'
+
+        # Rows resolved by unique value, one
+        # cache per (destination_table, unique)
+        self.lookup_cache_size = lookup_cache_size
+        self.lookups = {}
+
+        # Source rows fetched ahead of time for
+        # the current chunk, keyed by table and id,
+        # and the columns selected per table
+        self.prefetched = {}
+        self.prefetched_columns = {}
+
+        # Values filtered by apply_batch_filters for the rows
+        # of the current chunk as (row, {field name: value}),
+        # keyed by id of row
+        self.batched = {}
+
+        # IdentityMap of source rows already migrated
+        self.identity = identity
+
+        # When journal is a list, entries added to the lookup
+        # caches and identity map are recorded in it so they
+        # can be undone if the row is rolled back
+        self.journal = None
+
+        # Metrics of stage timings and counters, or None
+        self.metrics = metrics
+
+        # Profiler timing every filter, action and
+        # Field.transform override, or None
+        self.profiler = profiler
+
     def add_transformer(self, transformer):
         self.transformers.append(transformer)
 
+    def start(self, transformer, stage):
+        """
+        Start timing a stage of transformer if metrics are kept
+        """
+        if self.metrics is not None:
+            self.metrics.start(transformer, stage)
+
+    def stop(self):
+        """
+        Stop timing the stage started last if metrics are kept
+        """
+        if self.metrics is not None:
+            self.metrics.stop()
+
+    def count(self, transformer, counter, n=1):
+        """
+        Increase a counter of transformer if metrics are kept
+        """
+        if self.metrics is not None:
+            self.metrics.count(transformer, counter, n)
+
     def get_from_unique(
             self, 
             table, 
@@ -29,16 +108,300 @@ class Manager:
             table, unique, value
         )
 
+    def get_lookup(self, table, unique):
+        """
+        Returns the lookup cache of a destination table and unique column
+        """
+        key = (table, unique)
+        if key not in self.lookups:
+            self.lookups[key] = LookupCache(self.lookup_cache_size)
+        return self.lookups[key]
+
+    def lookup_stats(self):
+        """
+        Returns size, hits and misses of every lookup cache
+        keyed by (destination_table, unique)
+        """
+        return dict(
+            (key, lookup.stats()) for key, lookup in self.lookups.items()
+        )
+
+    def prefetch(self, transformer, rows):
+        """
+        Fetch the source rows referenced by the SubTransformerFields
+        and RelationTransformerFields of a chunk of rows with one
+        query per referenced table. Replaces the previous chunk.
+
+        :param Transformer transformer: Transformer object
+        :param list rows: Rows from the source table of transformer
+        """
+        pks = {}
+        columns = {}
+        for field in transformer._fields.values():
+            if not isinstance(field, (SubTransformerField, RelationTransformerField))\
+            or not field.transformer:
+                continue
+            target = field.transformer()
+            table = target.source_table
+            if not table:
+                continue
+            for row in rows:
+                value = row.get(field.source)
+                if value is not None:
+                    pks.setdefault(table, set()).add(value)
+            # Rows of a table read by several fields
+            # have the columns of all of them
+            projection = self.projection(target, getattr(field, 'key', 'id'))
+            if projection is None or columns.get(table, ()) is None:
+                columns[table] = None
+            else:
+                columns[table] = tuple(sorted(
+                    set(columns.get(table, ())).union(projection)
+                ))
+
+        self.clear_prefetched()
+        self.start(transformer, 'prefetch')
+        for table, values in pks.items():
+            self.prefetched[table] = self.source_db.get_rows_from_pks(
+                table, values, columns[table]
+            )
+            self.prefetched_columns[table] = None if columns[table] is None\
+                else frozenset(columns[table])
+        self.count(transformer, 'queries', len(pks))
+        self.stop()
+
+    def clear_prefetched(self):
+        """
+        Forget the prefetched rows of the last chunk, so they
+        are not served to later runs once their source rows changed
+        """
+        self.prefetched = {}
+        self.prefetched_columns = {}
+
+    def apply_batch_filters(self, transformer, rows):
+        """
+        Apply the filters of the fields of a transformer with batch
+        filters once per column to a chunk of source rows. Filtered
+        values replace those of the previous chunk and are kept
+        aside for set_values to pick up, the rows are left untouched.
+
+        :param Transformer transformer: Transformer object
+        :param list rows: Rows from the source table of transformer
+        """
+        self.batched = {}
+        self.start(transformer, 'filters')
+        for column, slots in transformer._batch.items():
+            values = [row.get(column) for row in rows]
+            for name, batch in slots:
+                if self.profiler is not None:
+                    filtered = list(values)
+                    for field_filter in transformer._fields[name].filters:
+                        if getattr(field_filter, 'batch', False):
+                            filtered = self.profiler.call(
+                                transformer.__class__.__name__,
+                                name,
+                                'batch_filter',
+                                field_filter,
+                                filtered
+                            )
+                        else:
+                            filtered = [
+                                self.profiler.call(
+                                    transformer.__class__.__name__,
+                                    name,
+                                    'filter',
+                                    field_filter,
+                                    value
+                                )
+                                for value in filtered
+                            ]
+                else:
+                    filtered = batch(list(values))
+                if len(filtered) != len(rows):
+                    raise Exception(
+                        'Batch filter of %s.%s returned %i values for %i rows' % (
+                            transformer.__class__.__name__,
+                            name,
+                            len(filtered),
+                            len(rows)
+                        )
+                    )
+                for row, value in zip(rows, filtered):
+                    self.batched.setdefault(id(row), (row, {}))[1][name] = value
+        self.stop()
+
+    def get_batched(self, row):
+        """
+        Returns the values filtered by apply_batch_filters
+        for a source row by field name, or None
+        """
+        batched = self.batched.get(id(row))
+        if batched is None or batched[0] is not row:
+            return None
+        return batched[1]
+
+    def projection(self, transformer, *extra):
+        """
+        Returns the source columns selected for transformer
+        and extra columns, None to select all columns
+
+        :param Transformer transformer: Transformer object
+        """
+        columns = transformer._columns
+        if columns is None or not extra or set(extra) <= set(columns):
+            return columns
+        return tuple(sorted(set(columns).union(extra)))
+
+    def get_source_row(self, table, pk, transformer=None, columns=None):
+        """
+        Get a row from the source database, from the
+        prefetched rows if it was fetched ahead of time
+
+        :param str table: Name of source table
+        :param pk: id of row in source table
+        :param Transformer transformer: Transformer the row is read for, metrics are counted under it
+        :param tuple columns: Columns to select, None selects all of them
+        """
+        rows = self.prefetched.get(table)
+        if rows is not None and pk in rows:
+            # Prefetched rows hold the columns of the fields
+            # of the transformer being run, not necessarily
+            # those of transformers nested deeper
+            prefetched = self.prefetched_columns.get(table)
+            if prefetched is None or (
+                columns is not None and prefetched.issuperset(columns)
+            ):
+                self.count(transformer or table, 'prefetch_hits')
+                return rows[pk]
+        self.start(transformer or table, 'source')
+        row = self.source_db.get_row_from_pk(table, pk, columns)
+        self.count(transformer or table, 'queries')
+        self.stop()
+        return row
+
+    def get_identity(self, transformer, source_pk):
+        """
+        Returns the destination primary key a source row
+        was migrated to, or None if it has not been migrated
+        """
+        if self.identity is None or source_pk is None\
+        or not transformer.source_table or not transformer.commit:
+            return None
+        return self.identity.get(transformer, source_pk)
+
+    def set_identity(self, transformer, source_pk, pk):
+        """
+        Record the destination primary key a source row was migrated to
+        """
+        if self.identity is None or source_pk is None or pk is None\
+        or not transformer.source_table or not transformer.commit:
+            return
+        self.identity.set(transformer, source_pk, pk)
+        if self.journal is not None:
+            self.journal.append(
+                lambda: self.identity.discard(transformer, source_pk)
+            )
+
     def resolve_unique(self, transformer, unique_value):
-        dest_row = self.get_from_unique(
+        lookup = self.get_lookup(
             transformer.destination_table,
-            transformer.unique,
-            unique_value,
-            db='destination_db'
+            transformer.unique
         )
+        dest_row = lookup.get(unique_value)
+        if dest_row is None:
+            self.start(transformer, 'lookup')
+            dest_row = self.get_from_unique(
+                transformer.destination_table,
+                transformer.unique,
+                unique_value,
+                db='destination_db'
+            )
+            if dest_row:
+                lookup.set(unique_value, dest_row)
+            self.count(transformer, 'cache_misses')
+            self.count(transformer, 'queries')
+            self.stop()
+        else:
+            self.count(transformer, 'cache_hits')
 
         return dest_row
 
+    def remember(self, transformer, row, pk):
+        """
+        Add a row we inserted ourselves to the lookup
+        cache of its transformer, if it declares a unique
+
+        :param Transformer transformer: Transformer object
+        :param dict row: Transformed row as it was inserted
+        :param int pk: Primary key returned by the insert
+        """
+        if not transformer.unique or pk is None:
+            return
+        unique_value = row.get(transformer.unique)
+        if unique_value is None:
+            return
+        dest_row = dict(row)
+        dest_row['id'] = pk
+        lookup = self.get_lookup(
+            transformer.destination_table,
+            transformer.unique
+        )
+        lookup.set(unique_value, dest_row)
+        if self.journal is not None:
+            self.journal.append(lambda: lookup.discard(unique_value))
+
+    def mark(self):
+        """
+        Returns the position in journal rollback can undo back to
+        """
+        return len(self.journal) if self.journal is not None else 0
+
+    def rollback(self, mark=0):
+        """
+        Forget the state collected for rows whose writes were
+        rolled back: pending relations and the lookup cache and
+        identity map entries recorded in journal after mark
+
+        :param int mark: Position in journal returned by mark
+        """
+        self.cache = []
+        while self.journal and len(self.journal) > mark:
+            self.journal.pop()()
+
+    def warm_lookups(self, transformer):
+        """
+        Preload the lookup caches of a transformer and the
+        transformers referenced by its fields with a single query
+        per destination table. Tables with more rows than
+        fit in a lookup cache are skipped.
+
+        :param Transformer transformer: Transformer object
+        """
+        targets = [transformer]
+        for field in transformer._fields.values():
+            if isinstance(field, (SubTransformerField, RelationTransformerField))\
+            and field.transformer:
+                targets.append(field.transformer())
+
+        for target in targets:
+            if not target.unique or not target.destination_table:
+                continue
+            row_count = self.destination_db.get_table_row_count(
+                target.destination_table
+            )
+            if row_count > self.lookup_cache_size:
+                continue
+            lookup = self.get_lookup(
+                target.destination_table,
+                target.unique
+            )
+            for row in self.destination_db.get_table_rows(
+                target.destination_table
+            ):
+                unique_value = row.get(target.unique)
+                if unique_value is not None:
+                    lookup.set(unique_value, row)
+
 
     def add_relation(self, table, data):
         """
@@ -62,12 +425,24 @@ class Manager:
             transformers = [transformers]
 
         for transformer in transformers:
+            known = self.get_identity(transformer, value)
+            if known is not None:
+                # Already migrated, relate to the
+                # existing row instead of inserting it again
+                self.add_relation(
+                    field.relation_table,
+                    {transformer.destination_id: known}
+                )
+                continue
+
             if transformer.source_table:
-                row = self.source_db.get_row_from_pk(
+                row = self.get_source_row(
                     transformer.source_table,
-                    value
+                    value,
+                    transformer,
+                    transformer._columns
                 )
-                transformer.set_values(row)
+                self.set_values(transformer, row)
 
             if transformer.method == 'get_or_create':
                 # If the transformer declares a get_or_create
@@ -80,12 +455,15 @@ class Manager:
                         transformer,
                         unique_value
                     )
+                    if data:
+                        self.set_identity(transformer, value, data.get('id'))
                 else:
                     raise Exception(
                         'No unique declared for transformer: %s' % transformer.__class__.__name__
                     )
             else:
                 data = self.insert(transformer)
+                self.set_identity(transformer, value, data.get('id'))
 
             if not transformer.commit:
                 self.add_relation(
@@ -110,36 +488,119 @@ class Manager:
         Resolve SubTransformerField
         """
         pk = value
-        row = transformer.to_dict()
+        target = field.transformer()
 
-
-        if field.transformer().unique:
-            row = self.source_db.get_row_from_pk(
-                field.transformer().source_table,
-                value
+        if target.unique:
+            row = self.get_source_row(
+                target.source_table,
+                value,
+                target,
+                target._columns
             )
-            unique_value = row.get(field.transformer().unique)
+            unique_value = row.get(target.unique)
             dest_row = self.resolve_unique(
-                field.transformer(), unique_value
+                target, unique_value
             )
             if dest_row:
                 return dest_row.get(field.key)
 
+        # Identities are kept under the transformer of the field,
+        # a transform override may return another transformer
+        # such as the one the field belongs to
+        identify = field.commit and field.key == 'id'\
+            and isinstance(transformer, field.transformer)
         if transformer.source_table:
-            row = self.source_db.get_row_from_pk(
+            if identify:
+                known = self.get_identity(transformer, value)
+                if known is not None:
+                    return known
+
+            row = self.get_source_row(
                 transformer.source_table,
-                value
+                value,
+                transformer,
+                self.projection(transformer, field.key)
             )
-            transformer.set_values(row)
+            self.set_values(transformer, row)
 
             if field.commit:
                 pk = self.insert(transformer).get(field.key)
+                if identify:
+                    self.set_identity(transformer, value, pk)
             else:
                 pk = row.get(field.key)
 
 
         return pk
 
+    def build(self, transformer):
+        """
+        Resolve all fields of a transformer into a row
+        ready to be inserted into the destination database.
+        Relations found along the way are stored in cache.
+
+        :param Transformer transformer: Transformer object
+
+        :return: A dictionary containing transformed columns
+        """
+        transformed = {}
+        # Values as set from the source row, a Field.transform
+        # override may replace transformer along the way
+        values = transformer.to_dict()
+        for key, field, kind, custom in transformer._steps:
+            value = values.get(key)
+            if value is None:
+                continue
+            if kind == 'transformer':
+                if custom:
+                    transformer = self.transform_field(transformer, key, field, transformer)
+                if field.commit:
+                    value = getattr(transformer, key, None)
+                    transformed[key] = value if value is not None else ""
+            elif kind == 'value':
+                transformed[key] = field.value
+            elif kind == 'sub':
+                self.start(transformer, 'sub')
+                pk = self.resolve_subtransformerfield(
+                    field,
+                    value,
+                    self.transform_field(transformer, key, field, transformer)
+                    if custom else field.transform(transformer)
+                )
+                val = field.postFilter(pk) if field.postFilter else pk
+                transformed[key] = val
+                self.stop()
+            elif kind == 'relation':
+                self.start(transformer, 'relation')
+                self.resolve_relationtransformerfield(
+                    field,
+                    value,
+                    self.transform_field(transformer, key, field, field.transformer())
+                    if custom else field.transform(field.transformer())
+                )
+                self.stop()
+        return transformed
+
+    def transform_field(self, transformer, key, field, target):
+        """
+        Call the Field.transform override of a field
+        with target, timed if a profiler is set
+
+        :param Transformer transformer: Transformer the field belongs to
+        :param str key: Name of the field
+        :param Field field: Field overriding transform
+        :param target: Argument passed to field.transform
+        """
+        if self.profiler is None:
+            return field.transform(target)
+        return self.profiler.call(
+            transformer.__class__.__name__,
+            key,
+            'transform',
+            field.transform,
+            target
+        )
+
     def insert(self, transformer):
         """
         Insert a single row from resolved transformer data
@@ -148,70 +609,428 @@ class Manager:
 
         :return: A dictionary containing id: primary_key if data was commited, otherwise a dictionary containing transformed columns
         """
-        pk = None
-        transformed = {}
-        for key, value in transformer.to_dict().items():
-            field = transformer.to_field(key)
-            if field != None and value != None:
-                if isinstance(field, RelationTransformerField):
-                    pk = self.resolve_relationtransformerfield(
-                        field,
-                        value,
-                        field.transform(field.transformer())
-                    )
-                elif isinstance(field, SubTransformerField):
-                    pk = self.resolve_subtransformerfield(
-                        field,
-                        value,
-                        field.transform(transformer)
-                    )
-                    val = field.postFilter(pk) if field.postFilter else pk
-                    transformed[key] = val
-                elif isinstance(field, TransformerField):
-                    transformer = field.transform(transformer)
-                    val = transformer.to_dict().get(key)
-                    if field.commit:
-                        transformed[key] = val if val != None else ""
-                elif isinstance(field, ValueField):
-                    transformed[key] = field.value
+        transformed = self.build(transformer)
         if transformer.commit:
-            pk = self.destination_db.insert_single(
-                transformer.destination_table, transformed
-            )
+            self.start(transformer, 'insert')
+            key = getattr(transformer, 'destination_key', None)
+            if key:
+                pk = self.destination_db.insert_single(
+                    transformer.destination_table,
+                    self.upsert_row(transformer, transformed),
+                    key=key
+                )
+            else:
+                pk = self.destination_db.insert_single(
+                    transformer.destination_table, transformed
+                )
+            self.count(transformer, 'queries')
+            self.count(transformer, 'inserted')
+            self.stop()
+            self.remember(transformer, transformed, pk.get('id'))
             return pk
         else:
             return transformed
 
-    def transform(self, transformer, row):
+    def upsert_row(self, transformer, transformed):
         """
-        Performs transformation of all fields declared
-        in transformer on a single row
+        Set the columns of a transformed row left out for having
+        no value to None, so upserting the row clears values
+        that were removed from the source row since
 
         :param Transformer transformer: Transformer object
-        :param dict row: Dictionary containing row values from source database
+        :param dict transformed: Row built by build
         """
-        transformer.set_values(row)
+        for key, field, kind, custom in transformer._steps:
+            if key not in transformed and (
+                kind == 'sub' or (kind == 'transformer' and field.commit)
+            ):
+                transformed[key] = None
+        return transformed
+
+    def insert_relations(self, relations, destination_id, pk):
+        """
+        Queue relation rows collected while resolving a
+        transformer, now that its primary key is known
+
+        :param list relations: List of {relation_table: data}
+        :param str destination_id: Column name referencing the transformer
+        :param int pk: Primary key of the inserted transformer row
+        """
+        for relation in relations:
+            for key,value in relation.items():
+                table = key
+                value[destination_id] = pk
+                self.queue_relation(table, value)
+        if not self.relation_batch:
+            self.flush_relations()
+
+    def queue_relation(self, table, row):
+        """
+        Buffer a relation row unless the same row is already buffered
+
+        :param str table: Name of relation table
+        :param dict row: Dictionary of column name:id
+        :return: Key of the row if it was buffered, None for a duplicate
+        """
+        rows = self.relations.setdefault(table, {})
+        key = tuple(sorted(row.items()))
+        if key in rows:
+            return None
+        rows[key] = row
+        if self.journal is not None:
+            self.journal.append(lambda: rows.pop(key, None))
+        return key
+
+    def pending_relations(self):
+        """
+        Returns the number of buffered relation rows
+        """
+        return sum(len(rows) for rows in self.relations.values())
+
+    def flush_relations(self):
+        """
+        Write buffered relation rows with one bulk insert
+        per relation table, without returning their ids.
+        The rows of a table that fails to be written are kept
+        and not written again until they are discarded.
+
+        :return: Number of relation rows written
+        """
+        if self.relations_failed:
+            raise Exception(
+                'Relation rows failed to be written, discard them first'
+            )
+        written = 0
+        for table in list(self.relations.keys()):
+            rows = list(self.relations[table].values())
+            if rows:
+                self.start(table, 'relations')
+                try:
+                    self.destination_db.insert_rows(
+                        table, rows, conflict=self.relation_conflict
+                    )
+                except Exception:
+                    # Rows that failed are not written again
+                    # by the next flush, hiding the error,
+                    # and rows they belong to are not checkpointed
+                    self.relations_failed = True
+                    raise
+                self.count(table, 'queries')
+                self.count(table, 'inserted', len(rows))
+                self.stop()
+                written += len(rows)
+            del self.relations[table]
+        return written
 
+    def resolve_existing(self, transformer):
+        """
+        Lookup a get_or_create transformer in the destination
+        database, returns the matching row or None
+        """
         if transformer.unique and transformer.method == 'get_or_create':
             unique_value = transformer.to_dict().get(transformer.unique)
-            dest_row = self.resolve_unique(
+            return self.resolve_unique(
                 transformer, unique_value
             )
-            if dest_row:
-                return dest_row.get('id')
+        return None
+
+    def set_values(self, transformer, row):
+        """
+        Set the values of transformer from a source row,
+        running the filters and actions of its fields
+        """
+        batched = self.get_batched(row) if self.batched else None
+        if self.metrics is None and self.profiler is None:
+            transformer.set_values(row, batched)
+            return
+        self.start(transformer, 'filters')
+        transformer.set_values(row, batched, self.profiler)
+        self.stop()
+
+    def transform(self, transformer, row):
+        """
+        Performs transformation of all fields declared
+        in transformer on a single row
+
+        :param Transformer transformer: Transformer object
+        :param dict row: Dictionary containing row values from source database
+        """
+        # Rows upserted on a destination key are applied
+        # again even if they were migrated before
+        upsert = getattr(transformer, 'destination_key', None)
+        known = None if upsert else self.get_identity(transformer, row.get('id'))
+        if known is not None:
+            return known
+
+        self.set_values(transformer, row)
+
+        dest_row = self.resolve_existing(transformer)
+        if dest_row:
+            return dest_row.get('id')
         pk = self.insert(transformer).get('id')
+        self.set_identity(transformer, row.get('id'), pk)
 
         if self.cache:
-            for relation in self.cache:
-                for key,value in relation.items():
-                    table = key
-                    value[transformer.destination_id] = pk
-                    self.destination_db.insert_single(
-                        table, value
-                    )
+            self.insert_relations(
+                self.cache, transformer.destination_id, pk
+            )
             self.cache = []
         return pk
 
-    def transformAll(self, transformers):
-        for transformer in transformers:
-            self.transform(transformer)
+    def copyable(self, transformer):
+        """
+        A transformer can be bulk loaded with COPY when none of its
+        rows need the primary key returned by the insert, that is
+        it only has TransformerFields and ValueFields, nothing
+        is related to it, it has no unique to look it up by,
+        its rows are not upserted on a destination key and
+        they are not recorded in an identity map.
+
+        :param Transformer transformer: Transformer object
+        """
+        if transformer.method == 'get_or_create' or transformer.unique:
+            return False
+        if getattr(transformer, 'destination_key', None):
+            return False
+        if self.identity is not None and transformer.source_table:
+            return False
+        for field in transformer._fields.values():
+            if not isinstance(field, (TransformerField, ValueField)):
+                return False
+        return True
+
+    def copyable_row(self, row):
+        """
+        Values of a row can be written with COPY unless one of them
+        is a list or dict. The driver of an insert adapts those to
+        an array or json, COPY would write their str() instead.
+
+        :param dict row: Transformed row
+        """
+        for value in row.values():
+            if isinstance(value, (list, tuple, dict, set)):
+                return False
+        return True
+
+    def pending(self, table):
+        """
+        Returns the number of rows buffered for a destination table
+        """
+        return len(self.buffer.get(table, []))
+
+    def is_buffered(self, transformer):
+        """
+        Returns True if a get_or_create row with the unique value
+        of transformer is waiting in buffer. It is found by
+        resolve_existing once flushed.
+        """
+        if not transformer.unique or transformer.method != 'get_or_create':
+            return False
+        return transformer.to_dict().get(transformer.unique)\
+            in self.buffered.get(transformer.destination_table, ())
+
+    def queue(self, transformer, row, flush=True):
+        """
+        Performs transformation of a single row like transform
+        but buffers the result instead of inserting it.
+        The buffer of the destination table is flushed
+        once it holds batch_size rows.
+
+        :param Transformer transformer: Transformer object
+        :param dict row: Dictionary containing row values from source database
+        :param boolean flush: Flush the buffer once full, otherwise flushing is left to the caller
+
+        :return: List of primary keys inserted by a flush, empty if nothing was flushed
+        """
+        if not transformer.commit:
+            self.transform(transformer, row)
+            return []
+
+        if not getattr(transformer, 'destination_key', None)\
+        and self.get_identity(transformer, row.get('id')) is not None:
+            return []
+
+        self.set_values(transformer, row)
+
+        if self.resolve_existing(transformer) or self.is_buffered(transformer):
+            return []
+
+        transformed = self.build(transformer)
+        table = transformer.destination_table
+        if transformer.unique and transformer.method == 'get_or_create':
+            self.buffered.setdefault(table, set()).add(
+                transformer.to_dict().get(transformer.unique)
+            )
+        self.buffer.setdefault(table, []).append({
+            'row': transformed,
+            'relations': self.cache,
+            'destination_id': transformer.destination_id,
+            'transformer': transformer,
+            'source_pk': row.get('id'),
+            'copy': not self.cache and self.copyable(transformer)\
+                and self.copyable_row(transformed)
+        })
+        self.cache = []
+
+        if flush and len(self.buffer[table]) >= (self.batch_size or 1):
+            return self.flush(table)
+        return []
+
+    def flush(self, table=None):
+        """
+        Write buffered rows with one multi-row insert per
+        destination table and resolve their queued relations
+        with the primary keys returned.
+
+        :param str table: Only flush this destination table
+        :return: List of primary keys inserted, in buffered order. Rows bulk loaded with COPY have no primary key and are returned as None
+        """
+        tables = [table] if table else list(self.buffer.keys())
+        pks = []
+        for table in tables:
+            entries = self.buffer.pop(table, [])
+            self.buffered.pop(table, None)
+            if not entries:
+                continue
+            transformer = entries[0]['transformer']
+            if all(entry['copy'] for entry in entries):
+                self.start(transformer, 'copy')
+                self.copy(table, [entry['row'] for entry in entries])
+                self.count(transformer, 'inserted', len(entries))
+                self.stop()
+                pks.extend([None] * len(entries))
+                continue
+            self.start(transformer, 'insert')
+            key = getattr(transformer, 'destination_key', None)
+            if key:
+                rows = self.upsert_batch(table, entries, key)
+            else:
+                rows = self.destination_db.insert_batch(
+                    table, [entry['row'] for entry in entries]
+                )
+            self.count(transformer, 'queries')
+            self.count(transformer, 'inserted', len(entries))
+            self.stop()
+            for entry, row in zip(entries, rows):
+                pk = row.get('id')
+                self.remember(entry['transformer'], entry['row'], pk)
+                self.set_identity(entry['transformer'], entry['source_pk'], pk)
+                for relation in entry['relations']:
+                    for key, value in relation.items():
+                        value[entry['destination_id']] = pk
+                        self.queue_relation(key, value)
+                pks.append(pk)
+
+        # Relation rows of the whole flush are
+        # written together, nothing refers to them
+        if not self.relation_batch:
+            self.flush_relations()
+        return pks
+
+    def flush_isolated(self, table=None):
+        """
+        Flush like flush, in a savepoint. If the multi-row insert
+        of a table fails its rows are written again one at a time,
+        each in its own savepoint, so only the failing rows are
+        rolled back.
+
+        :param str table: Only flush this destination table
+        :return: Tuple of the list of primary keys inserted and a list of (source pk, exception) of the rows rolled back
+        """
+        tables = [table] if table else list(self.buffer.keys())
+        pks = []
+        failed = []
+        for table in tables:
+            entries = list(self.buffer.get(table, []))
+            mark = self.mark()
+            self.destination_db.savepoint('batch')
+            try:
+                pks.extend(self.flush(table))
+            except Exception:
+                self.destination_db.rollback_to_savepoint('batch')
+                self.rollback(mark)
+            else:
+                self.destination_db.release_savepoint('batch')
+                continue
+            for entry in entries:
+                mark = self.mark()
+                self.destination_db.savepoint()
+                self.buffer[table] = [entry]
+                try:
+                    pks.extend(self.flush(table))
+                except Exception as e:
+                    self.destination_db.rollback_to_savepoint()
+                    self.rollback(mark)
+                    self.buffer.pop(table, None)
+                    failed.append((entry['source_pk'], e))
+                else:
+                    self.destination_db.release_savepoint()
+        return pks, failed
+
+    def discard(self):
+        """
+        Drop buffered rows and relation rows that were never written
+        """
+        self.cache = []
+        self.buffer = {}
+        self.buffered = {}
+        self.relations = {}
+        self.relations_failed = False
+
+    def upsert_batch(self, table, entries, key):
+        """
+        Upsert buffered rows by destination_key. ON CONFLICT DO UPDATE
+        can not update the same row twice in one statement, so only
+        the last row of each key is written. Rows with a NULL in
+        their key never conflict and are all written.
+
+        :param str table: Name of destination table
+        :param list entries: Buffered entries
+        :param tuple key: Columns of destination_key
+        :return: List of {id : pk} in the same order as entries
+        """
+        rows = [
+            self.upsert_row(entry['transformer'], entry['row'])
+            for entry in entries
+        ]
+        keys = []
+        last = {}
+        for index, row in enumerate(rows):
+            value = tuple(row.get(column) for column in key)
+            if None in value:
+                value = index
+            keys.append(value)
+            last[value] = index
+        written = sorted(last.values())
+        returned = dict(zip(
+            written,
+            self.destination_db.insert_batch(
+                table, [rows[index] for index in written], key=key
+            )
+        ))
+        return [returned[last[value]] for value in keys]
+
+    def copy(self, table, rows):
+        """
+        Bulk load rows into a destination table with COPY.
+        Like insert_single, columns with a value of None are left out,
+        rows are grouped by the columns they set.
+
+        :param str table: Name of destination table
+        :param list rows: List of transformed rows
+        """
+        groups = {}
+        for row in rows:
+            columns = tuple(
+                key for key, value in row.items() if value != None
+            )
+            groups.setdefault(columns, []).append(
+                tuple(row[key] for key in columns)
+            )
+        for columns, values in groups.items():
+            if columns:
+                self.destination_db.copy_rows(table, columns, values)
+            else:
+                self.destination_db.insert_batch(
+                    table, [{} for value in values]
+                )
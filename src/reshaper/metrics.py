@@ -0,0 +1,196 @@
+import json
+import os
+import time
+
+class Metrics:
+    """
+    Time spent in each stage of a run and counts of rows,
+    queries and cache hits, kept per transformer.
+
+    Stage times are exclusive: time spent in a stage started
+    while another one runs, such as the insert of a row
+    referenced by a SubTransformerField, only counts
+    towards the inner stage.
+
+    Given a path, metrics are exported to it every interval
+    seconds as a Prometheus textfile or as JSON lines.
+    """
+    def __init__(self, path=None, format='prometheus', interval=60):
+        """
+        :param str path: Path of file to export metrics to
+        :param str format: Export format, prometheus or json
+        :param float interval: Seconds between exports
+        """
+        if format not in ('prometheus', 'json'):
+            raise Exception('Unknown metrics format: %s' % format)
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.stages = {}
+        self.counts = {}
+        self.stack = []
+        self.exported = time.time()
+
+    def name(self, transformer):
+        """
+        Returns the name metrics of a transformer are kept under
+        """
+        if isinstance(transformer, str):
+            return transformer
+        return transformer.__class__.__name__
+
+    def start(self, transformer, stage):
+        """
+        Start timing a stage, until the matching stop
+        """
+        self.stack.append([transformer, stage, time.perf_counter(), 0.0])
+
+    def stop(self):
+        """
+        Stop timing the stage started last
+        """
+        transformer, stage, started, inner = self.stack.pop()
+        elapsed = time.perf_counter() - started
+        self.add(transformer, stage, elapsed - inner)
+        if self.stack:
+            self.stack[-1][3] += elapsed
+
+    def reset(self):
+        """
+        Drop the stages left running by a row that failed
+        """
+        self.stack = []
+
+    def add(self, transformer, stage, seconds, calls=1):
+        """
+        Add time spent in a stage
+
+        :param Transformer transformer: Transformer object or name
+        :param str stage: Name of stage
+        :param float seconds: Seconds spent
+        :param int calls: Number of times the stage ran
+        """
+        key = (self.name(transformer), stage)
+        stage = self.stages.get(key)
+        if stage is None:
+            stage = self.stages[key] = [0.0, 0]
+        stage[0] += seconds
+        stage[1] += calls
+
+    def count(self, transformer, counter, n=1):
+        """
+        Increase a counter such as rows, queries or cache_hits
+
+        :param Transformer transformer: Transformer object or name
+        :param str counter: Name of counter
+        :param int n: Amount to increase the counter by
+        """
+        key = (self.name(transformer), counter)
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def stats(self):
+        """
+        Returns the stages and counters of every transformer as
+        {transformer: {'stages': {stage: {'seconds', 'calls'}}, 'counts': {counter: n}}}
+        """
+        stats = {}
+        for (transformer, stage), (seconds, calls) in self.stages.items():
+            stats.setdefault(
+                transformer, {'stages': {}, 'counts': {}}
+            )['stages'][stage] = {'seconds': seconds, 'calls': calls}
+        for (transformer, counter), n in self.counts.items():
+            stats.setdefault(
+                transformer, {'stages': {}, 'counts': {}}
+            )['counts'][counter] = n
+        return stats
+
+    def summary(self):
+        """
+        Print time spent in each stage and the counters
+        of every transformer as a table
+        """
+        stats = self.stats()
+        total = sum(stage[0] for stage in self.stages.values())
+        print('%-30s %-12s %10s %10s %7s' % (
+            'Transformer', 'Stage', 'Calls', 'Seconds', '%'
+        ))
+        for transformer in sorted(stats):
+            stages = stats[transformer]['stages']
+            for stage in sorted(stages, key=lambda stage: -stages[stage]['seconds']):
+                seconds = stages[stage]['seconds']
+                print('%-30s %-12s %10i %10.3f %7.1f' % (
+                    transformer,
+                    stage,
+                    stages[stage]['calls'],
+                    seconds,
+                    seconds * 100 / total if total else 0
+                ))
+            counts = stats[transformer]['counts']
+            if counts:
+                print('%-30s %s' % (transformer, ', '.join(
+                    '%s: %i' % (counter, counts[counter])
+                    for counter in sorted(counts)
+                )))
+
+    def prometheus(self):
+        """
+        Returns metrics in the Prometheus text format
+        """
+        lines = [
+            '# HELP reshaper_stage_seconds_total Seconds spent in a stage',
+            '# TYPE reshaper_stage_seconds_total counter'
+        ]
+        for (transformer, stage), (seconds, calls) in sorted(self.stages.items()):
+            lines.append(
+                'reshaper_stage_seconds_total{transformer="%s",stage="%s"} %f' % (
+                    transformer, stage, seconds
+                )
+            )
+        lines.extend([
+            '# HELP reshaper_stage_calls_total Number of times a stage ran',
+            '# TYPE reshaper_stage_calls_total counter'
+        ])
+        for (transformer, stage), (seconds, calls) in sorted(self.stages.items()):
+            lines.append(
+                'reshaper_stage_calls_total{transformer="%s",stage="%s"} %i' % (
+                    transformer, stage, calls
+                )
+            )
+        for counter in sorted(set(counter for _, counter in self.counts)):
+            lines.append('# TYPE reshaper_%s_total counter' % counter)
+            for (transformer, name), n in sorted(self.counts.items()):
+                if name == counter:
+                    lines.append(
+                        'reshaper_%s_total{transformer="%s"} %i' % (
+                            counter, transformer, n
+                        )
+                    )
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """
+        Export metrics to path. A Prometheus textfile is replaced
+        atomically, JSON lines are appended to.
+        """
+        if not self.path:
+            return
+        self.exported = time.time()
+        if self.format == 'json':
+            with open(self.path, 'a') as metrics_file:
+                metrics_file.write(json.dumps({
+                    'time': self.exported,
+                    'transformers': self.stats()
+                }) + '\n')
+            return
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as metrics_file:
+            metrics_file.write(self.prometheus())
+        os.replace(tmp, self.path)
+
+    def tick(self):
+        """
+        Export metrics if interval seconds have
+        passed since they were last exported
+        """
+        if self.path and time.time() - self.exported >= self.interval:
+            self.export()
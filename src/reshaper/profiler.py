@@ -0,0 +1,100 @@
+import random
+import time
+
+class Profiler:
+    """
+    Times every filter, action and Field.transform override
+    of a run, keyed by transformer, field and function.
+    Keeps the total time and number of calls of each
+    function and a random sample of call latencies
+    to estimate the median and 99th percentile from.
+    """
+    def __init__(self, samples=10000):
+        """
+        :param int samples: Maximum number of latencies kept per function
+        """
+        self.samples = samples
+        self.functions = {}
+
+    def call(self, transformer, field, kind, function, *args):
+        """
+        Call function with args and record how long it took
+
+        :param str transformer: Name of transformer class
+        :param str field: Name of field
+        :param str kind: filter, batch_filter, action or transform
+        :param function function: Function to call
+        :return: Whatever function returns
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        self.record(
+            transformer,
+            field,
+            kind,
+            function,
+            time.perf_counter() - start
+        )
+        return result
+
+    def record(self, transformer, field, kind, function, seconds):
+        """
+        Record a single call of function that took seconds
+        """
+        key = (transformer, field, kind, function)
+        entry = self.functions.get(key)
+        if entry is None:
+            entry = self.functions[key] = [0.0, 0, []]
+        entry[0] += seconds
+        entry[1] += 1
+        latencies = entry[2]
+        if len(latencies) < self.samples:
+            latencies.append(seconds)
+        else:
+            # Reservoir sampling keeps a uniform sample of all calls
+            index = random.randrange(entry[1])
+            if index < self.samples:
+                latencies[index] = seconds
+
+    def stats(self):
+        """
+        Returns a dictionary per profiled function with transformer,
+        field, kind, function name, calls, seconds, p50 and p99,
+        most time consuming first
+        """
+        stats = []
+        for (transformer, field, kind, function), entry in self.functions.items():
+            seconds, calls, latencies = entry
+            latencies = sorted(latencies)
+            stats.append({
+                'transformer': transformer,
+                'field': field,
+                'kind': kind,
+                'function': getattr(function, '__name__', repr(function)),
+                'calls': calls,
+                'seconds': seconds,
+                'p50': latencies[int(0.5 * (len(latencies) - 1))],
+                'p99': latencies[int(0.99 * (len(latencies) - 1))]
+            })
+        stats.sort(key=lambda stat: -stat['seconds'])
+        return stats
+
+    def report(self, top=10):
+        """
+        Print the top most time consuming functions
+
+        :param int top: Number of functions to print
+        """
+        print('%-40s %-12s %-20s %10s %10s %10s %10s' % (
+            'Field', 'Kind', 'Function', 'Calls', 'Seconds', 'p50 us', 'p99 us'
+        ))
+        for stat in self.stats()[:top]:
+            print('%-40s %-12s %-20s %10i %10.3f %10.1f %10.1f' % (
+                '%s.%s' % (stat['transformer'], stat['field']),
+                stat['kind'],
+                stat['function'],
+                stat['calls'],
+                stat['seconds'],
+                stat['p50'] * 1000000,
+                stat['p99'] * 1000000
+            ))
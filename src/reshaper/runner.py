@@ -1,7 +1,14 @@
-import redis
 import os
+import json
+import multiprocessing
+import queue
+import time
 from progressbar import ProgressBar, Bar, Percentage, RotatingMarker, FileTransferSpeed, ETA, Counter
+from .backends.null import DB as NullDB
+from .checkpoints import CheckpointStore, RedisCheckpoints
 from .manager import Manager
+from .metrics import Metrics
+from .profiler import Profiler
 from dotenv import load_dotenv
 
 try:
@@ -9,60 +16,589 @@ try:
 except Exception:
     pass
 
+# Number of source rows read ahead to apply
+# batch filters when prefetch is not set
+CHUNK_SIZE = 1000
+
 
 
 class Runner():
-    def __init__(self, source_db, destination_db, cache=False):
+    def __init__(
+        self,
+        source_db,
+        destination_db,
+        cache=False,
+        identity=None,
+        metrics=None,
+        profiler=None
+    ):
         self.mwidgets = [ 
             Percentage(), ' ', 
             Bar(marker=RotatingMarker()),' ',
             Counter(), ' ',
             ETA(), ' ', 
         ]
+        # Checkpoint store, cache=True uses
+        # the redis configured in .env
         self.cache = None
-        if cache:
-            self.cache = redis.StrictRedis(
+        if isinstance(cache, CheckpointStore):
+            self.cache = cache
+        elif cache:
+            self.cache = RedisCheckpoints(
                 host=os.environ.get('REDIS_HOST'),
                 port=os.environ.get('REDIS_PORT'),
                 db=os.environ.get('REDIS_DB')
             )
+        self.pending_checkpoints = {}
         self.source_db = source_db
         self.destination_db = destination_db
+        self.identity = identity
+        # Metrics of stage timings and counters, metrics=True
+        # keeps them without exporting them
+        self.metrics = metrics
+        if metrics is True:
+            self.metrics = Metrics()
+        # Profiler of filters, actions and Field.transform
+        # overrides, profiler=True profiles with defaults
+        self.profiler = profiler
+        if profiler is True:
+            self.profiler = Profiler()
+        self.commits = []
+        self.failed = []
         self.manager = Manager(
             source_db=source_db,
-            destination_db=destination_db
+            destination_db=destination_db,
+            identity=identity,
+            metrics=self.metrics,
+            profiler=self.profiler
         )
 
-    def run(self, transformer, query=''):
-        last_source_index = 0
+    def checkpoint(self, name, last_source_index, last_destination_index):
+        """
+        Store the last transformed source/destination index
+        so an interrupted run can be resumed. Only called once
+        the rows up to that index are durable in the destination.
+
+        :param str name: Name the checkpoint is stored under
+        """
+        if not self.cache:
+            return
+        self.pending_checkpoints[name] = (
+            last_source_index, last_destination_index
+        )
+        self.flush_checkpoint(name)
+
+    def flush_checkpoint(self, name):
+        """
+        Write the pending checkpoint of name to the checkpoint store
+        """
+        values = self.pending_checkpoints.pop(name, None)
+        if values is None:
+            return
+        # Relation rows and identity map entries of
+        # checkpointed rows must be written first
+        self.manager.flush_relations()
+        if self.identity is not None:
+            self.identity.spill()
+        self.cache.set({
+            '%s_last_source_index' % name: values[0],
+            '%s_last_destination_index' % name: values[1]
+        })
+
+    def prepare_chunk(self, transformer, chunk, prefetch=False):
+        """
+        Prefetch the rows referenced by a chunk of source
+        rows and apply batch filters to it
+        """
+        if prefetch:
+            self.manager.prefetch(transformer, chunk)
+        if transformer._batch:
+            self.manager.apply_batch_filters(transformer, chunk)
+
+    def chunks(self, transformer, rows, size, prefetch=False):
+        """
+        Iterate over source rows in chunks of size rows,
+        preparing each chunk before it is transformed
+
+        :param Transformer transformer: Transformer object
+        :param rows: Iterable of source rows
+        :param int size: Number of rows in a chunk
+        :param boolean prefetch: Prefetch the rows referenced by each chunk
+        """
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= size:
+                self.prepare_chunk(transformer, chunk, prefetch)
+                for prepared in chunk:
+                    yield prepared
+                chunk = []
+        if chunk:
+            self.prepare_chunk(transformer, chunk, prefetch)
+            for prepared in chunk:
+                yield prepared
+
+    def timed(self, transformer, rows):
+        """
+        Iterate over source rows, timing the reads
+        as the read stage of transformer
+        """
+        rows = iter(rows)
+        while True:
+            self.metrics.start(transformer, 'read')
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.metrics.stop()
+                return
+            self.metrics.stop()
+            yield row
+
+    def resume_index(self, name, default=0):
+        """
+        Returns the last source index checkpointed under name,
+        or default if nothing has been checkpointed
+        """
+        if not self.cache:
+            return default
+        lsi = self.cache.get('%s_last_source_index' % name)
+        if not lsi:
+            return default
+        return int(lsi)
+
+    def resume_key(self, name):
+        """
+        Returns the key of the last source row checkpointed
+        under name by a keyset paginated run as a tuple,
+        or None if nothing has been checkpointed
+        """
+        if not self.cache:
+            return None
+        lsi = self.cache.get('%s_last_source_index' % name)
+        if not lsi:
+            return None
+        key = json.loads(lsi)
+        if isinstance(key, list):
+            return tuple(key)
+        return (key,)
+
+    def select_list(self, transformers):
+        """
+        Returns the select list of the source columns read
+        by transformers, * if one of them reads all columns
+
+        :param list transformers: List of Transformer objects
+        """
+        columns = set()
+        for transformer in transformers:
+            if transformer._columns is None:
+                return '*'
+            columns.update(transformer._columns)
+        return ','.join(sorted(columns))
+
+    def commit(self, name, rows, last_source_index, last_destination_index):
+        """
+        Commit the destination transaction, recording its latency,
+        and checkpoint the rows it made durable
+        """
+        self.manager.flush_relations()
+        start = time.time()
+        self.destination_db.commit()
+        latency = time.time() - start
+        self.commits.append((rows, latency))
+        if self.metrics is not None:
+            self.metrics.add(name, 'commit', latency)
+        # Entries of committed rows can no longer be rolled back
+        self.manager.journal = []
+        if self.identity is not None:
+            self.identity.overflow()
+        self.checkpoint(name, last_source_index, last_destination_index)
+
+    def fail(self, transformer, source_index, error):
+        """
+        Record a row that failed and was rolled back
+        """
+        self.failed.append((source_index, error))
+        if self.metrics is not None:
+            self.metrics.reset()
+            self.metrics.count(transformer, 'failed')
+
+    def flush(self, transformer, table=None, isolate=False):
+        """
+        Write buffered rows. With isolate, rows of a multi-row
+        insert that fails are written again one at a time and
+        only the failing rows are rolled back and recorded.
+
+        :return: List of primary keys inserted
+        """
+        if not isolate:
+            return self.manager.flush(table)
+        pks, failed = self.manager.flush_isolated(table)
+        for source_pk, e in failed:
+            self.fail(transformer, source_pk, e)
+        return pks
+
+    def setup(self, transformer, warm_lookups=False):
+        """
+        Prepare transforming the rows of transformer
+        """
+        if warm_lookups:
+            self.manager.warm_lookups(transformer)
+
+    def finish(self):
+        """
+        Spill the identity map and export metrics once rows are transformed
+        """
+        if self.identity is not None:
+            self.identity.spill()
+        if self.metrics is not None:
+            self.metrics.export()
+
+    def transform_rows(
+        self,
+        transformer,
+        name,
+        select,
+        batch_size=None,
+        itersize=None,
+        warm_lookups=False,
+        prefetch=None,
+        commit_every=None,
+        commit_seconds=None,
+        isolate=True,
+        checkpoint_every=None,
+        checkpoint_seconds=None,
+        progress=None,
+        rows=None,
+        key=None,
+        relation_batch=None,
+        relation_conflict='error',
+        shared=False
+    ):
+        """
+        Transform every row returned by a select on the source database,
+        checkpointing the last source index under name
+
+        :param Transformer transformer: Transformer object
+        :param str name: Name checkpoints are stored under
+        :param str select: Query selecting source rows ordered by id
+        :param rows: Iterable of source rows transformed instead of running select
+        :param tuple key: Columns identifying source rows, checkpointed as a JSON list instead of the id
+        :param int commit_every: Write to the destination in transactions committed every commit_every rows
+        :param float commit_seconds: Commit the destination transaction at least every commit_seconds seconds
+        :param boolean isolate: In a transaction, wrap each row in a savepoint so a failing row is rolled back and skipped
+        :param int checkpoint_every: Write checkpoints every checkpoint_every rows, in transactions committed with each checkpoint
+        :param float checkpoint_seconds: Write checkpoints every checkpoint_seconds seconds, in transactions committed with each checkpoint
+        :param callable progress: Called with the number of rows transformed so far
+        :param int relation_batch: Buffer relation rows and write them relation_batch rows at a time
+        :param str relation_conflict: error fails on a relation row that already exists, ignore skips it
+        :param boolean shared: Rows are a page of a shared scan, setup and finish are left to run_shared
+
+        :return: Number of rows transformed
+        """
+        # Indexes of the last row whose writes
+        # have been sent to the destination
+        last_source_index = None
         last_destination_index = 0
         count = 0
-        transformer_name = transformer.__class__.__name__
+        uncommitted = 0
+        # Checkpoints are written with every commit, so the rows
+        # they cover are never written again by a resumed run
+        if checkpoint_every or checkpoint_seconds:
+            if commit_every or commit_seconds:
+                raise Exception(
+                    'Checkpoints are written with every commit, pass either commit_every/commit_seconds or checkpoint_every/checkpoint_seconds'
+                )
+            commit_every = checkpoint_every
+            commit_seconds = checkpoint_seconds
+        transactional = bool(commit_every or commit_seconds)
+        isolate = transactional and isolate
+        if isolate and relation_batch:
+            raise Exception(
+                'relation_batch writes relation rows outside of the savepoints of isolate, pass isolate=False'
+            )
+        table = transformer.destination_table
+        self.failed = []
+        self.commits = []
+        if not shared:
+            self.setup(transformer, warm_lookups)
+        if self.metrics is not None:
+            self.metrics.reset()
 
-        if self.cache:
-            if not query:
-                query = 'WHERE id >'
-            lsi = self.cache.get(
-                '%s_last_source_index' % transformer_name
+        if rows is not None:
+            source = iter(rows)
+        elif itersize:
+            source = self.source_db.stream(select, itersize)
+        else:
+            source = self.source_db.cursor()
+            source.execute(select)
+
+        cursor = source
+        if self.metrics is not None:
+            cursor = self.timed(transformer, source)
+        if prefetch or transformer._batch:
+            cursor = self.chunks(
+                transformer,
+                cursor,
+                prefetch or CHUNK_SIZE,
+                prefetch=bool(prefetch)
             )
-            if lsi:
-                lsi = lsi.decode('utf-8')
+
+        self.manager.batch_size = batch_size
+        self.manager.relation_batch = relation_batch
+        self.manager.relation_conflict = relation_conflict
+        if transactional:
+            self.destination_db.begin()
+            # Undone if the transaction is rolled back
+            self.manager.journal = []
+            if self.identity is not None:
+                self.identity.hold()
+            last_commit = time.time()
+
+        try:
+            for row in cursor:
+                if key:
+                    source_index = json.dumps(
+                        [row.get(column) for column in key], default=str
+                    )
+                else:
+                    source_index = row.get('id')
+                count += 1
+                written = False
+
+                mark = self.manager.mark()
+                if isolate:
+                    self.destination_db.savepoint()
+                try:
+                    if batch_size:
+                        self.manager.queue(transformer, row, flush=False)
+                    else:
+                        pk = self.manager.transform(transformer, row)
+                except Exception as e:
+                    if not isolate:
+                        raise
+                    self.destination_db.rollback_to_savepoint()
+                    self.manager.rollback(mark)
+                    self.fail(transformer, source_index, e)
+                else:
+                    if isolate:
+                        self.destination_db.release_savepoint()
+                    if not batch_size and pk is not None:
+                        last_destination_index = pk
+
+                # Batched rows are only written once
+                # their batch has been flushed
+                if batch_size:
+                    if self.manager.pending(table) >= batch_size:
+                        pks = self.flush(transformer, table, isolate)
+                        if pks and pks[-1] is not None:
+                            last_destination_index = pks[-1]
+                        last_source_index = source_index
+                        written = True
+                else:
+                    last_source_index = source_index
+                    written = True
+
+                if relation_batch\
+                and self.manager.pending_relations() >= relation_batch:
+                    self.manager.flush_relations()
+
+                if transactional:
+                    uncommitted += 1
+                    if (commit_every and uncommitted >= commit_every)\
+                    or (commit_seconds and time.time() - last_commit >= commit_seconds):
+                        if last_source_index is not None:
+                            self.commit(
+                                name,
+                                uncommitted,
+                                last_source_index,
+                                last_destination_index
+                            )
+                        uncommitted = 0
+                        last_commit = time.time()
+                elif written:
+                    self.checkpoint(
+                        name,
+                        last_source_index,
+                        last_destination_index
+                    )
+                if progress:
+                    progress(count)
+                if self.metrics is not None:
+                    self.metrics.count(transformer, 'rows')
+                    self.metrics.tick()
+
+            if batch_size:
+                pks = self.flush(transformer, isolate=isolate)
+                if pks and pks[-1] is not None:
+                    last_destination_index = pks[-1]
+                if count:
+                    last_source_index = source_index
+            self.manager.flush_relations()
+
+            if transactional:
+                if uncommitted and last_source_index is not None:
+                    self.commit(
+                        name,
+                        uncommitted,
+                        last_source_index,
+                        last_destination_index
+                    )
+                self.destination_db.end()
+            elif batch_size and count:
+                self.checkpoint(
+                    name,
+                    last_source_index,
+                    last_destination_index
+                )
+        except Exception:
+            if transactional:
+                # Lookup cache and identity map entries of the
+                # rolled back rows are undone, their buffered
+                # and relation rows are dropped
+                self.destination_db.end(commit=False)
+                self.manager.rollback()
+                self.manager.discard()
             else:
-                lsi = '0'
-            ldi = self.cache.get(
-                '%s_last_destination_index' % transformer_name
+                # Relation rows of the rows already written are
+                # written too. If they can not be, because writing
+                # them is what failed, those rows are not checkpointed
+                try:
+                    self.manager.flush_relations()
+                except Exception:
+                    self.pending_checkpoints.pop(name, None)
+                self.manager.discard()
+            raise
+        finally:
+            # Whatever was checkpointed is durable by now
+            self.flush_checkpoint(name)
+            self.manager.journal = None
+            if self.identity is not None:
+                # Entries of rolled back rows are undone by now,
+                # the others are of written rows and are kept
+                self.identity.hold(False)
+                self.identity.spill()
+            self.manager.clear_prefetched()
+            self.manager.batched = {}
+            if hasattr(source, 'close'):
+                source.close()
+
+        if not shared:
+            self.finish()
+        return count
+
+    def report(self, transformer_name):
+        """
+        Print commits and failed rows of the last run,
+        metrics and the profile of fields
+        """
+        self.report_rows(transformer_name)
+        if self.metrics is not None:
+            self.metrics.summary()
+        if self.profiler is not None:
+            self.profiler.report()
+
+    def report_rows(self, transformer_name):
+        """
+        Print commits and failed rows of the last run
+        """
+        if self.commits:
+            rows = sum(commit[0] for commit in self.commits)
+            latency = sum(commit[1] for commit in self.commits)
+            print("%s - %i commits, %.1f rows per commit, %.2fms average commit latency" % (
+                transformer_name,
+                len(self.commits),
+                float(rows) / len(self.commits),
+                latency * 1000 / len(self.commits)
+            ))
+        if self.failed:
+            print("%s - %i rows failed and were rolled back, source ids: %s" % (
+                transformer_name,
+                len(self.failed),
+                ', '.join(str(failed[0]) for failed in self.failed[:20])
+            ))
+
+    def run(
+        self,
+        transformer,
+        query='',
+        estimate=False,
+        page_size=CHUNK_SIZE,
+        dry_run=False,
+        **options
+    ):
+        """
+        Transform all rows of the transformers source table.
+        Source rows are selected ordered by id, or read in pages
+        of page_size rows if the transformer declares order_by
+        or a watermark.
+
+        :param Transformer transformer: Transformer object
+        :param str query: Extra query appended to the source select
+        :param boolean estimate: Use the planner row estimate instead of COUNT(*) for the progress bar
+        :param int page_size: Number of rows read per page with order_by
+        :param dry_run: Write to a null sink instead of the destination database, True or a reshaper.backends.null.DB
+        :param int batch_size: Buffer transformed rows and insert them batch_size rows at a time
+        :param int itersize: Stream source rows through a server-side cursor, itersize rows at a time
+        :param boolean warm_lookups: Preload the unique lookup caches of small destination tables before transforming
+        :param int prefetch: Read source rows prefetch rows at a time and fetch the rows they reference in bulk
+        :param int commit_every: Write to the destination in transactions committed every commit_every rows
+        :param float commit_seconds: Commit the destination transaction at least every commit_seconds seconds
+        :param boolean isolate: In a transaction, wrap each row in a savepoint so a failing row is rolled back and skipped
+        :param int relation_batch: Buffer relation rows and write them relation_batch rows at a time
+        :param str relation_conflict: error fails on a relation row that already exists, ignore skips it
+
+        :return: Number of rows transformed
+        """
+        # Changed rows are read again and would be
+        # inserted a second time instead of updated
+        if getattr(transformer, 'watermark', None)\
+        and not getattr(transformer, 'destination_key', None):
+            raise Exception(
+                '%s - A watermark needs a destination_key to update the rows it reads again' % (
+                    transformer.__class__.__name__
+                )
+            )
+        if dry_run:
+            return self.dry_run(
+                transformer,
+                dry_run,
+                query=query,
+                estimate=estimate,
+                page_size=page_size,
+                **options
             )
 
-            if ldi:
-                ldi = ldi.decode('utf-8')
-            else:
-                ldi = '0'
-            query = '%s %s' % (query, lsi)
+        transformer_name = transformer.__class__.__name__
+        order_by = getattr(transformer, 'order_by', None)
+
+        if self.cache and not order_by:
+            if not query:
+                query = 'WHERE id >'
+            query = '%s %s' % (
+                query, self.resume_index(transformer_name)
+            )
 
         source_table = transformer.source_table
-        row_len = self.source_db.get_table_row_count(
-            source_table, query
-        )
+        # A row-value comparison with NULL is never true,
+        # keyset pages would never read those rows
+        watermark = getattr(transformer, 'watermark', None)
+        if watermark and self.source_db.get_table_row_count(
+            source_table, 'WHERE %s IS NULL' % watermark
+        ):
+            raise Exception(
+                '%s - Rows of %s without a watermark are never read, %s must be NOT NULL' % (
+                    transformer_name, source_table, watermark
+                )
+            )
+        if estimate:
+            row_len = self.source_db.get_table_row_estimate(
+                source_table
+            )
+        else:
+            row_len = self.source_db.get_table_row_count(
+                source_table, query
+            )
         pbar = ProgressBar(
             widgets = self.mwidgets,
             maxval = row_len
@@ -70,27 +606,408 @@ class Runner():
         
         print("%s - Transforming %i objects" % (transformer_name, row_len))
 
-        cursor = self.source_db.cursor()
-        cursor.execute(
-            """ SELECT * FROM %s %s ORDER BY id ASC""" % (source_table, query)
+        if order_by:
+            options['rows'] = self.source_db.keyset(
+                source_table,
+                order_by,
+                size=page_size,
+                after=self.resume_key(transformer_name),
+                query=query,
+                columns=transformer._columns
+            )
+            options['key'] = order_by
+            select = None
+        else:
+            select = """ SELECT %s FROM %s %s ORDER BY id ASC""" % (
+                self.select_list([transformer]), source_table, query
+            )
+
+        # An estimated row count can be lower than
+        # the number of rows actually transformed
+        count = self.transform_rows(
+            transformer,
+            transformer_name,
+            select,
+            progress=lambda count: pbar.update(min(count, row_len)),
+            **options
         )
+        pbar.finish()
+        self.report(transformer_name)
+        return count
 
-        for row in cursor:
-            last_destination_index = self.manager.transform(
-                transformer, row
-            )
-            last_source_index = row.get('id')
-            count += 1
-            pbar.update(count)
+    def run_shared(
+        self,
+        transformers,
+        query='',
+        estimate=False,
+        page_size=CHUNK_SIZE,
+        dry_run=False,
+        itersize=None,
+        **options
+    ):
+        """
+        Transform the rows of a source table read by several transformers
+        with a single scan. Every page_size source rows read are transformed
+        by each transformer in turn, each checkpointing under its own name
+        so they resume independently. The scan starts after the lowest
+        checkpoint and a transformer skips the rows it already transformed.
+        Rows are read ordered by id, transformers declaring order_by
+        can not share a scan. Takes the same options as run except dry_run.
 
-            if self.cache:
-                self.cache.set(
-                    '%s_last_source_index' % transformer_name,
-                    last_source_index
+        :param list transformers: List of Transformer objects with the same source table
+        :param str query: Extra query appended to the source select
+        :param boolean estimate: Use the planner row estimate instead of COUNT(*) for the progress bar
+        :param int page_size: Number of source rows transformed by every transformer at a time
+        :param int itersize: Stream source rows through a server-side cursor, itersize rows at a time
+
+        :return: Number of rows transformed by each transformer, keyed by transformer name
+        """
+        if dry_run:
+            raise Exception('A shared scan can not be a dry run, dry run each transformer instead')
+        for option in ('rows', 'key', 'progress', 'shared'):
+            if option in options:
+                raise Exception('%s is set by a shared scan and can not be passed' % option)
+        tables = set(transformer.source_table for transformer in transformers)
+        if len(tables) != 1:
+            raise Exception(
+                'Transformers of a shared scan need the same source table, got: %s' % ', '.join(
+                    sorted(str(table) for table in tables)
                 )
-                self.cache.set(
-                    '%s_last_destination_index' % transformer_name,
-                    last_destination_index
+            )
+        for transformer in transformers:
+            if getattr(transformer, 'order_by', None):
+                raise Exception(
+                    '%s - A shared scan reads rows ordered by id, order_by is not supported' % (
+                        transformer.__class__.__name__
+                    )
                 )
+        names = [transformer.__class__.__name__ for transformer in transformers]
+        if len(set(names)) != len(names):
+            raise Exception('Transformers of a shared scan checkpoint by class name and must be distinct')
+        source_table = tables.pop()
+
+        resume = dict((name, self.resume_index(name)) for name in names)
+        if self.cache:
+            if not query:
+                query = 'WHERE id >'
+            query = '%s %s' % (query, min(resume.values()))
+
+        if estimate:
+            row_len = self.source_db.get_table_row_estimate(source_table)
+        else:
+            row_len = self.source_db.get_table_row_count(source_table, query)
+        pbar = ProgressBar(
+            widgets = self.mwidgets,
+            maxval = row_len
+        ).start()
+
+        print("%s - Transforming %i objects with %i transformers: %s" % (
+            source_table, row_len, len(transformers), ', '.join(names)
+        ))
+
+        select = """ SELECT %s FROM %s %s ORDER BY id ASC""" % (
+            self.select_list(transformers), source_table, query
+        )
+        if itersize:
+            scan = self.source_db.stream(select, itersize)
+        else:
+            scan = self.source_db.cursor()
+            scan.execute(select)
+        rows = scan
+        if self.metrics is not None:
+            rows = self.timed(source_table, scan)
+
+        counts = dict((name, 0) for name in names)
+        commits = dict((name, []) for name in names)
+        failed = dict((name, []) for name in names)
+
+        def transform(page):
+            for transformer, name in zip(transformers, names):
+                part = [row for row in page if row.get('id') > resume[name]]
+                if not part:
+                    continue
+                counts[name] += self.transform_rows(
+                    transformer, name, None, rows=part, shared=True, **options
+                )
+                commits[name].extend(self.commits)
+                failed[name].extend(self.failed)
+
+        for transformer, name in zip(transformers, names):
+            self.setup(transformer, options.get('warm_lookups', False))
+
+        scanned = 0
+        try:
+            page = []
+            for row in rows:
+                page.append(row)
+                if len(page) >= page_size:
+                    transform(page)
+                    scanned += len(page)
+                    pbar.update(min(scanned, row_len))
+                    page = []
+            if page:
+                transform(page)
+                scanned += len(page)
+                pbar.update(min(scanned, row_len))
+        finally:
+            if hasattr(scan, 'close'):
+                scan.close()
         pbar.finish()
+        self.finish()
+
+        for name in names:
+            self.commits = commits[name]
+            self.failed = failed[name]
+            self.report_rows(name)
+        if self.metrics is not None:
+            self.metrics.summary()
+        if self.profiler is not None:
+            self.profiler.report()
+        return counts
+
+    def dry_run(self, transformer, sink=True, **options):
+        """
+        Transform all rows of the transformers source table into a
+        null sink, which accepts every write and hands out synthetic
+        primary keys. Reads every source row regardless of checkpoints
+        and writes none, lookups and the identity map of this runner
+        are left untouched. Takes the same options as run.
+
+        :param Transformer transformer: Transformer object
+        :param sink: reshaper.backends.null.DB to write to, True writes to one keeping column statistics
+        :return: Number of rows transformed
+        """
+        if not isinstance(sink, NullDB):
+            sink = NullDB(stats=True)
+        runner = Runner(
+            self.source_db,
+            sink,
+            metrics=self.metrics,
+            profiler=self.profiler
+        )
+        count = runner.run(transformer, **options)
+        sink.report()
         return count
+
+    def partition(self, transformer, workers, percentiles=False):
+        """
+        Split the source table of a transformer into id ranges.
+        With a cache the partitions are stored so a resumed run
+        uses the same ranges, the last one is extended to
+        include rows added since.
+
+        :param Transformer transformer: Transformer object
+        :param int workers: Number of ranges
+        :param boolean percentiles: Split by row count instead of evenly between the lowest and highest id
+        :return: A list of (low, high) id ranges, both inclusive
+        """
+        key = '%s_partitions' % transformer.__class__.__name__
+        low, high = self.source_db.get_id_bounds(transformer.source_table)
+        if low is None:
+            return []
+
+        if self.cache:
+            partitions = self.cache.get(key)
+            if partitions:
+                partitions = [
+                    tuple(partition)
+                    for partition in json.loads(partitions)
+                ]
+                start, end = partitions[-1]
+                partitions[-1] = (start, max(end, high))
+                return partitions
+
+        if workers <= 1:
+            cuts = []
+        elif percentiles:
+            cuts = self.source_db.get_id_percentiles(
+                transformer.source_table, workers
+            )
+        else:
+            step = float(high - low + 1) / workers
+            cuts = [low + int(step * i) - 1 for i in range(1, workers)]
+
+        partitions = []
+        start = low
+        for cut in cuts:
+            if cut >= start and cut < high:
+                partitions.append((start, cut))
+                start = cut + 1
+        partitions.append((start, high))
+
+        if self.cache:
+            self.cache.set({key: json.dumps(partitions)})
+        return partitions
+
+    def run_partition(self, transformer, low, high, progress=None, **options):
+        """
+        Transform the rows of a single id range, checkpointing
+        under the name of the transformer and the lowest id of the
+        range so each range resumes independently, also once the
+        last range has been extended to include new rows
+
+        :param Transformer transformer: Transformer object
+        :param int low: Lowest id of range
+        :param int high: Highest id of range
+        :param callable progress: Called with the number of rows transformed so far
+
+        :return: Number of rows transformed
+        """
+        self.check_partition(transformer, options)
+        name = '%s_%i' % (transformer.__class__.__name__, low)
+        start = max(self.resume_index(name, low - 1), low - 1)
+        return self.transform_rows(
+            transformer,
+            name,
+            """ SELECT %s FROM %s WHERE id > %i AND id <= %i ORDER BY id ASC""" % (
+                self.select_list([transformer]), transformer.source_table, start, high
+            ),
+            progress=progress,
+            **options
+        )
+
+    def check_partition(self, transformer, options):
+        """
+        Raises if rows of transformer can not be transformed in id
+        ranges, or options apply to a whole run and not to a range
+        """
+        if transformer.order_by:
+            raise Exception(
+                '%s is read in order_by order, its rows can not be partitioned by id' % (
+                    transformer.__class__.__name__
+                )
+            )
+        for option in ('query', 'estimate', 'page_size', 'dry_run'):
+            if option in options:
+                raise Exception(
+                    '%s is not supported when rows are partitioned by id' % option
+                )
+
+    def check_cache(self):
+        """
+        Raises if the checkpoint store can not be
+        written by worker processes at the same time
+        """
+        if self.cache is not None and not self.cache.shared:
+            raise Exception(
+                '%s can not be shared between worker processes, use SQLiteCheckpoints or RedisCheckpoints' % (
+                    self.cache.__class__.__name__
+                )
+            )
+
+    def run_parallel(
+        self,
+        transformer,
+        workers=2,
+        percentiles=False,
+        estimate=False,
+        **options
+    ):
+        """
+        Transform all rows of the transformers source table with
+        worker processes, each transforming a range of ids with
+        its own source and destination connections.
+        Takes the same options as run except query, page_size and dry_run,
+        transformers that declare order_by or watermark can not be partitioned.
+
+        :param Transformer transformer: Transformer object
+        :param int workers: Number of worker processes
+        :param boolean percentiles: Split ranges by row count instead of evenly between the lowest and highest id
+        :param boolean estimate: Use the planner row estimate instead of COUNT(*) for the progress bar
+
+        :return: Number of rows transformed
+        """
+        if self.identity is not None:
+            raise Exception(
+                'An identity map can not be shared between worker processes'
+            )
+        self.check_cache()
+        self.check_partition(transformer, options)
+
+        transformer_name = transformer.__class__.__name__
+        partitions = self.partition(transformer, workers, percentiles)
+        if estimate:
+            row_len = self.source_db.get_table_row_estimate(
+                transformer.source_table
+            )
+        else:
+            row_len = self.source_db.get_table_row_count(
+                transformer.source_table
+            )
+        pbar = ProgressBar(
+            widgets = self.mwidgets,
+            maxval = row_len
+        ).start()
+
+        print("%s - Transforming %i objects with %i workers" % (
+            transformer_name, row_len, len(partitions)
+        ))
+
+        # Spawned processes do not inherit the
+        # connections of the parent process
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        processes = []
+        for low, high in partitions:
+            process = context.Process(
+                target=run_partition,
+                args=(
+                    self.source_db,
+                    self.destination_db,
+                    self.cache,
+                    transformer,
+                    low,
+                    high,
+                    progress,
+                    options
+                )
+            )
+            process.start()
+            processes.append(process)
+
+        counts = {}
+        while any(process.is_alive() for process in processes)\
+        or not progress.empty():
+            try:
+                partition, count = progress.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            counts[partition] = count
+            pbar.update(min(sum(counts.values()), row_len))
+
+        for process, partition in zip(processes, partitions):
+            process.join()
+            if process.exitcode != 0:
+                raise Exception(
+                    '%s - Partition %i-%i failed' % ((transformer_name,) + partition)
+                )
+        pbar.finish()
+        return sum(counts.values())
+
+
+def run_partition(
+    source_db,
+    destination_db,
+    cache,
+    transformer,
+    low,
+    high,
+    progress,
+    options
+):
+    """
+    Entry point of a run_parallel worker process,
+    reports (partition, count) to the progress queue
+    """
+    runner = Runner(source_db, destination_db, cache=cache)
+    partition = (low, high)
+
+    def report(count):
+        if count % 100 == 0:
+            progress.put((partition, count))
+
+    count = runner.run_partition(
+        transformer, low, high, progress=report, **options
+    )
+    progress.put((partition, count))
+    return count
@@ -0,0 +1,199 @@
+import multiprocessing
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from .runner import Runner
+from .transformers import RelationTransformerField, SubTransformerField
+
+class Scheduler:
+    """
+    Runs a set of transformers in dependency order.
+    A transformer referencing another transformer of the set
+    through a SubTransformerField or RelationTransformerField
+    only starts once that transformer has finished, transformers
+    that do not depend on each other run concurrently in
+    worker processes.
+    """
+    def __init__(self, runner, workers=2):
+        """
+        :param Runner runner: Runner whose databases, cache and identity map the workers use
+        :param int workers: Number of worker processes
+        """
+        self.runner = runner
+        self.workers = workers
+        self.timings = {}
+        self.elapsed = 0
+
+    def dependencies(self, transformers):
+        """
+        Returns the names of the transformers each
+        transformer depends on, keyed by transformer name
+
+        :param list transformers: List of Transformer objects
+        """
+        names = dict(
+            (transformer.__class__, transformer.__class__.__name__)
+            for transformer in transformers
+        )
+        graph = {}
+        for transformer in transformers:
+            depends = set()
+            for field in transformer._fields.values():
+                if isinstance(field, (SubTransformerField, RelationTransformerField))\
+                and field.transformer in names\
+                and field.transformer is not transformer.__class__:
+                    depends.add(names[field.transformer])
+            graph[transformer.__class__.__name__] = depends
+        return graph
+
+    def order(self, transformers):
+        """
+        Returns the names of the transformers grouped in levels,
+        every transformer only depends on transformers of earlier levels
+
+        :param list transformers: List of Transformer objects
+        """
+        graph = self.dependencies(transformers)
+        levels = []
+        done = set()
+        while len(done) < len(graph):
+            level = sorted(
+                name for name, depends in graph.items()
+                if name not in done and depends <= done
+            )
+            if not level:
+                raise Exception(
+                    'Circular dependency between transformers: %s' % ', '.join(
+                        sorted(set(graph) - done)
+                    )
+                )
+            levels.append(level)
+            done.update(level)
+        return levels
+
+    def check_identity(self, graph):
+        """
+        Worker processes only reuse the rows migrated by the
+        transformers a transformer depends on through an identity
+        map backed by a file. Raises for an identity map held in
+        memory, warns without one.
+
+        :param dict graph: Dependencies of every transformer as returned by dependencies
+        """
+        if not any(graph.values()):
+            return
+        identity = self.runner.identity
+        if identity is None:
+            warnings.warn(
+                'Scheduled without an identity map, transformers depending on others '
+                'insert the rows they reference again: %s' % ', '.join(
+                    sorted(name for name, depends in graph.items() if depends)
+                )
+            )
+        elif not identity.path:
+            raise Exception(
+                'An identity map without a path can not be shared between worker processes'
+            )
+
+    def run(self, transformers, **options):
+        """
+        Run all transformers, each as soon as the
+        transformers it depends on have finished.
+        Takes the same options as Runner.run.
+
+        :param list transformers: List of Transformer objects
+
+        :return: Rows transformed and wall time in seconds of each transformer, keyed by transformer name
+        """
+        # Raises on circular dependencies
+        self.order(transformers)
+
+        graph = self.dependencies(transformers)
+        self.check_identity(graph)
+        self.runner.check_cache()
+        by_name = dict(
+            (transformer.__class__.__name__, transformer)
+            for transformer in transformers
+        )
+        pending = dict(graph)
+        running = {}
+        self.timings = {}
+        start = time.time()
+
+        # Spawned processes do not inherit the
+        # connections of the parent process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context
+        ) as pool:
+            while pending or running:
+                waiting = set(pending) | set(running.values())
+                for name in sorted(pending):
+                    if not pending[name] & waiting:
+                        del pending[name]
+                        future = pool.submit(
+                            run_transformer,
+                            self.runner.source_db,
+                            self.runner.destination_db,
+                            self.runner.cache,
+                            self.runner.identity,
+                            by_name[name],
+                            options
+                        )
+                        running[future] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    count, seconds = future.result()
+                    self.timings[name] = {
+                        'count': count,
+                        'seconds': seconds
+                    }
+
+        self.elapsed = time.time() - start
+        return self.timings
+
+    def report(self):
+        """
+        Print rows transformed and wall time of each
+        transformer of the last run
+        """
+        print('%-30s %12s %10s %10s' % ('Transformer', 'Rows', 'Seconds', 'Rows/s'))
+        for name, timing in sorted(
+            self.timings.items(), key=lambda item: -item[1]['seconds']
+        ):
+            seconds = timing['seconds']
+            print('%-30s %12i %10.2f %10.1f' % (
+                name,
+                timing['count'],
+                seconds,
+                timing['count'] / seconds if seconds else 0
+            ))
+        print('Total wall time %.2f seconds, %.2f seconds of work' % (
+            self.elapsed,
+            sum(timing['seconds'] for timing in self.timings.values())
+        ))
+
+
+def run_transformer(
+    source_db,
+    destination_db,
+    cache,
+    identity,
+    transformer,
+    options
+):
+    """
+    Entry point of a Scheduler worker process
+
+    :return: Tuple of rows transformed and wall time in seconds
+    """
+    runner = Runner(
+        source_db, destination_db, cache=cache, identity=identity
+    )
+    start = time.time()
+    count = runner.run(transformer, **options)
+    if identity is not None:
+        identity.close()
+    return count, time.time() - start
@@ -1,4 +1,21 @@
+def batch_filter(function):
+    """
+    Marks a filter as batch capable.
+    A batch filter is called once per chunk of source rows
+    with a list of the values of a whole column and returns
+    the filtered values in the same order, as a list or any
+    other sequence such as a NumPy array.
+    Filters run in the order they are declared, a batch filter
+    gets the values returned by the filters before it.
+    """
+    function.batch = True
+    return function
+
 class Field:
+    # Kind of field, used by Manager to decide
+    # how a field is resolved
+    kind = None
+
     def __init__(
         self,
         source=None,
@@ -28,19 +45,62 @@ class Field:
         """
         Applies field filters to value.
         Filters are applied in the same order
-        they are passed in.
+        they are passed in, batch filters are
+        called with a list holding the value.
 
         :param str value: Field value
         """
         if not self.filters:
             return
 
-        val = self.filters[n](value)
-        if len(self.filters)-1 == n:
-            return val
-        else:
-            n += 1
-            return self.apply_filters(val, n)
+        for field_filter in self.filters[n:]:
+            if getattr(field_filter, 'batch', False):
+                value = field_filter([value])[0]
+            else:
+                value = field_filter(value)
+        return value
+
+    def compose_batch_filters(self):
+        """
+        Returns a single function applying all filters of the field
+        in order to a column of values, batch filters to the whole
+        column and the other filters to each value of it,
+        or None if the field has no batch filters
+        """
+        filters = tuple(self.filters)
+        if not any(getattr(field_filter, 'batch', False) for field_filter in filters):
+            return None
+        if len(filters) == 1:
+            return filters[0]
+
+        def apply(values):
+            for field_filter in filters:
+                if getattr(field_filter, 'batch', False):
+                    values = field_filter(values)
+                else:
+                    values = [field_filter(value) for value in values]
+            return values
+        return apply
+
+    def compose_filters(self):
+        """
+        Returns a single function applying all filters of the field
+        in order to a single value, or None if it has none
+        """
+        filters = tuple(self.filters)
+        if not filters:
+            return None
+        if len(filters) == 1 and not getattr(filters[0], 'batch', False):
+            return filters[0]
+
+        def apply(value):
+            for field_filter in filters:
+                if getattr(field_filter, 'batch', False):
+                    value = field_filter([value])[0]
+                else:
+                    value = field_filter(value)
+            return value
+        return apply
 
     def run_actions(self, value):
         """
@@ -50,8 +110,8 @@ class Field:
 
         :param str value: Value from field in source db
         """
-        if field.actions:
-            for action in field.actions:
+        if self.actions:
+            for action in self.actions:
                 action(value)
 
 class TransformerField(Field):
@@ -62,9 +122,11 @@ class TransformerField(Field):
     It simply carries the value from source database
     to the destination database.
     """
-    pass
+    kind = 'transformer'
 
 class RelationTransformerField(Field):
+    kind = 'relation'
+
     def __init__(
         self,
         source,
@@ -103,6 +165,8 @@ class SubTransformerField(Field):
     :param list filters: A list of functions that alter the original value
     :param list actions: A list of functions to run after transformation
     """
+    kind = 'sub'
+
     def __init__(
         self,
         source,
@@ -134,6 +198,8 @@ class ValueField(Field):
     Would insert the column key with the value: "value"
     into the destination database
     """
+    kind = 'value'
+
     def __init__(self, value):
         super(ValueField, self).__init__(
             '__value__'
@@ -181,10 +247,103 @@ class TransformerMeta(type):
             setattr(new_class, '_meta', attr_meta.__dict__)
         if transformer_fields:
             setattr(new_class, '_fields', transformer_fields)
+            setattr(new_class, '_steps', cls.compile_steps(transformer_fields))
         if source:
             setattr(new_class, '_source', source)
+            setattr(new_class, '_plan', cls.compile_plan(source))
+            setattr(new_class, '_batch', cls.compile_batch(source))
+        setattr(new_class, '_columns', cls.compile_columns(
+            getattr(new_class, '_source', {}),
+            getattr(new_class, '_meta', {})
+        ))
         return new_class
 
+    @staticmethod
+    def compile_columns(source, meta):
+        """
+        Compile the source columns selected for a transformer instead
+        of all columns of its source table: id unless rows are identified
+        by order_by, the columns read by its fields, order_by, watermark,
+        unique and the source_columns declared in Meta for columns custom
+        transform methods access.
+        Returns None if Meta declares source_columns = '*'
+        """
+        extra = meta.get('source_columns', ())
+        if extra == '*':
+            return None
+        if isinstance(extra, str):
+            extra = (extra,)
+        columns = set(column for column in source if column is not None)
+        # Tables keyed by order_by may have no id column,
+        # a watermark alone orders rows by (watermark, id)
+        if meta.get('order_by'):
+            columns.update(meta['order_by'])
+        else:
+            columns.add('id')
+        if meta.get('watermark'):
+            columns.add(meta['watermark'])
+        # Rows are looked up in the destination by
+        # the value of unique in their source row
+        if meta.get('unique'):
+            columns.add(meta['unique'])
+        columns.update(extra)
+        return tuple(sorted(columns))
+
+    @staticmethod
+    def compile_plan(source):
+        """
+        Compile the source columns of a transformer into a plan used
+        by set_values, mapping each column to the attributes it sets
+        as (name, filter, actions) with its filters composed into
+        a single function
+        """
+        plan = {}
+        for column, fields in source.items():
+            plan[column] = tuple(
+                (
+                    field['name'],
+                    field['field'].compose_filters(),
+                    tuple(field['field'].actions)
+                )
+                for field in fields
+            )
+        return plan
+
+    @staticmethod
+    def compile_batch(source):
+        """
+        Compile the source columns with batch filters into a plan
+        used by Manager.apply_batch_filters, mapping each column
+        to the attributes it sets as (name, column filter)
+        """
+        batch = {}
+        for column, fields in source.items():
+            slots = []
+            for field in fields:
+                apply = field['field'].compose_batch_filters()
+                if apply:
+                    slots.append((field['name'], apply))
+            if slots:
+                batch[column] = tuple(slots)
+        return batch
+
+    @staticmethod
+    def compile_steps(transformer_fields):
+        """
+        Compile the fields of a transformer into the steps Manager
+        runs to build a row, as (name, field, kind, custom) where
+        custom tells if the field overrides Field.transform
+        """
+        return tuple(
+            (
+                name,
+                field,
+                field.kind,
+                type(field).transform is not Field.transform
+            )
+            for name, field in transformer_fields.items()
+        )
+
 
 class Transformer(metaclass=TransformerMeta):
     """
@@ -192,6 +351,13 @@ class Transformer(metaclass=TransformerMeta):
     to new values depending on what is declared within their
     TransformerFields.
     """
+    _fields = {}
+    _source = {}
+    _plan = {}
+    _batch = {}
+    _steps = ()
+    _columns = None
+
     def __init__(self, *args, **kwargs):
 
         if hasattr(self, '_meta'):
@@ -218,14 +384,37 @@ class Transformer(metaclass=TransformerMeta):
             # method: only get_or_create at the moment
             self.method = self._meta.get('method', None)
 
+            # Columns identifying and ordering source rows,
+            # read in pages with keyset pagination if set
+            self.order_by = self._meta.get('order_by', None)
+            if self.order_by:
+                self.order_by = tuple(self.order_by)
+
+            # Source column updated whenever a row changes. Rows are
+            # read ordered by it so a run resumes with the rows
+            # changed since the last row it transformed
+            self.watermark = self._meta.get('watermark', None)
+            if self.watermark:
+                self.order_by = (self.watermark,) + tuple(
+                    column for column in self.order_by or ('id',)
+                    if column != self.watermark
+                )
+
+            # Destination columns with a unique constraint, rows
+            # with the same key are updated instead of inserted
+            self.destination_key = self._meta.get('destination_key', None)
+            if isinstance(self.destination_key, str):
+                self.destination_key = (self.destination_key,)
+            elif self.destination_key:
+                self.destination_key = tuple(self.destination_key)
+
     def to_dict(self):
         """
         Returns column/value of transformer as a dictionary
         """
-        dic = {}
-        for key in self._fields.keys():
-            dic[key] = getattr(self, key)
-        return dic
+        return dict(
+            (key, getattr(self, key)) for key in self._fields
+        )
 
     def to_field(self, key):
         """
@@ -236,19 +425,43 @@ class Transformer(metaclass=TransformerMeta):
         """
         return self._fields.get(key)
 
-    def set_values(self, data):
+    def set_values(self, data, batched=None, profiler=None):
         """
         Sets values of transformer
         Runs through filters/actions of each field
         if they are specified
+
+        :param dict data: Row from the source table
+        :param dict batched: Values already filtered by Manager.apply_batch_filters, by field name
+        :param Profiler profiler: Time every filter and action of each field
         """
-        for key, value in data.items():
-            if key in self._source.keys():
-                for field in self._source[key]:
-                    field_instance = field.get('field')
+        transformer = self.__class__.__name__
+        for key, slots in self._plan.items():
+            if key not in data:
+                continue
+            value = data[key]
+            for name, apply, actions in slots:
+                if batched is not None and name in batched:
+                    val = batched[name]
+                elif profiler is not None:
                     val = value
-                    if field_instance.filters:
-                        val = field_instance.apply_filters(value)
-                    if field_instance.actions:
-                        field_instance.run_actions(value)
-                    setattr(self, field.get('name'), val)
+                    for field_filter in self._fields[name].filters:
+                        if getattr(field_filter, 'batch', False):
+                            val = profiler.call(
+                                transformer, name, 'batch_filter', field_filter, [val]
+                            )[0]
+                        else:
+                            val = profiler.call(
+                                transformer, name, 'filter', field_filter, val
+                            )
+                elif apply:
+                    val = apply(value)
+                else:
+                    val = value
+                # Actions run after the filters with the source value
+                for action in actions:
+                    if profiler is not None:
+                        profiler.call(transformer, name, 'action', action, value)
+                    else:
+                        action(value)
+                setattr(self, name, val)
@@ -1,7 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from mockredis.client import MockRedis
 
+from src.reshaper.checkpoints import *
 from src.reshaper.runner import Runner
 from test.test_data.sql import DBWrapper
 from test.test_data.transformers import *
@@ -28,7 +32,7 @@ class TestCache(unittest.TestCase):
 
 
     def test_running_with_cache(self):
-        self.runner.cache = MockRedis()
+        self.runner.cache = RedisCheckpoints(client=MockRedis())
         pk_author = self.runner.source_db.insert_single(
             'author', {'name':'Stephen King', 'age': '67'}
         ).get('id')
@@ -42,7 +46,7 @@ class TestCache(unittest.TestCase):
         self.runner.run(MovieTransformer())
 	
         # Verify that runners cache has transformer last index with namespace
-        lsi = self.runner.cache.get('MovieTransformer_last_source_index').decode('utf-8')
+        lsi = self.runner.cache.get('MovieTransformer_last_source_index')
         self.assertEqual('1', lsi)
         
         # Add more records
@@ -62,6 +66,68 @@ class TestCache(unittest.TestCase):
         self.assertEqual(1, count)
 
         # Verify that now the last source index is 2
-        lsi = self.runner.cache.get('MovieTransformer_last_source_index').decode('utf-8')
+        lsi = self.runner.cache.get('MovieTransformer_last_source_index')
         self.assertEqual('2', lsi)
 	"""
+
+class TestCheckpointStores(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertStores(self, store):
+        self.assertIsNone(store.get('MovieTransformer_last_source_index'))
+        store.set({
+            'MovieTransformer_last_source_index': 10,
+            'MovieTransformer_last_destination_index': 20
+        })
+        self.assertEqual('10', store.get('MovieTransformer_last_source_index'))
+        self.assertEqual('20', store.get('MovieTransformer_last_destination_index'))
+
+    def test_redis_checkpoints(self):
+        self.assertStores(RedisCheckpoints(client=MockRedis()))
+
+    def test_file_checkpoints(self):
+        path = os.path.join(self.directory, 'checkpoints.json')
+        self.assertStores(FileCheckpoints(path))
+
+        # Checkpoints are read back from file
+        self.assertEqual(
+            '10',
+            FileCheckpoints(path).get('MovieTransformer_last_source_index')
+        )
+        self.assertFalse(os.path.exists('%s.tmp' % path))
+
+    def test_sqlite_checkpoints(self):
+        path = os.path.join(self.directory, 'checkpoints.db')
+        self.assertStores(SQLiteCheckpoints(path))
+        self.assertEqual(
+            '10',
+            SQLiteCheckpoints(path).get('MovieTransformer_last_source_index')
+        )
+
+    def test_abstract_store(self):
+        """
+        Test that a store has to implement get and set
+        """
+        class GetOnlyCheckpoints(CheckpointStore):
+            def get(self, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            GetOnlyCheckpoints()
+
+    def test_parallel_file_checkpoints(self):
+        """
+        Test that worker processes refuse a checkpoint file
+        """
+        path = os.path.join(self.directory, 'checkpoints.json')
+        runner = Runner(None, None, cache=FileCheckpoints(path))
+        with self.assertRaises(Exception):
+            runner.run_parallel(MovieTransformer())
+        runner = Runner(None, None, cache=SQLiteCheckpoints(
+            os.path.join(self.directory, 'checkpoints.db')
+        ))
+        runner.check_cache()
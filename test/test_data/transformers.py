@@ -9,6 +9,15 @@ class AuthorTransformer(Transformer):
         source_table = 'author'
         destination_table = 'new_author'
 
+class OrderedAuthorTransformer(Transformer):
+    author_name = TransformerField('name')
+    author_age = TransformerField('age')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        order_by = ('name', 'id')
+
 class MovieTransformer(Transformer):
     title = TransformerField('title')
     author_id = RelationTransformerField(
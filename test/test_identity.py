@@ -0,0 +1,216 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.reshaper.backends.sqlite import DB
+from src.reshaper.checkpoints import FileCheckpoints
+from src.reshaper.identity import IdentityMap
+from src.reshaper.runner import Runner
+from src.reshaper.transformers import *
+from test.test_data.transformers import *
+from test.test_sqlite import SOURCE_TABLES, DESTINATION_TABLES, create_tables
+
+class PlainCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'country'
+        destination_table = 'new_country'
+
+class CountryField(SubTransformerField):
+    def transform(self, transformer):
+        return self.transformer()
+
+class CountryDirectorTransformer(Transformer):
+    name = TransformerField('name')
+    country_id = CountryField('country_id', transformer=PlainCountryTransformer)
+
+    class Meta:
+        source_table = 'director'
+        destination_table = 'new_director'
+
+class TestIdentityMap(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'identity.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_set_and_get(self):
+        """
+        Test that entries are kept per transformer
+        """
+        identity = IdentityMap()
+        identity.set(AuthorTransformer(), 1, 10)
+
+        self.assertEqual(10, identity.get(AuthorTransformer(), 1))
+        self.assertEqual(10, identity.get('AuthorTransformer', 1))
+        self.assertIsNone(identity.get(MovieTransformer(), 1))
+
+    def test_spill(self):
+        """
+        Test that entries are spilled to the SQLite file
+        once max_memory is reached
+        """
+        identity = IdentityMap(self.path, max_memory=2)
+        identity.set(AuthorTransformer(), 1, 10)
+        self.assertEqual(1, identity.size)
+
+        identity.set(AuthorTransformer(), 2, 20)
+        self.assertEqual(0, identity.size)
+        self.assertEqual(20, identity.get(AuthorTransformer(), 2))
+        identity.close()
+
+    def test_hold(self):
+        """
+        Test that held entries are only spilled once released
+        """
+        identity = IdentityMap(self.path, max_memory=2)
+        identity.hold()
+        identity.set(AuthorTransformer(), 1, 10)
+        identity.set(AuthorTransformer(), 2, 20)
+        self.assertEqual(2, identity.size)
+
+        identity.discard(AuthorTransformer(), 2)
+        identity.set(AuthorTransformer(), 3, 30)
+        identity.hold(False)
+        self.assertEqual(0, identity.size)
+        self.assertIsNone(identity.get(AuthorTransformer(), 2))
+        self.assertEqual(30, identity.get(AuthorTransformer(), 3))
+        identity.close()
+
+    def test_persists_between_runs(self):
+        """
+        Test that entries are kept in the SQLite file
+        once the identity map is closed
+        """
+        identity = IdentityMap(self.path)
+        identity.set(AuthorTransformer(), 1, 10)
+        identity.close()
+
+        identity = IdentityMap(self.path)
+        self.assertEqual(10, identity.get(AuthorTransformer(), 1))
+        identity.close()
+
+    def test_spilled_names(self):
+        """
+        Test that only transformers with spilled entries
+        are looked up in the SQLite file
+        """
+        identity = IdentityMap(self.path)
+        identity.set(AuthorTransformer(), 1, 10)
+        self.assertEqual(set(), identity.spilled)
+        identity.close()
+
+        identity = IdentityMap(self.path)
+        self.assertEqual(set(['AuthorTransformer']), identity.spilled)
+        identity.conn.close()
+        # Answered from memory without querying the closed file
+        self.assertIsNone(identity.get(MovieTransformer(), 1))
+
+class TestRunnerIdentity(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner(
+            source_db = DB(),
+            destination_db = DB()
+        )
+        create_tables(self.runner.source_db, SOURCE_TABLES)
+        create_tables(self.runner.destination_db, DESTINATION_TABLES)
+
+    def test_identity(self):
+        country = self.runner.source_db.insert_single(
+            'country', {'name': 'Iceland'}
+        ).get('id')
+        self.runner.source_db.insert_many('director', [
+            {'name': 'Director %i' % n, 'country_id': country}
+            for n in range(3)
+        ])
+        identity = IdentityMap()
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = self.runner.destination_db,
+            identity = identity
+        )
+        runner.run(CountryDirectorTransformer())
+        db = self.runner.destination_db
+        # The country is inserted once and kept under its own transformer
+        self.assertEqual(1, db.get_table_row_count('new_country'))
+        self.assertEqual(
+            db.get_table_rows('new_country')[0]['id'],
+            identity.get('PlainCountryTransformer', country)
+        )
+        self.assertEqual(
+            set([1, 2, 3]), set(identity.entries['CountryDirectorTransformer'])
+        )
+
+    def test_rollback_identity(self):
+        """
+        Test that identity map entries of a rolled
+        back transaction are undone
+        """
+        self.runner.source_db.insert_many('author', [
+            {'name': name, 'age': 40} for name in ['Mary', 'Bram']
+        ])
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_bram BEFORE INSERT ON new_author
+                    WHEN NEW.author_name = 'Bram'
+                    BEGIN SELECT RAISE(ABORT, 'Bram'); END
+                """
+            )
+        identity = IdentityMap()
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = db,
+            identity = identity
+        )
+        with self.assertRaises(Exception):
+            runner.run(AuthorTransformer(), commit_every=10, isolate=False)
+        self.assertEqual(0, db.get_table_row_count('new_author'))
+        self.assertEqual({}, identity.entries.get('AuthorTransformer', {}))
+        self.assertIsNone(runner.manager.journal)
+
+    def test_spill_checkpointed(self):
+        """
+        Test that entries of checkpointed rows are spilled
+        before their checkpoint, and kept if the run fails
+        """
+        self.runner.source_db.insert_many('author', [
+            {'name': name, 'age': 40} for name in ['Mary', 'Bram', 'Edgar']
+        ])
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_edgar BEFORE INSERT ON new_author
+                    WHEN NEW.author_name = 'Edgar'
+                    BEGIN SELECT RAISE(ABORT, 'Edgar'); END
+                """
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'identity.db')
+        identity = IdentityMap(path)
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = db,
+            identity = identity,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+        )
+        held = []
+        set_values = runner.cache.set
+        def record(values):
+            held.append(identity.size)
+            set_values(values)
+        runner.cache.set = record
+
+        with self.assertRaises(Exception):
+            runner.run(AuthorTransformer(), checkpoint_every=2, isolate=False)
+        self.assertEqual([0], held)
+        self.assertEqual(0, identity.size)
+        identity.conn.close()
+        identity = IdentityMap(path)
+        self.assertIsNotNone(identity.get('AuthorTransformer', 2))
+        self.assertIsNone(identity.get('AuthorTransformer', 3))
+        identity.close()
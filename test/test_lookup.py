@@ -0,0 +1,34 @@
+import unittest
+from src.reshaper.lookup import LookupCache
+
+class TestLookupCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        """
+        Test that lookups are counted as hits and misses
+        """
+        lookup = LookupCache(maxsize=10)
+        self.assertIsNone(lookup.get('Iceland'))
+        lookup.set('Iceland', {'id': 1, 'name': 'Iceland'})
+        self.assertEqual(1, lookup.get('Iceland').get('id'))
+
+        self.assertEqual(
+            {'size': 1, 'hits': 1, 'misses': 1},
+            lookup.stats()
+        )
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test that the least recently used row is evicted
+        once the cache is full
+        """
+        lookup = LookupCache(maxsize=2)
+        lookup.set('Iceland', {'id': 1})
+        lookup.set('Norway', {'id': 2})
+
+        # Iceland is now the most recently used row
+        lookup.get('Iceland')
+        lookup.set('Sweden', {'id': 3})
+
+        self.assertEqual(2, len(lookup))
+        self.assertIsNone(lookup.get('Norway'))
+        self.assertEqual(1, lookup.get('Iceland').get('id'))
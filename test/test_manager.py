@@ -1,5 +1,15 @@
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+from src.reshaper.backends.postgresql import PooledDB
+from src.reshaper.checkpoints import FileCheckpoints
 from src.reshaper.runner import Runner
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
 from src.reshaper.transformers import *
 from test.test_data.sql import DBWrapper
 from test.test_data.transformers import *
@@ -71,3 +81,312 @@ class TestManager(unittest.TestCase):
             new_country_pk, 
             results.get('country_id')
         )
+
+    def test_transform_batched(self):
+        """
+        Test that batched inserts map returned ids back
+        to the relation rows of each buffered row
+        """
+        authors = ['Neil Gaiman', 'Terry Pratchett', 'Ursula Le Guin']
+        for name in authors:
+            pk_author = self.runner.source_db.insert_single(
+                'author', {'name': name, 'age': '70'}
+            ).get('id')
+            self.runner.source_db.insert_single(
+                'movie', {
+                    'title': 'By %s' % name,
+                    'author_id': pk_author
+                }
+            )
+
+        self.runner.run(
+            MovieTransformer(),
+            query="WHERE title LIKE 'By %'",
+            batch_size=2
+        )
+
+        for name in authors:
+            movie = self.runner.destination_db.get_row_from_field(
+                'new_movie', 'title', 'By %s' % name
+            )
+            author = self.runner.destination_db.get_row_from_field(
+                'new_author', 'author_name', name
+            )
+            relation = self.runner.destination_db.get_row_from_field(
+                'movie_author', 'movie_id', movie.get('id')
+            )
+            self.assertEqual(author.get('id'), relation.get('author_id'))
+
+    def test_transform_streaming(self):
+        """
+        Test transforming rows read through a server-side cursor
+        """
+        self.runner.source_db.insert_single(
+            'country', {'name': 'Norway'}
+        )
+        count = self.runner.run(
+            CountryTransformer(),
+            query="WHERE name = 'Norway'",
+            itersize=1,
+            estimate=True
+        )
+        self.assertEqual(1, count)
+        row = self.runner.destination_db.get_row_from_field(
+            'new_country', 'name', 'Norway'
+        )
+        self.assertIsNotNone(row)
+
+    def test_transform_copy(self):
+        """
+        Test that batched transformers without relations
+        are bulk loaded with COPY
+        """
+        for name in ['Tab\tname', 'Back\\slash']:
+            self.runner.source_db.insert_single(
+                'author', {'name': name, 'age': '40'}
+            )
+        self.assertTrue(
+            self.runner.manager.copyable(AuthorTransformer())
+        )
+        count = self.runner.run(
+            AuthorTransformer(),
+            query="WHERE name IN ('Tab\tname', 'Back\\slash')",
+            batch_size=10
+        )
+        self.assertEqual(2, count)
+        row = self.runner.destination_db.get_row_from_field(
+            'new_author', 'author_name', 'Tab\tname'
+        )
+        self.assertEqual(40, row.get('author_age'))
+
+    def test_resolve_unique_cache(self):
+        """
+        Test that unique lookups are served from the lookup
+        cache once warmed
+        """
+        new_country_pk = self.runner.destination_db.insert_single(
+            'new_country', {'name': 'Finland'}
+        ).get('id')
+        self.runner.manager.warm_lookups(DirectorTransformer())
+        lookup = self.runner.manager.get_lookup('new_country', 'name')
+        hits = lookup.hits
+
+        row = self.runner.manager.resolve_unique(
+            CountryTransformer(), 'Finland'
+        )
+        self.assertEqual(new_country_pk, row.get('id'))
+        self.assertEqual(hits + 1, lookup.hits)
+
+    def test_transform_prefetch(self):
+        """
+        Test that referenced rows are served from the prefetched chunk
+        """
+        pk_author = self.runner.source_db.insert_single(
+            'author', {'name': 'Mary Shelley', 'age': '53'}
+        ).get('id')
+        self.runner.source_db.insert_single(
+            'movie', {
+                'title': 'Frankenstein',
+                'author_id': pk_author
+            }
+        )
+
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = self.runner.destination_db,
+            metrics = True
+        )
+        runner.run(
+            MovieTransformer(),
+            query="WHERE title = 'Frankenstein'",
+            prefetch=50
+        )
+        counts = runner.metrics.stats()['AuthorTransformer']['counts']
+        self.assertEqual(1, counts.get('prefetch_hits'))
+        # Prefetched rows do not outlive the run
+        self.assertEqual({}, runner.manager.prefetched)
+
+        row = self.runner.destination_db.get_row_from_field(
+            'new_author', 'author_name', 'Mary Shelley'
+        )
+        self.assertEqual(53, row.get('author_age'))
+
+    def test_run_parallel(self):
+        """
+        Test transforming a table with multiple worker processes
+        """
+        for name in ['Portugal', 'Spain', 'France', 'Italy']:
+            self.runner.source_db.insert_single(
+                'old_fruits', {'fruit': 'Orange', 'owner': name}
+            )
+
+        count = self.runner.run_parallel(FruitTransformer(), workers=2)
+        self.assertEqual(4, count)
+        row = self.runner.destination_db.get_row_from_field(
+            'fruit_owner', 'name', 'Italy'
+        )
+        self.assertEqual(7, row.get('age'))
+
+    def test_transform_transaction(self):
+        """
+        Test that a failing row is rolled back to its
+        savepoint without losing the rest of the transaction
+        """
+        for title in ['Dracula', 'Nosferatu', 'Carmilla']:
+            self.runner.source_db.insert_single(
+                'movie', {'title': title}
+            )
+        # Only the destination refuses the row
+        with self.runner.destination_db.cursor() as cur:
+            cur.execute(
+                """ ALTER TABLE new_movie ADD CONSTRAINT no_nosferatu
+                    CHECK (title <> 'Nosferatu') NOT VALID
+                """
+            )
+
+        def drop():
+            with self.runner.destination_db.cursor() as cur:
+                cur.execute('ALTER TABLE new_movie DROP CONSTRAINT no_nosferatu')
+        self.addCleanup(drop)
+
+        query = "WHERE title IN ('Dracula', 'Nosferatu', 'Carmilla')"
+        count = self.runner.run(MovieTransformer(), query=query, commit_every=2)
+        self.assertEqual(3, count)
+        self.assertEqual(1, len(self.runner.failed))
+        self.assertEqual(3, sum(rows for rows, latency in self.runner.commits))
+        self.assertIsNotNone(
+            self.runner.destination_db.get_row_from_field(
+                'new_movie', 'title', 'Carmilla'
+            )
+        )
+
+        # A failing row of a batch is written again on its own
+        count = self.runner.run(
+            MovieTransformer(), query=query, commit_every=2, batch_size=10
+        )
+        self.assertEqual(3, count)
+        self.assertEqual(1, len(self.runner.failed))
+        self.assertEqual(
+            2, self.runner.destination_db.get_table_row_count(
+                'new_movie', "WHERE title = 'Dracula'"
+            )
+        )
+
+    def test_pooled_db(self):
+        """
+        Test that threads sharing a PooledDB borrow
+        connections independently
+        """
+        db = PooledDB(
+            dbName='test_b_db',
+            dbUser=os.environ.get('DATABASE_USER'),
+            dbPass=os.environ.get('DATABASE_PASSWORD'),
+            maxconn=2
+        )
+        names = ['Pool %i' % n for n in range(8)]
+        found = []
+
+        def insert(name):
+            pk = db.insert_single('new_country', {'name': name}).get('id')
+            found.append(db.get_row_from_pk('new_country', pk).get('name'))
+
+        threads = [threading.Thread(target=insert, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(names), sorted(found))
+
+        db.begin()
+        db.insert_single('new_country', {'name': 'Pool rollback'})
+        db.end(commit=False)
+        self.assertIsNone(
+            db.get_row_from_field('new_country', 'name', 'Pool rollback')
+        )
+        self.assertEqual(
+            len(names),
+            db.get_table_row_count('new_country', "WHERE name LIKE 'Pool %'")
+        )
+        db.close()
+
+    def test_statement_cache(self):
+        """
+        Test that statements are prepared once and
+        values are passed as parameters
+        """
+        db = self.runner.destination_db
+        before = db.statement_stats()
+        for name in ["O'Brien", 'Quote \' %s']:
+            pk = db.insert_single('new_country', {'name': name}).get('id')
+            self.assertEqual(name, db.get_row_from_pk('new_country', pk).get('name'))
+            self.assertEqual(pk, db.get_row_from_field('new_country', 'name', name).get('id'))
+        stats = db.statement_stats()
+        # Earlier tests may have prepared the same statements
+        self.assertGreaterEqual(stats['hits'] - before['hits'], 3)
+        self.assertLessEqual(stats['misses'] - before['misses'], 3)
+
+    @unittest.skipUnless(psycopg, 'psycopg 3 is not installed')
+    def test_psycopg3_backend(self):
+        """
+        Test batched and pipelined writes of the psycopg 3 backend
+        """
+        from src.reshaper.backends.psycopg3 import DB as PipelineDB
+        db = PipelineDB(
+            dbName='test_b_db',
+            dbUser=os.environ.get('DATABASE_USER'),
+            dbPass=os.environ.get('DATABASE_PASSWORD')
+        )
+        pks = db.insert_batch('new_author', [
+            {'author_name': 'Pipe A', 'author_age': 1},
+            {'author_name': 'Pipe B', 'author_age': None},
+            {'author_name': 'Pipe C', 'author_age': 3}
+        ])
+        movie = db.insert_single('new_movie', {'title': 'Pipelined'}).get('id')
+        self.assertEqual(3, db.insert_rows('movie_author', [
+            {'movie_id': movie, 'author_id': pk.get('id')} for pk in pks
+        ]))
+        self.assertEqual(
+            'Pipe B',
+            db.get_row_from_pk('new_author', pks[1].get('id')).get('author_name')
+        )
+        self.assertEqual(
+            3, db.get_table_row_count('movie_author', 'WHERE movie_id=%i' % movie)
+        )
+
+    def test_transform_keyset(self):
+        """
+        Test reading source rows in keyset paginated pages
+        ordered by order_by and resuming after the last key
+        """
+        for name in ['Keyset B', 'Keyset A', 'Keyset C']:
+            self.runner.source_db.insert_single(
+                'author', {'name': name, 'age': 40}
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'checkpoints.json')
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = self.runner.destination_db,
+            cache = FileCheckpoints(path)
+        )
+        query = "WHERE name LIKE 'Keyset %'"
+        self.assertEqual(
+            3, runner.run(OrderedAuthorTransformer(), query=query, page_size=2)
+        )
+        self.assertEqual(
+            ('Keyset C',),
+            runner.resume_key('OrderedAuthorTransformer')[:1]
+        )
+
+        self.runner.source_db.insert_single(
+            'author', {'name': 'Keyset D', 'age': 40}
+        )
+        self.assertEqual(
+            1, runner.run(OrderedAuthorTransformer(), query=query, page_size=2)
+        )
+        self.assertIsNotNone(
+            self.runner.destination_db.get_row_from_field(
+                'new_author', 'author_name', 'Keyset D'
+            )
+        )
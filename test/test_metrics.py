@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from src.reshaper.manager import Manager
+from src.reshaper.metrics import Metrics
+from src.reshaper.transformers import *
+
+class UniqueCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'country'
+        destination_table = 'new_country'
+        unique = 'name'
+        method = 'get_or_create'
+
+class TestMetrics(unittest.TestCase):
+    def test_exclusive_stages(self):
+        """
+        Test that time spent in an inner stage is
+        not counted towards the outer stage
+        """
+        metrics = Metrics()
+        metrics.start('MovieTransformer', 'relation')
+        metrics.start('AuthorTransformer', 'insert')
+        time.sleep(0.02)
+        metrics.stop()
+        metrics.stop()
+
+        stats = metrics.stats()
+        self.assertGreaterEqual(
+            stats['AuthorTransformer']['stages']['insert']['seconds'], 0.02
+        )
+        self.assertLess(
+            stats['MovieTransformer']['stages']['relation']['seconds'], 0.02
+        )
+        self.assertEqual(
+            1, stats['MovieTransformer']['stages']['relation']['calls']
+        )
+
+    def test_manager_counts(self):
+        """
+        Test that Manager counts rows, queries and lookup cache hits
+        """
+        class DB:
+            def get_row_from_field(self, table, field, value):
+                return None
+
+            def insert_single(self, table, row):
+                return {'id': 1}
+
+        metrics = Metrics()
+        manager = Manager(DB(), DB(), metrics=metrics)
+        for name in ['Iceland', 'Iceland']:
+            manager.transform(UniqueCountryTransformer(), {'id': 1, 'name': name})
+
+        counts = metrics.stats()['UniqueCountryTransformer']['counts']
+        self.assertEqual(1, counts['inserted'])
+        # The second lookup hits the row remembered from the first insert
+        self.assertEqual(1, counts['cache_hits'])
+        self.assertEqual(1, counts['cache_misses'])
+        self.assertEqual(2, counts['queries'])
+
+    def test_export(self):
+        """
+        Test exporting metrics as a Prometheus textfile and as JSON lines
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'reshaper.prom')
+        metrics = Metrics(path)
+        metrics.add('MovieTransformer', 'insert', 0.5)
+        metrics.count('MovieTransformer', 'rows', 10)
+        metrics.export()
+        with open(path) as metrics_file:
+            text = metrics_file.read()
+        self.assertIn(
+            'reshaper_stage_seconds_total{transformer="MovieTransformer",stage="insert"} 0.500000',
+            text
+        )
+        self.assertIn('reshaper_rows_total{transformer="MovieTransformer"} 10', text)
+
+        path = os.path.join(directory, 'reshaper.jsonl')
+        metrics = Metrics(path, format='json', interval=0)
+        metrics.count('MovieTransformer', 'rows')
+        metrics.tick()
+        metrics.tick()
+        with open(path) as metrics_file:
+            lines = [json.loads(line) for line in metrics_file]
+        self.assertEqual(2, len(lines))
+        self.assertEqual(
+            1, lines[-1]['transformers']['MovieTransformer']['counts']['rows']
+        )
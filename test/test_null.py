@@ -0,0 +1,57 @@
+import unittest
+from src.reshaper.backends.null import DB as NullDB
+from src.reshaper.backends.sqlite import DB
+from src.reshaper.runner import Runner
+from test.test_data.transformers import *
+from test.test_sqlite import SOURCE_TABLES, DESTINATION_TABLES, create_tables
+
+class TestNullDB(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner(
+            source_db = DB(),
+            destination_db = DB()
+        )
+        create_tables(self.runner.source_db, SOURCE_TABLES)
+        create_tables(self.runner.destination_db, DESTINATION_TABLES)
+        author = self.runner.source_db.insert_single(
+            'author', {'name': 'Stephen King', 'age': 67}
+        ).get('id')
+        self.runner.source_db.insert_many('movie', [
+            {'title': 'IT', 'author_id': author},
+            {'title': 'Carrie', 'author_id': author},
+            {'title': 'Misery', 'author_id': None}
+        ])
+
+    def test_synthetic_ids(self):
+        sink = NullDB()
+        self.assertEqual({'id': 1}, sink.insert_single('new_movie', {'title': 'IT'}))
+        self.assertEqual(
+            [{'id': 2}, {'id': 3}],
+            sink.insert_batch('new_movie', [{'title': 'a'}, {'title': 'b'}])
+        )
+        self.assertEqual({'id': 1}, sink.insert_single('new_author', {}))
+        self.assertEqual(3, sink.get_table_row_count('new_movie'))
+        self.assertEqual({}, sink.stats()['new_movie']['columns'])
+
+    def test_dry_run(self):
+        sink = NullDB(stats=True)
+        count = self.runner.run(MovieTransformer(), dry_run=sink)
+        self.assertEqual(3, count)
+        stats = sink.stats()
+        self.assertEqual(3, stats['new_movie']['rows'])
+        self.assertEqual(
+            {'values': 3, 'nulls': 0, 'min': 'Carrie', 'max': 'Misery'},
+            stats['new_movie']['columns']['title']
+        )
+        self.assertEqual(2, stats['new_author']['rows'])
+        self.assertEqual(2, stats['movie_author']['rows'])
+        # Nothing was written to the destination
+        self.assertEqual(
+            0, self.runner.destination_db.get_table_row_count('new_movie')
+        )
+
+    def test_dry_run_batched(self):
+        sink = NullDB(stats=True)
+        self.runner.run(MovieTransformer(), dry_run=sink, batch_size=2)
+        self.assertEqual(3, sink.stats()['new_movie']['rows'])
+        self.assertEqual(2, sink.stats()['movie_author']['rows'])
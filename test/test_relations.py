@@ -0,0 +1,132 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from src.reshaper.backends.sqlite import DB
+from src.reshaper.checkpoints import FileCheckpoints
+from src.reshaper.runner import Runner
+from test.test_data.transformers import *
+from test.test_sqlite import SOURCE_TABLES, DESTINATION_TABLES, create_tables
+
+class TestRelations(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner(
+            source_db = DB(),
+            destination_db = DB()
+        )
+        create_tables(self.runner.source_db, SOURCE_TABLES)
+        create_tables(self.runner.destination_db, DESTINATION_TABLES)
+
+    def test_relation_batch(self):
+        author = self.runner.source_db.insert_single(
+            'author', {'name': 'Stephen King', 'age': 67}
+        ).get('id')
+        self.runner.source_db.insert_many('movie', [
+            {'title': title, 'author_id': author}
+            for title in ['IT', 'Carrie', 'Misery']
+        ])
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = self.runner.destination_db,
+            metrics = True
+        )
+        runner.run(MovieTransformer(), relation_batch=10)
+        counts = runner.metrics.stats()['movie_author']['counts']
+        # Relation rows of every movie are written with a single insert
+        self.assertEqual({'queries': 1, 'inserted': 3}, counts)
+        self.assertEqual(
+            3, self.runner.destination_db.get_table_row_count('movie_author')
+        )
+
+    def test_relation_failure(self):
+        """
+        Test that relation rows that failed to be written
+        are not written again, hiding the error
+        """
+        author = self.runner.source_db.insert_single(
+            'author', {'name': 'Stephen King', 'age': 67}
+        ).get('id')
+        self.runner.source_db.insert_single(
+            'movie', {'title': 'IT', 'author_id': author}
+        )
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_relation BEFORE INSERT ON movie_author
+                    BEGIN SELECT RAISE(ABORT, 'movie_author'); END
+                """
+            )
+        with self.assertRaises(Exception) as raised:
+            self.runner.run(MovieTransformer(), relation_batch=10)
+        # The error raised is the one of the first write
+        self.assertIsInstance(raised.exception.__context__, sqlite3.Error)
+        self.assertEqual(0, self.runner.manager.pending_relations())
+
+    def test_relation_failure_checkpoint(self):
+        """
+        Test that rows whose relation rows failed to be
+        written are not checkpointed
+        """
+        author = self.runner.source_db.insert_single(
+            'author', {'name': 'Stephen King', 'age': 67}
+        ).get('id')
+        self.runner.source_db.insert_many('movie', [
+            {'title': 'Movie %i' % n, 'author_id': author} for n in range(6)
+        ])
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_relation BEFORE INSERT ON movie_author
+                    WHEN NEW.movie_id = 5
+                    BEGIN SELECT RAISE(ABORT, 'movie_author'); END
+                """
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = db,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+        )
+        with self.assertRaises(Exception):
+            runner.run(
+                MovieTransformer(), relation_batch=3, checkpoint_every=4, isolate=False
+            )
+        # Movies 1 to 4 are committed and checkpointed, movies
+        # 5 and 6 are rolled back with their relation rows
+        self.assertEqual(4, db.get_table_row_count('new_movie'))
+        self.assertEqual(4, db.get_table_row_count('movie_author'))
+        self.assertEqual(4, runner.resume_index('MovieTransformer'))
+        self.assertEqual(0, runner.manager.pending_relations())
+
+    def test_relation_conflict(self):
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                'CREATE UNIQUE INDEX movie_author_ids ON movie_author(movie_id, author_id)'
+            )
+        manager = self.runner.manager
+        manager.relation_batch = 10
+        for n in range(2):
+            manager.insert_relations(
+                [{'movie_author': {'author_id': 1}}], 'movie_id', 1
+            )
+        self.assertEqual(1, manager.pending_relations())
+        manager.flush_relations()
+        # A resumed run writing the same relation again
+        manager.insert_relations(
+            [{'movie_author': {'author_id': 1}}], 'movie_id', 1
+        )
+        self.assertRaises(Exception, manager.flush_relations)
+        # Rows that failed are kept, but not written again
+        self.assertEqual(1, manager.pending_relations())
+        self.assertRaises(Exception, manager.flush_relations)
+        manager.discard()
+        self.assertEqual(0, manager.pending_relations())
+        manager.insert_relations(
+            [{'movie_author': {'author_id': 1}}], 'movie_id', 1
+        )
+        manager.relation_conflict = 'ignore'
+        manager.flush_relations()
+        self.assertEqual(1, db.get_table_row_count('movie_author'))
@@ -0,0 +1,478 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.reshaper.backends.sqlite import DB
+from src.reshaper.checkpoints import FileCheckpoints
+from src.reshaper.identity import IdentityMap
+from src.reshaper.runner import Runner
+from src.reshaper.transformers import *
+from test.test_data.transformers import *
+from test.test_sqlite import SOURCE_TABLES, DESTINATION_TABLES, create_tables
+
+class AuthorCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_country'
+
+class UniqueCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'country'
+        destination_table = 'new_country'
+        unique = 'name'
+        method = 'get_or_create'
+
+class BioAuthorTransformer(AuthorTransformer):
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        source_columns = ('bio',)
+
+class AllAuthorTransformer(AuthorTransformer):
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        source_columns = '*'
+
+class BioCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_country'
+        unique = 'bio'
+
+class SyncAuthorTransformer(Transformer):
+    legacy_id = TransformerField('id')
+    author_name = TransformerField('name')
+    author_age = TransformerField('age')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        watermark = 'updated_at'
+        destination_key = 'legacy_id'
+
+class TaggedCountryTransformer(Transformer):
+    name = TransformerField('name')
+    tags = ValueField(['north', 'island'])
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_country'
+
+class EventCountryTransformer(Transformer):
+    name = TransformerField('name')
+
+    class Meta:
+        source_table = 'event'
+        destination_table = 'new_country'
+        order_by = ('tenant_id', 'created_at')
+
+class KeylessSyncAuthorTransformer(Transformer):
+    author_name = TransformerField('name')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        watermark = 'updated_at'
+
+class AgeAuthorTransformer(Transformer):
+    legacy_id = TransformerField('age')
+    author_name = TransformerField('name')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+        destination_key = 'legacy_id'
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner(
+            source_db = DB(),
+            destination_db = DB()
+        )
+        create_tables(self.runner.source_db, SOURCE_TABLES)
+        create_tables(self.runner.destination_db, DESTINATION_TABLES)
+
+    def test_batched_unique(self):
+        self.runner.source_db.insert_many('country', [
+            {'name': name} for name in ['Iceland', 'Norway', 'Iceland']
+        ])
+        self.runner.run(UniqueCountryTransformer(), batch_size=10)
+        # The second Iceland is matched with the row buffered before it
+        self.assertEqual(
+            ['Iceland', 'Norway'],
+            sorted(
+                row['name'] for row in
+                self.runner.destination_db.get_table_rows('new_country')
+            )
+        )
+
+    def test_prefetch(self):
+        db = self.runner.source_db
+        author = db.insert_single(
+            'author', {'name': 'Mary Shelley', 'age': 53}
+        ).get('id')
+        db.insert_single('movie', {'title': 'Frankenstein', 'author_id': author})
+        runner = Runner(
+            source_db = db,
+            destination_db = self.runner.destination_db,
+            metrics = True
+        )
+        runner.run(MovieTransformer(), prefetch=50)
+        counts = runner.metrics.stats()['AuthorTransformer']['counts']
+        self.assertEqual(1, counts.get('prefetch_hits'))
+        self.assertEqual({}, runner.manager.prefetched)
+
+        # A later run reads the author again instead of the row prefetched before
+        with db.cursor() as cur:
+            cur.execute("UPDATE author SET age=54 WHERE id=%i" % author)
+        row = runner.manager.get_source_row('author', author, columns=('age', 'id'))
+        self.assertEqual(54, row['age'])
+
+    def test_partition_resume(self):
+        db = self.runner.source_db
+        db.insert_many('author', [
+            {'name': 'Author %i' % n, 'age': n} for n in range(4)
+        ])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = db,
+            destination_db = self.runner.destination_db,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+        )
+        partitions = runner.partition(AuthorTransformer(), 2)
+        self.assertEqual([(1, 2), (3, 4)], partitions)
+        for low, high in partitions:
+            self.assertEqual(2, runner.run_partition(AuthorTransformer(), low, high))
+
+        db.insert_many('author', [
+            {'name': 'Author %i' % n, 'age': n} for n in range(4, 6)
+        ])
+        # The extended last range resumes from its checkpoint
+        partitions = runner.partition(AuthorTransformer(), 2)
+        self.assertEqual([(1, 2), (3, 6)], partitions)
+        self.assertEqual(2, runner.run_partition(AuthorTransformer(), 3, 6))
+        self.assertEqual(
+            6, self.runner.destination_db.get_table_row_count('new_author')
+        )
+
+    def test_partition_options(self):
+        """
+        Test that options of a whole run and transformers
+        read in order_by order are refused by id ranges
+        """
+        for option in ('query', 'estimate', 'page_size', 'dry_run'):
+            self.assertRaises(
+                Exception,
+                self.runner.run_partition,
+                AuthorTransformer(), 1, 2, **{option: True}
+            )
+        self.assertRaises(
+            Exception, self.runner.run_partition, SyncAuthorTransformer(), 1, 2
+        )
+        self.assertRaises(
+            Exception,
+            self.runner.run_parallel,
+            AuthorTransformer(),
+            query='WHERE age > 1'
+        )
+        self.assertRaises(
+            Exception, self.runner.run_parallel, SyncAuthorTransformer()
+        )
+
+    def test_isolated_batch(self):
+        """
+        Test that only the failing row of a batch
+        written in a transaction is rolled back
+        """
+        for title in ['Dracula', 'Nosferatu', 'Carmilla']:
+            self.runner.source_db.insert_single('movie', {'title': title})
+        db = self.runner.destination_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_nosferatu BEFORE INSERT ON new_movie
+                    WHEN NEW.title = 'Nosferatu'
+                    BEGIN SELECT RAISE(ABORT, 'Nosferatu'); END
+                """
+            )
+        count = self.runner.run(
+            MovieTransformer(), batch_size=10, commit_every=10
+        )
+        self.assertEqual(3, count)
+        self.assertEqual([2], [failed[0] for failed in self.runner.failed])
+        self.assertEqual(
+            ['Dracula', 'Carmilla'],
+            [row['title'] for row in db.get_table_rows('new_movie')]
+        )
+
+    def test_checkpoint_every(self):
+        """
+        Test that checkpoint_every commits the rows every
+        checkpoint_every rows along with their checkpoint
+        """
+        db = self.runner.source_db
+        db.insert_many('author', [
+            {'name': 'Author %i' % n, 'age': n} for n in range(6)
+        ])
+        destination = self.runner.destination_db
+        with destination.cursor() as cur:
+            cur.execute(
+                """ CREATE TRIGGER no_fifth BEFORE INSERT ON new_author
+                    WHEN NEW.author_age = 4
+                    BEGIN SELECT RAISE(ABORT, 'fifth'); END
+                """
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = db,
+            destination_db = destination,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+        )
+        with self.assertRaises(Exception):
+            runner.run(AuthorTransformer(), checkpoint_every=2, isolate=False)
+        self.assertEqual([2, 2], [rows for rows, latency in runner.commits])
+        self.assertEqual(4, runner.resume_index('AuthorTransformer'))
+        self.assertEqual(4, destination.get_table_row_count('new_author'))
+
+        with destination.cursor() as cur:
+            cur.execute('DROP TRIGGER no_fifth')
+        # The resumed run writes no row twice
+        self.assertEqual(
+            2, runner.run(AuthorTransformer(), checkpoint_every=2)
+        )
+        self.assertEqual(
+            list(range(6)),
+            [row['author_age'] for row in destination.get_table_rows('new_author')]
+        )
+        self.assertRaises(
+            Exception,
+            runner.run,
+            AuthorTransformer(),
+            checkpoint_every=2,
+            commit_every=10
+        )
+
+    def test_run_shared(self):
+        self.runner.source_db.insert_many('author', [
+            {'name': 'Author %i' % n, 'age': n} for n in range(5)
+        ])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = self.runner.source_db,
+            destination_db = self.runner.destination_db,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json')),
+            metrics = True
+        )
+        # AuthorTransformer already transformed the first two rows
+        runner.cache.set({'AuthorTransformer_last_source_index': 2})
+        warmed = []
+        runner.manager.warm_lookups = warmed.append
+        counts = runner.run_shared(
+            [AuthorTransformer(), AuthorCountryTransformer()],
+            page_size=2,
+            estimate=True,
+            warm_lookups=True
+        )
+        # Lookups are warmed once per transformer, not once per page
+        self.assertEqual(2, len(warmed))
+        self.assertEqual(
+            {'AuthorTransformer': 3, 'AuthorCountryTransformer': 5}, counts
+        )
+        db = self.runner.destination_db
+        self.assertEqual(3, db.get_table_row_count('new_author'))
+        self.assertEqual(5, db.get_table_row_count('new_country'))
+        # Source rows are read once, the last read finds no row
+        self.assertEqual(
+            6, runner.metrics.stats()['author']['stages']['read']['calls']
+        )
+        for name in counts:
+            self.assertEqual(5, runner.resume_index(name))
+        self.assertRaises(
+            Exception,
+            runner.run_shared,
+            [AuthorTransformer(), MovieTransformer()]
+        )
+        self.assertRaises(
+            Exception,
+            runner.run_shared,
+            [AuthorTransformer(), AuthorCountryTransformer()],
+            dry_run=True
+        )
+
+    def test_projection(self):
+        self.assertEqual(('age', 'id', 'name'), AuthorTransformer._columns)
+        self.assertEqual(
+            ('author_id', 'id', 'title'), MovieTransformer._columns
+        )
+        self.assertEqual(
+            ('age', 'bio', 'id', 'name'), BioAuthorTransformer._columns
+        )
+        self.assertIsNone(AllAuthorTransformer._columns)
+        # Unique is read even if no field reads it
+        self.assertEqual(('bio', 'id', 'name'), BioCountryTransformer._columns)
+        self.assertEqual(
+            'age,id,name', self.runner.select_list([AuthorTransformer()])
+        )
+        self.assertEqual('*', self.runner.select_list(
+            [AuthorTransformer(), AllAuthorTransformer()]
+        ))
+
+        db = self.runner.source_db
+        pk = db.insert_single(
+            'author', {'name': 'Stephen King', 'age': 67, 'bio': 'x' * 1000}
+        ).get('id')
+        columns = AuthorTransformer._columns
+        self.assertEqual(
+            {'id': pk, 'name': 'Stephen King', 'age': 67},
+            db.get_row_from_pk('author', pk, columns)
+        )
+        self.assertEqual(
+            set(columns), set(db.get_rows_from_pks('author', [pk], columns)[pk])
+        )
+        self.assertEqual(
+            [set(columns)],
+            [set(row) for row in db.keyset('author', ('name', 'id'), columns=columns)]
+        )
+        self.assertIn('bio', db.get_row_from_pk('author', pk))
+
+    def test_watermark(self):
+        db = self.runner.source_db
+        db.insert_many('author', [
+            {'name': 'Author %i' % n, 'age': n, 'updated_at': '2024-01-01 00:00:0%i' % n}
+            for n in range(3)
+        ])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = db,
+            destination_db = self.runner.destination_db,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+        )
+        self.assertEqual(
+            ('updated_at', 'id'), SyncAuthorTransformer().order_by
+        )
+        self.assertEqual(3, runner.run(SyncAuthorTransformer(), page_size=2))
+        before = runner.destination_db.get_row_from_field(
+            'new_author', 'legacy_id', 1
+        )
+
+        with db.cursor() as cur:
+            cur.execute(
+                "UPDATE author SET name='Changed', age=NULL, updated_at='2024-01-02' WHERE id=1"
+            )
+        db.insert_single(
+            'author', {'name': 'New', 'age': 4, 'updated_at': '2024-01-02 00:00:01'}
+        )
+        # Only the changed and the new row are read and upserted
+        self.assertEqual(
+            2, runner.run(SyncAuthorTransformer(), page_size=2, batch_size=2)
+        )
+        self.assertEqual(
+            4, runner.destination_db.get_table_row_count('new_author')
+        )
+        after = runner.destination_db.get_row_from_field(
+            'new_author', 'legacy_id', 1
+        )
+        self.assertEqual(
+            {'id': before['id'], 'author_name': 'Changed', 'author_age': None, 'legacy_id': 1},
+            after
+        )
+        self.assertEqual(0, runner.run(SyncAuthorTransformer()))
+        # Changed rows would be inserted again
+        self.assertRaises(Exception, runner.run, KeylessSyncAuthorTransformer())
+
+        # Rows without a watermark would never be read
+        db.insert_single('author', {'name': 'Undated', 'age': 5})
+        self.assertRaises(Exception, runner.run, SyncAuthorTransformer())
+
+    def test_order_by_without_id(self):
+        """
+        Test that a table keyed by order_by is
+        transformed without an id column
+        """
+        db = self.runner.source_db
+        with db.cursor() as cur:
+            cur.execute(
+                """ CREATE TABLE event(
+                    tenant_id  integer,
+                    created_at text,
+                    name       varchar(100),
+                    PRIMARY KEY (tenant_id, created_at)
+                )
+                """
+            )
+        db.insert_many('event', [
+            {'tenant_id': tenant, 'created_at': created, 'name': name}
+            for tenant, created, name in [
+                (2, '2024-01-01', 'c'), (1, '2024-01-02', 'b'), (1, '2024-01-01', 'a')
+            ]
+        ])
+        self.assertEqual(
+            ('created_at', 'name', 'tenant_id'), EventCountryTransformer._columns
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runner = Runner(
+            source_db = db,
+            destination_db = self.runner.destination_db,
+            cache = FileCheckpoints(os.path.join(directory, 'checkpoints.json')),
+            identity = IdentityMap()
+        )
+        self.assertEqual(
+            3, runner.run(EventCountryTransformer(), page_size=2, batch_size=2)
+        )
+        self.assertEqual(
+            ['a', 'b', 'c'],
+            [row['name'] for row in runner.destination_db.get_table_rows('new_country')]
+        )
+        self.assertEqual(
+            (2, '2024-01-01'), runner.resume_key('EventCountryTransformer')
+        )
+
+    def test_copy_values(self):
+        """
+        Test that rows with list or dict values are
+        inserted instead of bulk loaded with COPY
+        """
+        manager = self.runner.manager
+        for transformer in [AuthorCountryTransformer(), TaggedCountryTransformer()]:
+            manager.queue(transformer, {'id': 1, 'name': 'Iceland'}, flush=False)
+        self.assertEqual(
+            [True, False],
+            [entry['copy'] for entry in manager.buffer['new_country']]
+        )
+
+    def test_upsert_duplicates(self):
+        """
+        Test that only the last of the rows sharing a
+        destination_key in one batch is written
+        """
+        self.runner.source_db.insert_many('author', [
+            {'name': name, 'age': age}
+            for name, age in [('First', 1), ('Second', 2), ('Again', 1), ('None', None)]
+        ])
+        db = self.runner.destination_db
+        batches = []
+        insert_batch = db.insert_batch
+        def record(table, rows, key=None):
+            batches.append(len(rows))
+            return insert_batch(table, rows, key)
+        db.insert_batch = record
+
+        self.assertEqual(
+            4, self.runner.run(AgeAuthorTransformer(), batch_size=10)
+        )
+        self.assertEqual([3], batches)
+        self.assertEqual(
+            ['Second', 'Again', 'None'],
+            [row['author_name'] for row in db.get_table_rows('new_author')]
+        )
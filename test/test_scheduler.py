@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+import warnings
+from src.reshaper.backends.null import DB as NullDB
+from src.reshaper.checkpoints import FileCheckpoints
+from src.reshaper.identity import IdentityMap
+from src.reshaper.runner import Runner
+from src.reshaper.scheduler import Scheduler
+from src.reshaper.transformers import *
+from test.test_data.transformers import *
+
+class OtherCircularTransformer(Transformer):
+    circular_id = SubTransformerField('circular_id')
+
+    class Meta:
+        source_table = 'other_circular'
+        destination_table = 'new_other_circular'
+
+class CircularTransformer(Transformer):
+    other_id = SubTransformerField(
+        'other_id',
+        transformer=OtherCircularTransformer
+    )
+
+    class Meta:
+        source_table = 'circular'
+        destination_table = 'new_circular'
+
+OtherCircularTransformer._fields['circular_id'].transformer = CircularTransformer
+
+class TestScheduler(unittest.TestCase):
+    def test_dependencies(self):
+        """
+        Test that only references to transformers
+        being scheduled are dependencies
+        """
+        scheduler = Scheduler(None)
+        graph = scheduler.dependencies([
+            AuthorTransformer(),
+            MovieTransformer(),
+            ActorTransformer(),
+            DirectorTransformer()
+        ])
+
+        self.assertEqual(set(), graph['AuthorTransformer'])
+        self.assertEqual({'AuthorTransformer'}, graph['MovieTransformer'])
+        self.assertEqual(
+            {'AuthorTransformer', 'MovieTransformer'},
+            graph['ActorTransformer']
+        )
+        # CountryTransformer is not scheduled
+        self.assertEqual(set(), graph['DirectorTransformer'])
+
+    def test_order(self):
+        """
+        Test that leaf transformers run first
+        """
+        scheduler = Scheduler(None)
+        levels = scheduler.order([
+            ActorTransformer(),
+            MovieTransformer(),
+            AuthorTransformer(),
+            CountryTransformer(),
+            DirectorTransformer()
+        ])
+
+        self.assertEqual([
+            ['AuthorTransformer', 'CountryTransformer'],
+            ['DirectorTransformer', 'MovieTransformer'],
+            ['ActorTransformer']
+        ], levels)
+
+    def test_circular_dependency(self):
+        """
+        Test that circular dependencies are refused
+        """
+        scheduler = Scheduler(None)
+        with self.assertRaises(Exception):
+            scheduler.order([
+                CircularTransformer(),
+                OtherCircularTransformer()
+            ])
+
+    def test_identity(self):
+        """
+        Test that dependents are not scheduled without
+        an identity map the worker processes can share
+        """
+        transformers = [AuthorTransformer(), MovieTransformer()]
+        scheduler = Scheduler(
+            Runner(NullDB(), NullDB(), identity=IdentityMap())
+        )
+        with self.assertRaises(Exception):
+            scheduler.run(transformers)
+
+        scheduler = Scheduler(Runner(NullDB(), NullDB()))
+        graph = scheduler.dependencies(transformers)
+        with self.assertWarns(UserWarning):
+            scheduler.check_identity(graph)
+        # Independent transformers need no identity map
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            scheduler.check_identity(
+                scheduler.dependencies([AuthorTransformer(), CountryTransformer()])
+            )
+
+    def test_file_checkpoints(self):
+        """
+        Test that worker processes refuse a checkpoint file
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            scheduler = Scheduler(Runner(
+                NullDB(),
+                NullDB(),
+                cache=FileCheckpoints(os.path.join(directory, 'checkpoints.json'))
+            ))
+            with self.assertRaises(Exception):
+                scheduler.run([AuthorTransformer()])
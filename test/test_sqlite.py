@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.reshaper.backends.sqlite import DB
+from src.reshaper.runner import Runner
+from test.test_data.transformers import *
+
+SOURCE_TABLES = [
+    """ CREATE TABLE author(
+        id    INTEGER PRIMARY KEY,
+        name  varchar(100),
+        age   integer,
+        bio   text,
+        updated_at text
+    )
+    """,
+    """ CREATE TABLE movie(
+        id       INTEGER PRIMARY KEY,
+        title    varchar(50),
+        author_id integer REFERENCES author
+    )
+    """,
+    """ CREATE TABLE country(
+        id       INTEGER PRIMARY KEY,
+        name     varchar(100)
+    )
+    """,
+    """ CREATE TABLE director(
+        id         INTEGER PRIMARY KEY,
+        name       varchar(100),
+        country_id integer REFERENCES country
+    )
+    """
+]
+
+DESTINATION_TABLES = [
+    """ CREATE TABLE new_author(
+        id    INTEGER PRIMARY KEY,
+        author_name    varchar(100),
+        author_age     integer,
+        legacy_id      integer UNIQUE
+    )
+    """,
+    """ CREATE TABLE new_movie(
+        id    INTEGER PRIMARY KEY,
+        title varchar(50)
+    )
+    """,
+    """ CREATE TABLE movie_author(
+        id    INTEGER PRIMARY KEY,
+        movie_id integer REFERENCES new_movie,
+        author_id integer REFERENCES new_author
+    )
+    """,
+    """ CREATE TABLE new_country(
+        id       INTEGER PRIMARY KEY,
+        name     varchar(100)
+    )
+    """,
+    """ CREATE TABLE new_director(
+        id         INTEGER PRIMARY KEY,
+        name       varchar(100),
+        country_id integer REFERENCES new_country
+    )
+    """
+]
+
+def create_tables(db, tables):
+    with db.cursor() as cur:
+        for table in tables:
+            cur.execute(table)
+
+class TestSQLite(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner(
+            source_db = DB(),
+            destination_db = DB()
+        )
+        create_tables(self.runner.source_db, SOURCE_TABLES)
+        create_tables(self.runner.destination_db, DESTINATION_TABLES)
+
+    def test_transform(self):
+        pk_author = self.runner.source_db.insert_single(
+            'author', {'name':'Stephen King', 'age': 67}
+        ).get('id')
+        self.runner.source_db.insert_single(
+            'movie', {'title':'IT', 'author_id': pk_author}
+        )
+        self.runner.run(MovieTransformer())
+        row = self.runner.destination_db.get_row_from_field(
+            'new_author', 'author_name', 'Stephen King'
+        )
+        self.assertEqual(67, row.get('author_age'))
+        relation = self.runner.destination_db.get_row_from_field(
+            'movie_author', 'author_id', row.get('id')
+        )
+        self.assertEqual(
+            'IT',
+            self.runner.destination_db.get_row_from_pk(
+                'new_movie', relation.get('movie_id')
+            ).get('title')
+        )
+
+    def test_transform_batched(self):
+        country = self.runner.source_db.insert_single(
+            'country', {'name': 'Iceland'}
+        ).get('id')
+        new_country = self.runner.destination_db.insert_single(
+            'new_country', {'name': 'Iceland'}
+        ).get('id')
+        self.runner.source_db.insert_many('director', [
+            {'name': 'Director %i' % n, 'country_id': country}
+            for n in range(10)
+        ])
+        self.runner.run(DirectorTransformer(), batch_size=4)
+        rows = self.runner.destination_db.get_table_rows('new_director')
+        self.assertEqual(10, len(rows))
+        self.assertEqual(
+            set([new_country]), set(row['country_id'] for row in rows)
+        )
+
+    def test_keyset(self):
+        self.runner.source_db.insert_many('author', [
+            {'name': name, 'age': age}
+            for name, age in [('b', 1), ('a', 2), ('c', 3), ('a', 4)]
+        ])
+        rows = list(self.runner.source_db.keyset(
+            'author', ('name', 'id'), size=2
+        ))
+        self.assertEqual(
+            [2, 4, 1, 3], [row['age'] for row in rows]
+        )
+        rows = list(self.runner.source_db.keyset(
+            'author', ('name', 'id'), size=2, after=('a', 4),
+            query='WHERE age < 3'
+        ))
+        self.assertEqual([1], [row['age'] for row in rows])
+
+    def test_transaction(self):
+        db = self.runner.destination_db
+        db.begin()
+        db.insert_single('new_country', {'name': 'Iceland'})
+        db.savepoint()
+        db.insert_single('new_country', {'name': 'Norway'})
+        db.rollback_to_savepoint()
+        db.commit()
+        db.insert_single('new_country', {'name': 'Sweden'})
+        db.end(commit=False)
+        self.assertEqual(
+            ['Iceland'],
+            [row['name'] for row in db.get_table_rows('new_country')]
+        )
+
+    def test_wal_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'reshaper.db')
+        db = DB(path)
+        create_tables(db, DESTINATION_TABLES)
+        pk = db.insert_single('new_country', {'name': 'Iceland'}).get('id')
+        with db.cursor() as cur:
+            cur.execute('PRAGMA journal_mode')
+            self.assertEqual('wal', cur.fetchone()['journal_mode'])
+        # A second connection reads the file
+        self.assertEqual(
+            'Iceland', DB(path).get_row_from_pk('new_country', pk)['name']
+        )
@@ -1,4 +1,6 @@
 import unittest
+from src.reshaper.manager import Manager
+from src.reshaper.profiler import Profiler
 from src.reshaper.transformers import *
 
 def filter_1(value):
@@ -22,3 +24,134 @@ class TestTransformerFields(unittest.TestCase):
 
         # The resulting string should be -*testing*-
         self.assertEqual(f_value, '-*testing*-')
+
+calls = []
+
+class OrderTransformer(Transformer):
+    name = TransformerField(
+        'name',
+        filters=[lambda value: calls.append('filter') or value.upper()],
+        actions=[lambda value: calls.append(('action', value))]
+    )
+
+class TestSetValues(unittest.TestCase):
+    def test_filters_before_actions(self):
+        """
+        Test that actions run after the filters of
+        a field, with the value from the source row
+        """
+        transformer = OrderTransformer()
+        transformer.set_values({'name': 'bobby'})
+        self.assertEqual(['filter', ('action', 'bobby')], calls)
+        self.assertEqual('BOBBY', transformer.name)
+
+@batch_filter
+def upper_column(values):
+    return [value.upper() for value in values]
+
+class ShoutTransformer(Transformer):
+    name = TransformerField('name', filters=[filter_1, upper_column])
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+
+class LowerShoutTransformer(Transformer):
+    name = TransformerField('name', filters=[str.lower, upper_column])
+
+class TestBatchFilters(unittest.TestCase):
+    def test_applying_batch_filter_to_value(self):
+        """
+        Test that batch filters are applied to a single
+        value in the order they are declared
+        """
+        field = Field('test', filters=[filter_1, upper_column])
+        self.assertEqual(field.apply_filters('testing'), '-*TESTING')
+
+    def test_applying_batch_filter_to_chunk(self):
+        """
+        Test that batch filters applied to a chunk of
+        rows are picked up by set_values
+        """
+        rows = [{'name': 'bobby'}, {'name': 'alice'}]
+        manager = Manager()
+        manager.apply_batch_filters(ShoutTransformer(), rows)
+        # Filtered values are kept out of the source rows
+        self.assertEqual([{'name': 'bobby'}, {'name': 'alice'}], rows)
+
+        transformer = ShoutTransformer()
+        manager.set_values(transformer, rows[1])
+        self.assertEqual('-*ALICE', transformer.name)
+
+        # Rows that did not go through a chunk
+        # are filtered one value at a time
+        manager.set_values(transformer, {'name': 'carol'})
+        self.assertEqual('-*CAROL', transformer.name)
+
+    def test_filter_order(self):
+        """
+        Test that filters run in the order they are declared
+        whether the value is filtered alone or in a chunk
+        """
+        field = Field('test', filters=[str.lower, upper_column])
+        self.assertEqual('ALICE', field.apply_filters('Alice'))
+
+        rows = [{'name': 'Alice'}]
+        manager = Manager()
+        manager.apply_batch_filters(LowerShoutTransformer(), rows)
+        transformer = LowerShoutTransformer()
+        manager.set_values(transformer, rows[0])
+        self.assertEqual('ALICE', transformer.name)
+        transformer.set_values({'name': 'Bob'})
+        self.assertEqual('BOB', transformer.name)
+
+
+class LowerField(TransformerField):
+    def transform(self, transformer):
+        transformer.nickname = transformer.nickname.lower()
+        return transformer
+
+seen = []
+
+class ProfiledTransformer(Transformer):
+    name = TransformerField(
+        'name', filters=[filter_1, upper_column], actions=[seen.append]
+    )
+    nickname = LowerField('nickname')
+
+    class Meta:
+        source_table = 'author'
+        destination_table = 'new_author'
+
+class TestProfiler(unittest.TestCase):
+    def test_profiling_fields(self):
+        """
+        Test that filters, batch filters, actions and Field.transform
+        overrides are timed per transformer and field
+        """
+        class DB:
+            def insert_single(self, table, row):
+                self.row = row
+                return {'id': 1}
+
+        db = DB()
+        profiler = Profiler()
+        manager = Manager(DB(), db, profiler=profiler)
+        for name in ['bobby', 'alice']:
+            manager.transform(
+                ProfiledTransformer(), {'name': name, 'nickname': 'ALI'}
+            )
+        self.assertEqual({'name': '-*ALICE', 'nickname': 'ali'}, db.row)
+
+        stats = dict(
+            ((stat['field'], stat['kind']), stat) for stat in profiler.stats()
+        )
+        self.assertEqual(
+            [('name', 'action'), ('name', 'batch_filter'), ('name', 'filter'), ('nickname', 'transform')],
+            sorted(stats)
+        )
+        self.assertEqual('filter_1', stats[('name', 'filter')]['function'])
+        self.assertEqual(2, stats[('nickname', 'transform')]['calls'])
+        self.assertLessEqual(
+            stats[('name', 'filter')]['p50'], stats[('name', 'filter')]['p99']
+        )